@@ -0,0 +1,143 @@
+"""
+Compare the streaming ICS reader with icalendar on a generated calendar.
+
+    cd api && python benchmarks/ics_parse.py [--events 10000]
+
+Each parser runs in its own interpreter so peak RSS is not shared between
+them. The icalendar run reproduces the previous code path: the whole body in
+memory, a component tree, then a walk over its VEVENTs.
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytz
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+SUBJECTS = ["Réseaux", "Anglais", "Mathématiques", "Systèmes d'exploitation", "Bases de données"]
+
+
+def write_calendar(path: Path, events: int) -> None:
+    start = datetime(2024, 9, 2, 8)
+    fmt = "%Y%m%dT%H%M%SZ"
+    with path.open("w", encoding="utf-8", newline="") as f:
+        f.write("BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//benchmark//EN\r\n")
+        for i in range(events):
+            dtstart = start + timedelta(hours=2 * (i % 5), days=i // 5)
+            description = (
+                f"Matière : {SUBJECTS[i % len(SUBJECTS)]}\\nEnseignant : M. Dupont\\nType : TD\\n"
+                "Salle : B204\\nRemarque : apporter le support de cours imprimé et les exercices de la semaine"
+            )
+            f.write(
+                "BEGIN:VEVENT\r\n"
+                f"UID:Cours-{i}-hyperplanning@school.fr\r\n"
+                f"DTSTAMP:{start.strftime(fmt)}\r\n"
+                f"LAST-MODIFIED:{start.strftime(fmt)}\r\n"
+                "SEQUENCE:0\r\n"
+                f"SUMMARY:{SUBJECTS[i % len(SUBJECTS)]} - TD\r\n"
+                "LOCATION:B204\r\n"
+                # Folded at 75 octets like real feeds
+                f"DESCRIPTION:{description[:60]}\r\n {description[60:]}\r\n"
+                "CATEGORIES:HYPERPLANNING\r\n"
+                f"DTSTART:{dtstart.strftime(fmt)}\r\n"
+                f"DTEND:{(dtstart + timedelta(hours=2)).strftime(fmt)}\r\n"
+                "END:VEVENT\r\n"
+            )
+        f.write("END:VCALENDAR\r\n")
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_icalendar(path: Path) -> int:
+    from icalendar import Calendar
+
+    from course_index import CourseEvent, CourseIndex
+
+    tz = pytz.timezone("Europe/Paris")
+    content = path.read_bytes()
+    events = []
+    for component in Calendar.from_ical(content).walk("VEVENT"):
+        fields = {
+            "uid": str(component.get("uid")),
+            "summary": str(component.get("summary")),
+            "location": str(component.get("location", "")),
+            "description": str(component.get("description", "")),
+            "dtstart": component.get("dtstart").dt,
+            "dtend": component.get("dtend").dt,
+            "sequence": int(component.get("sequence", 0)),
+            "last_modified": component.get("last-modified").dt,
+        }
+        events.append(CourseEvent.from_fields(fields, tz))
+    return len(CourseIndex(events))
+
+
+def run_streaming(path: Path) -> int:
+    from course_index import CourseIndex
+
+    with path.open("rb") as f:
+        return len(CourseIndex.from_lines(f))
+
+
+PARSERS = {"icalendar": run_icalendar, "streaming": run_streaming}
+
+
+def measure(parser: str, path: Path) -> dict:
+    """Run one parser in this process and return its figures (used by the child processes)."""
+    import icalendar  # noqa: F401  imported by both runs so the baseline RSS is comparable
+
+    import course_index  # noqa: F401
+
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    events = PARSERS[parser](path)
+    return {
+        "parser": parser,
+        "events": events,
+        "seconds": time.perf_counter() - start,
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_rss_growth_mb": peak_rss_mb() - baseline,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--events", type=int, default=10_000)
+    parser.add_argument("--child", choices=PARSERS, help=argparse.SUPPRESS)
+    parser.add_argument("--path", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child, args.path)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "calendar.ics"
+        write_calendar(path, args.events)
+        print(f"{args.events} events, {path.stat().st_size / 1024 / 1024:.1f} MB\n")
+        print(f"{'parser':<12}{'events':>8}{'time (s)':>10}{'peak RSS (MB)':>15}{'growth (MB)':>13}")
+        for name in PARSERS:
+            output = subprocess.run(
+                [sys.executable, __file__, "--child", name, "--path", str(path)],
+                capture_output=True, text=True, check=True,
+            ).stdout
+            r = json.loads(output.strip().splitlines()[-1])
+            print(
+                f"{r['parser']:<12}{r['events']:>8}{r['seconds']:>10.2f}"
+                f"{r['peak_rss_mb']:>15.1f}{r['peak_rss_growth_mb']:>13.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+Shared cache of the Hyperplanning ICS calendars.
+Downloads and parses each calendar into a CourseIndex once per TTL for every route,
+revalidates it with conditional GETs and keeps serving the last good copy if the
+upstream is down. Several calendars are fetched concurrently and merged, a slow or
+failing one only costs its own courses. A background task started at app startup
+keeps them warm so that requests never wait on the school's server.
+"""
+
+import asyncio
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from urllib.parse import urlparse
+
+import requests
+
+from config import get_settings
+from course_index import CourseIndex, sync_courses
+from logger import setup_logger
+
+settings = get_settings()
+logger = setup_logger("calendar_cache")
+
+# First retry delay after a failed background refresh, doubled on each failure
+REFRESH_BACKOFF_BASE = 5.0
+
+SESSION = requests.Session()
+SESSION.headers.update({"User-Agent": settings.user_agent})
+
+# Calendars are fetched with requests in these threads, one per feed
+FETCH_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="calendar")
+
+
+@dataclass
+class CalendarEntry:
+    courses: CourseIndex
+    etag: str | None = None
+    last_modified: str | None = None
+    fetched_at: float = 0.0  # last 200 response (monotonic)
+    checked_at: float = 0.0  # last successful 200 or 304 (monotonic)
+    expires_at: float = 0.0  # next upstream check, also pushed back after a failure
+    parse_seconds: float = 0.0
+    last_error: str | None = None
+
+
+class CalendarCache:
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries: dict[str, CalendarEntry] = {}
+        self._locks: dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        self._merged: tuple[tuple[CourseIndex, ...], CourseIndex] | None = None
+        # Set while refresh_periodically() runs: expired entries are then served
+        # as-is (stale-while-revalidate) since the refresher is already on it.
+        self.background_refresh = False
+
+    def get(self, url: str) -> CourseIndex:
+        """Return the parsed courses at `url`, fetching them only when the TTL expired."""
+        entry = self._entries.get(url)
+        if entry and (self.background_refresh or time.monotonic() < entry.expires_at):
+            return entry.courses
+
+        # A lock per calendar makes concurrent requests wait for one download
+        # instead of each starting their own, without serializing calendars.
+        with self._lock(url):
+            entry = self._entries.get(url)
+            if entry and time.monotonic() < entry.expires_at:
+                return entry.courses
+
+            try:
+                return self._refresh_locked(url).courses
+            except (requests.RequestException, ValueError) as e:
+                if entry is None:
+                    raise
+                logger.warning(f"Calendar fetch failed, serving stale copy: {e}")
+                entry.expires_at = time.monotonic() + self.ttl
+                return entry.courses
+
+    def get_many(self, urls: list[str], timeout: float) -> tuple[CourseIndex, dict[str, str]]:
+        """Fetch the calendars at `urls` concurrently and merge their courses.
+
+        Returns the merged courses and an error message per calendar that
+        failed or did not answer within `timeout` seconds; a slow calendar
+        still contributes its last good copy. Raises if no calendar has any.
+        """
+        if len(urls) == 1:
+            return self.get(urls[0]), {}
+
+        futures = {url: FETCH_POOL.submit(self.get, url) for url in urls}
+        done, _ = wait(futures.values(), timeout=timeout)
+
+        indexes, errors = [], {}
+        first_error = None
+        for url, future in futures.items():
+            if future in done:
+                try:
+                    indexes.append(future.result())
+                    continue
+                except Exception as e:
+                    errors[url] = str(e)
+                    first_error = first_error or e
+            else:
+                # Left running: the download still fills the cache for the next call
+                errors[url] = f"No response within {timeout:.0f}s"
+                first_error = first_error or TimeoutError(errors[url])
+                entry = self._entries.get(url)
+                if entry:
+                    indexes.append(entry.courses)
+
+        if not indexes:
+            raise first_error
+
+        for url, error in errors.items():
+            logger.warning(f"Calendar {urlparse(url).hostname} unavailable: {error}")
+        return self._merge(indexes), errors
+
+    def _merge(self, indexes: list[CourseIndex]) -> CourseIndex:
+        # A 304 keeps the same CourseIndex objects, so the merge is reused until one changes
+        key = tuple(indexes)
+        if self._merged is None or self._merged[0] != key:
+            self._merged = (key, CourseIndex.merge(indexes))
+        return self._merged[1]
+
+    def refresh(self, url: str) -> CourseIndex:
+        """Revalidate the calendar at `url` now, whatever its TTL."""
+        with self._lock(url):
+            return self._refresh_locked(url).courses
+
+    def _lock(self, url: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(url, threading.Lock())
+
+    def _refresh_locked(self, url: str) -> CalendarEntry:
+        entry = self._entries.get(url)
+        try:
+            entry = self._fetch(url, entry)
+        # ValueError: a 200 whose body isn't a whole calendar, never stored over the last good one
+        except (requests.RequestException, ValueError) as e:
+            if entry is not None:
+                entry.last_error = str(e)
+            raise
+
+        self._entries[url] = entry
+        return entry
+
+    def _fetch(self, url: str, entry: CalendarEntry | None) -> CalendarEntry:
+        headers = {}
+        if entry and entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry and entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+
+        # Streamed: the body is parsed while it downloads and never held whole
+        with SESSION.get(url, headers=headers, timeout=settings.api_timeout, stream=True) as response:
+            now = time.monotonic()
+
+            if response.status_code == 304 and entry:
+                logger.info("Calendar not modified upstream")
+                entry.checked_at = now
+                entry.expires_at = now + self.ttl
+                entry.last_error = None
+                return entry
+
+            response.raise_for_status()
+
+            start = time.perf_counter()
+            courses = CourseIndex.from_lines(response.iter_lines())
+            parse_seconds = time.perf_counter() - start
+            logger.info(f"Calendar downloaded ({len(courses)} events parsed in {parse_seconds:.3f}s)")
+
+        try:
+            sync_courses(courses, feed=url)
+        except Exception as e:
+            logger.error(f"Failed to store courses: {e}")
+
+        return CalendarEntry(
+            courses=courses,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+            fetched_at=now,
+            checked_at=now,
+            expires_at=now + self.ttl,
+            parse_seconds=parse_seconds,
+        )
+
+    def status(self, url: str) -> dict:
+        entry = self._entries.get(url)
+        if entry is None:
+            return {"cached": False}
+
+        now = time.monotonic()
+        return {
+            "cached": True,
+            "events": len(entry.courses),
+            "last_fetch_age_seconds": round(now - entry.fetched_at, 1),
+            "last_check_age_seconds": round(now - entry.checked_at, 1),
+            "parse_time_ms": round(entry.parse_seconds * 1000, 1),
+            "background_refresh": self.background_refresh,
+            "stale": entry.last_error is not None or now - entry.checked_at >= self.ttl,
+            "etag": entry.etag,
+            "last_modified": entry.last_modified,
+            "last_error": entry.last_error,
+        }
+
+    def clear(self) -> None:
+        with self._locks_guard:
+            self._entries.clear()
+            self._merged = None
+
+
+calendar_cache = CalendarCache(ttl=settings.hyperplanning_cache_ttl)
+
+
+async def refresh_periodically(urls: list[str]) -> None:
+    """Refresh the calendars at `urls` every TTL, backing off with jitter on failures."""
+    calendar_cache.background_refresh = True
+    failures = 0
+    try:
+        while True:
+            try:
+                results = await asyncio.gather(
+                    *(asyncio.to_thread(calendar_cache.refresh, url) for url in urls),
+                    return_exceptions=True,
+                )
+                errors = [r for r in results if isinstance(r, Exception)]
+                if errors:
+                    raise errors[0]
+                failures = 0
+                delay = calendar_cache.ttl * random.uniform(0.9, 1.1)
+            except Exception as e:
+                failures += 1
+                backoff = min(calendar_cache.ttl, REFRESH_BACKOFF_BASE * 2 ** (failures - 1))
+                delay = random.uniform(backoff / 2, backoff)
+                logger.warning(f"Background calendar refresh failed ({failures}x), retrying in {delay:.0f}s: {e}")
+            await asyncio.sleep(delay)
+    finally:
+        calendar_cache.background_refresh = False
@@ -1,8 +1,30 @@
 import secrets
 from functools import lru_cache
 
+from pydantic import BaseModel, field_validator
 from pydantic_settings import BaseSettings
 
+# Keys of /email/summary next to the per-account counts
+RESERVED_MAIL_ACCOUNTS = {"total", "stale"}
+
+
+class MailAccountSettings(BaseModel):
+    """An IMAP account read alongside the Proton Bridge."""
+    name: str  # its key in /email/summary and the aggregated feed, e.g. "outlook"
+    host: str
+    port: int = 993
+    user: str
+    password: str
+    ssl: bool = True  # IMAP over TLS, otherwise plain IMAP upgraded with STARTTLS when offered
+    timeout: float | None = None  # seconds, MAIL_ACCOUNT_TIMEOUT when unset
+
+    @field_validator("name")
+    @classmethod
+    def validate_name(cls, v: str) -> str:
+        if not v or v in RESERVED_MAIL_ACCOUNTS:
+            raise ValueError(f"Mail account name must be set and not one of: {RESERVED_MAIL_ACCOUNTS}")
+        return v
+
 
 class Settings(BaseSettings):
     app_name: str = "AutoDesk Kiwi API"
@@ -20,10 +42,42 @@ class Settings(BaseSettings):
         "http://localhost:8000"
     ]
 
+    # Timezone used to bucket completions and courses into days
+    user_timezone: str = "Europe/Paris"
+
     user_agent: str = "AutoDeskKiwi/1.0 (kiwi-app-local-dev)"
     api_timeout: float = 12.0
 
     hyperplanning_url: str = ""
+    # Extra calendars (group, exams...) merged with hyperplanning_url
+    hyperplanning_urls: list[str] = []
+    # Seconds a fetched calendar is served before being revalidated upstream
+    hyperplanning_cache_ttl: float = 300.0
+    # Keep the calendar warm from a background task instead of on first request
+    hyperplanning_background_refresh: bool = True
+
+    # Logged-in IMAP sessions kept open for the email routes
+    mail_pool_size: int = 4
+    # Seconds an unused IMAP session stays open before being logged out
+    mail_pool_idle_timeout: float = 300.0
+    # Seconds the cached mail listing is served before asking the server for changes
+    mail_sync_interval: float = 15.0
+    # Bytes of each text part downloaded to display a message
+    mail_body_max_bytes: int = 256_000
+    # Seconds folder counts from STATUS are reused before asking the server again
+    mail_status_ttl: float = 5.0
+    # Index cached mail for full-text search from a background thread
+    mail_search_indexing: bool = True
+    # Messages whose text is fetched per indexing batch
+    mail_index_batch_size: int = 50
+    # Messages indexed per second at most, leaving the Bridge to the requests
+    mail_index_rate: float = 20.0
+    # IMAP accounts read alongside the Proton Bridge (Outlook, school...)
+    mail_accounts: list[MailAccountSettings] = []
+    # Accounts refreshed at once by the aggregated mail routes
+    mail_fetch_workers: int = 4
+    # Seconds the aggregated mail routes wait for an account before using its cached values
+    mail_account_timeout: float = 5.0
 
     # JWT Authentication settings
     jwt_secret_key: str = secrets.token_urlsafe(32)  # Auto-generate if not set
@@ -40,6 +94,19 @@ class Settings(BaseSettings):
         "extranet-hp-cgy.ensup.eu"
     ]
 
+    @field_validator("mail_accounts")
+    @classmethod
+    def validate_mail_accounts(cls, v: list[MailAccountSettings]) -> list[MailAccountSettings]:
+        names = ["proton", *(account.name for account in v)]
+        if len(set(names)) != len(names):
+            raise ValueError("Mail account names must be unique, and not proton (the Bridge)")
+        return v
+
+    @property
+    def calendar_urls(self) -> list[str]:
+        """hyperplanning_url followed by hyperplanning_urls, without blanks or duplicates."""
+        return list(dict.fromkeys(url for url in [self.hyperplanning_url, *self.hyperplanning_urls] if url))
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
@@ -0,0 +1,335 @@
+"""
+Pre-parsed Hyperplanning courses.
+Every VEVENT is streamed once into a compact CourseEvent, sorted by start time and
+indexed by local date, so lookups use bisect instead of walking the calendar.
+Each download is diffed against the Course table, so only added, moved or
+cancelled events are written, and every such change lands in CourseChange.
+Several calendars are merged into one index, each is stored under its own feed.
+"""
+
+import threading
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from collections.abc import Iterable
+from datetime import date, datetime, timedelta
+from heapq import merge
+from itertools import repeat
+from urllib.parse import urlparse
+
+import pytz
+from sqlalchemy import delete, insert, not_, or_, update
+from sqlmodel import select
+
+from config import get_settings
+from db import get_session
+from ics_stream import iter_vevents
+from logger import setup_logger
+from models import Course, CourseChange
+
+settings = get_settings()
+logger = setup_logger("course_index")
+
+# Fields that make a course different to the user, compared when diffing
+COURSE_FIELDS = ("subject", "start", "end", "room", "teacher", "type", "all_day")
+
+
+def _description_field(description: str, label: str, default: str) -> str:
+    if label in description:
+        parts = description.split(label)
+        if len(parts) > 1:
+            return parts[1].split("\n")[0].strip()
+    return default
+
+
+class CourseEvent:
+    __slots__ = (
+        "uid", "subject", "room", "teacher", "type", "start", "end", "all_day",
+        "sequence", "last_modified",
+    )
+
+    def __init__(self, uid, subject, room, teacher, type, start, end, all_day, sequence=0, last_modified=None):
+        self.uid: str = uid
+        self.subject: str = subject
+        self.room: str = room
+        self.teacher: str = teacher
+        self.type: str = type
+        self.start: datetime = start  # aware, in the user's timezone
+        self.end: datetime = end
+        self.all_day: bool = all_day
+        self.sequence: int = sequence
+        self.last_modified: datetime | None = last_modified  # aware
+
+    @classmethod
+    def from_fields(cls, fields: dict, tz) -> "CourseEvent":
+        """Build an event from the VEVENT properties yielded by ics_stream.iter_vevents."""
+        description = fields.get('description', '')
+        dtstart = fields['dtstart']
+        dtend = fields.get('dtend', dtstart)
+
+        all_day = not isinstance(dtstart, datetime)
+        if all_day:
+            if dtend == dtstart:
+                dtend = dtstart + timedelta(days=1)
+            dtstart = tz.localize(datetime.combine(dtstart, datetime.min.time()))
+            dtend = tz.localize(datetime.combine(dtend, datetime.min.time()))
+        else:
+            if dtstart.tzinfo is None:
+                dtstart = pytz.UTC.localize(dtstart)
+            if dtend.tzinfo is None:
+                dtend = pytz.UTC.localize(dtend)
+            dtstart = dtstart.astimezone(tz)
+            dtend = dtend.astimezone(tz)
+
+        last_modified = fields.get('last_modified')
+        if last_modified is not None and last_modified.tzinfo is None:
+            last_modified = pytz.UTC.localize(last_modified)
+
+        return cls(
+            uid=fields.get('uid', 'None'),
+            subject=fields.get('summary', 'None'),
+            room=fields.get('location', ''),
+            teacher=_description_field(description, "Enseignant :", "Inconnu"),
+            type=_description_field(description, "Type :", "Cours"),
+            start=dtstart,
+            end=dtend,
+            all_day=all_day,
+            sequence=fields.get('sequence', 0),
+            last_modified=last_modified,
+        )
+
+    @classmethod
+    def from_row(cls, row: Course, tz) -> "CourseEvent":
+        return cls(
+            uid=row.uid,
+            subject=row.subject,
+            room=row.room,
+            teacher=row.teacher,
+            type=row.type,
+            start=pytz.UTC.localize(row.start).astimezone(tz),
+            end=pytz.UTC.localize(row.end).astimezone(tz),
+            all_day=row.all_day,
+            sequence=row.sequence,
+            last_modified=pytz.UTC.localize(row.last_modified) if row.last_modified else None,
+        )
+
+    def to_row(self) -> dict:
+        return {
+            "uid": self.uid,
+            "subject": self.subject,
+            "start": self.start.astimezone(pytz.UTC).replace(tzinfo=None),
+            "end": self.end.astimezone(pytz.UTC).replace(tzinfo=None),
+            "room": self.room,
+            "teacher": self.teacher,
+            "type": self.type,
+            "all_day": self.all_day,
+            "sequence": self.sequence,
+            "last_modified": (
+                self.last_modified.astimezone(pytz.UTC).replace(tzinfo=None) if self.last_modified else None
+            ),
+        }
+
+    @property
+    def hours(self) -> float:
+        return (self.end - self.start).total_seconds() / 3600
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.uid,
+            "subject": self.subject,
+            "start": "Toute la journée" if self.all_day else self.start.strftime("%H:%M"),
+            "end": "" if self.all_day else self.end.strftime("%H:%M"),
+            "room": self.room,
+            "teacher": self.teacher,
+            "type": self.type,
+            "raw_start": self.start.isoformat(),
+            "raw_end": self.end.isoformat(),
+        }
+
+
+class HourTotals:
+    """Course hours per subject, type and teacher, split into done and planned.
+
+    Totals are summed once when the index is built. Courses are kept sorted by
+    end so that advance(now) only adds the courses that finished since the
+    previous call to the done side.
+    """
+
+    DIMENSIONS = ("subject", "type", "teacher")
+
+    def __init__(self, events: list[CourseEvent]):
+        self._by_end = sorted((e for e in events if not e.all_day), key=lambda e: e.end)
+        self._cursor = 0  # courses before it have ended
+        self._lock = threading.Lock()
+        self.total = {dim: defaultdict(float) for dim in self.DIMENSIONS}
+        self.done = {dim: defaultdict(float) for dim in self.DIMENSIONS}
+        for event in self._by_end:
+            for dim in self.DIMENSIONS:
+                self.total[dim][getattr(event, dim)] += event.hours
+
+    def advance(self, now: datetime) -> None:
+        with self._lock:
+            while self._cursor < len(self._by_end) and self._by_end[self._cursor].end < now:
+                event = self._by_end[self._cursor]
+                for dim in self.DIMENSIONS:
+                    self.done[dim][getattr(event, dim)] += event.hours
+                self._cursor += 1
+
+    def breakdown(self, dim: str, now: datetime) -> list[dict]:
+        """Done, planned and total hours per value of `dim`, largest total first."""
+        self.advance(now)
+        done = self.done[dim]
+        stats = [
+            {
+                dim: name,
+                "done": round(done[name], 1),
+                "planned": round(max(total - done[name], 0.0), 1),
+                "total": round(total, 1),
+            }
+            for name, total in self.total[dim].items()
+        ]
+        stats.sort(key=lambda x: x['total'], reverse=True)
+        return stats
+
+
+class CourseIndex:
+    """Courses sorted by start, with the index range of each local date."""
+
+    def __init__(self, events: list[CourseEvent]):
+        self.events = sorted(events, key=lambda e: e.start)
+        self._starts = [e.start for e in self.events]
+
+        # Events are sorted, so the courses of a day are one contiguous slice
+        self._day_ranges: dict[date, tuple[int, int]] = {}
+        for i, event in enumerate(self.events):
+            day = event.start.date()
+            lo, _ = self._day_ranges.get(day, (i, i))
+            self._day_ranges[day] = (lo, i + 1)
+        self._days = sorted(self._day_ranges)
+        self.hours = HourTotals(self.events)
+
+    @classmethod
+    def from_lines(cls, lines: Iterable[bytes]) -> "CourseIndex":
+        """Parse an ICS body line by line, e.g. straight from Response.iter_lines()."""
+        tz = pytz.timezone(settings.user_timezone)
+        return cls([
+            CourseEvent.from_fields(fields, tz)
+            for fields in iter_vevents(lines, default_tz=tz)
+            if 'dtstart' in fields
+        ])
+
+    @classmethod
+    def from_ical(cls, content: bytes) -> "CourseIndex":
+        return cls.from_lines(content.splitlines())
+
+    @classmethod
+    def merge(cls, indexes: list["CourseIndex"]) -> "CourseIndex":
+        """K-way merge of several calendars' sorted events, a course found in several feeds kept once.
+
+        A course is its (uid, start): the occurrences of a recurring event share
+        their uid, and only copies coming from another feed are dropped.
+        """
+        if len(indexes) == 1:
+            return indexes[0]
+        feeds: dict[tuple[str, datetime], int] = {}  # (uid, start) -> feed it was first seen in
+        events = []
+        feed_events = [zip(index.events, repeat(feed)) for feed, index in enumerate(indexes)]
+        for event, feed in merge(*feed_events, key=lambda pair: pair[0].start):
+            if feeds.setdefault((event.uid, event.start), feed) == feed:
+                events.append(event)
+        return cls(events)
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def courses_on(self, day: date) -> list[CourseEvent]:
+        lo, hi = self._day_ranges.get(day, (0, 0))
+        return self.events[lo:hi]
+
+    def first_day_with_courses(self, start: date, days: int) -> date | None:
+        """First local date in [start, start + days) that has courses."""
+        i = bisect_left(self._days, start)
+        if i < len(self._days) and self._days[i] < start + timedelta(days=days):
+            return self._days[i]
+        return None
+
+    def upcoming(self, after: datetime, limit: int) -> list[CourseEvent]:
+        """The next `limit` courses starting strictly after `after`."""
+        i = bisect_right(self._starts, after)
+        return self.events[i:i + limit]
+
+
+def _json_value(value):
+    return pytz.UTC.localize(value).isoformat() if isinstance(value, datetime) else value
+
+
+def sync_courses(index: CourseIndex, feed: str) -> dict[str, int]:
+    """Apply a downloaded calendar to the Course table as a diff against the stored events.
+
+    An event whose SEQUENCE and LAST-MODIFIED both match the stored row is
+    skipped without comparing fields; otherwise its fields are compared. Writes
+    and CourseChange entries are limited to the events that actually changed.
+    Only the rows of `feed` are considered, a uid already stored by another
+    calendar is left to it. Past courses missing from the download are kept.
+    """
+    # Several VEVENTs may share a uid (recurrences), the last one wins
+    incoming = {event.uid: {**event.to_row(), "feed": feed} for event in index.events}
+    columns = [getattr(Course, c) for c in ("uid", "sequence", "last_modified", "feed", *COURSE_FIELDS)]
+
+    with get_session() as session:
+        # Rows from before multi-calendar support have no feed, the first calendar adopts them
+        own_feed = or_(Course.feed == feed, Course.feed.is_(None))
+        stored = {row.uid: row._asdict() for row in session.exec(select(*columns).where(own_feed)).all()}
+        other_feeds = set(session.exec(select(Course.uid).where(not_(own_feed))).all())
+        initial_import = not stored
+
+        added, updated, changes = [], [], []
+        for uid, row in incoming.items():
+            old = stored.get(uid)
+            if old is None:
+                if uid in other_feeds:
+                    continue
+                added.append(row)
+                changes.append({"uid": uid, "kind": "added", "subject": row["subject"], "start": row["start"], "changes": {}})
+                continue
+
+            if (
+                row["last_modified"] is not None
+                and row["sequence"] == old["sequence"]
+                and row["last_modified"] == old["last_modified"]
+                and old["feed"] == feed
+            ):
+                continue
+
+            diff = {
+                field: [_json_value(old[field]), _json_value(row[field])]
+                for field in COURSE_FIELDS
+                if old[field] != row[field]
+            }
+            if diff or any(row[c] != old[c] for c in ("sequence", "last_modified", "feed")):
+                updated.append(row)
+            if diff:
+                changes.append({"uid": uid, "kind": "updated", "subject": row["subject"], "start": row["start"], "changes": diff})
+
+        # Feeds only cover a window of dates: courses that already ended and
+        # dropped out of it are history, only upcoming ones can be cancelled.
+        now = datetime.now(pytz.UTC).replace(tzinfo=None)
+        cancelled = [uid for uid, old in stored.items() if uid not in incoming and old["end"] > now]
+        for uid in cancelled:
+            old = stored[uid]
+            changes.append({"uid": uid, "kind": "cancelled", "subject": old["subject"], "start": old["start"], "changes": {}})
+
+        if added:
+            session.exec(insert(Course), params=added)
+        for row in updated:
+            session.exec(update(Course).where(Course.uid == row["uid"]).values(**row))
+        if cancelled:
+            session.exec(delete(Course).where(Course.uid.in_(cancelled)))
+
+        # The first download is not news, only log changes against a known schedule
+        if changes and not initial_import:
+            detected_at = datetime.now(pytz.UTC).replace(tzinfo=None)
+            session.exec(insert(CourseChange), params=[{**c, "detected_at": detected_at} for c in changes])
+
+    counts = {"added": len(added), "updated": len(updated), "cancelled": len(cancelled)}
+    logger.info(f"Courses synced from {urlparse(feed).hostname}: {counts}")
+    return counts
@@ -1,6 +1,7 @@
 from contextlib import contextmanager
 
-from sqlmodel import Session, SQLModel, create_engine
+from sqlalchemy import bindparam, func, insert, inspect, text, update
+from sqlmodel import Session, SQLModel, create_engine, select
 
 from config import get_settings
 
@@ -15,10 +16,74 @@ engine = create_engine(
 def init_db() -> None:
     """Initialize database and create all tables."""
     # Import all models to ensure they are registered with SQLModel
-    from models import Grade, Task  # noqa: F401
+    from models import Course, CourseChange, Grade, MailFolder, MailHeader, MailThread, MailThreadRef, OutboxMessage, Task, TaskTag  # noqa: F401
     from auth import User  # noqa: F401
 
     SQLModel.metadata.create_all(engine)
+    _add_missing_columns()
+
+    # create_all() skips indexes on tables that already exist, so indexes added
+    # to a model after the database was first created are created here.
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+    # FTS5 virtual tables aren't SQLModel models, mail_search creates its own
+    from mail_search import create_search_table
+    create_search_table()
+
+    _backfill_task_tags()
+    _backfill_completed_local_date()
+
+
+def _add_missing_columns() -> None:
+    """Add columns declared on models but missing from tables created by older versions."""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+
+
+def _backfill_task_tags() -> None:
+    """Populate the TaskTag table for databases created before it existed."""
+    from models import Task, TaskTag
+
+    with get_session() as session:
+        if session.exec(select(func.count()).select_from(TaskTag)).one():
+            return
+
+        # Plain rows rather than ORM objects, this runs once over every task
+        tagged = session.exec(
+            select(
+                Task.id, Task.parent_id, Task.tags, Task.status,
+                Task.due_date, Task.created_at, Task.completed_at,
+            ).where(Task.parent_id.is_(None), Task.tags.is_not(None))
+        ).all()
+        rows = [row for task in tagged for row in TaskTag.rows_for(task)]
+        for i in range(0, len(rows), 1000):
+            session.exec(insert(TaskTag), params=rows[i:i + 1000])
+
+
+def _backfill_completed_local_date() -> None:
+    """Compute the local completion day of tasks completed before the column existed."""
+    from models import Task, local_date
+
+    with get_session() as session:
+        missing = session.exec(
+            select(Task.id, Task.completed_at)
+            .where(Task.completed_at.is_not(None), Task.completed_local_date.is_(None))
+        ).all()
+        if missing:
+            table = Task.__table__
+            session.exec(
+                update(table).where(table.c.id == bindparam("task_id")).values(completed_local_date=bindparam("day")),
+                params=[{"task_id": task_id, "day": local_date(completed_at)} for task_id, completed_at in missing],
+            )
+
 
 @contextmanager
 def get_session():
@@ -0,0 +1,184 @@
+"""
+Streaming import of grade histories.
+Reads an NDJSON or CSV upload as it arrives, validates it row by row and writes
+valid grades in chunked transactions, reporting progress as NDJSON lines. Memory
+use does not depend on the file size.
+"""
+
+import asyncio
+import codecs
+import csv
+import json
+import tempfile
+from collections.abc import AsyncIterator
+from datetime import datetime
+
+import pytz
+from pydantic import ValidationError
+from sqlalchemy import delete, insert
+
+from db import get_session
+from grade_stats import invalidate_grade_summary
+from logger import setup_logger
+from models import Grade, GradeCreate
+
+logger = setup_logger("grade_import")
+
+# Rows per executemany batch, and per transaction for streamed imports
+GRADE_CHUNK_SIZE = 500
+# Rejected rows reported in one progress line before it is flushed
+ERRORS_PER_PROGRESS = 100
+# Uploads larger than this are spooled to a temporary file instead of memory
+SPOOL_MAX_MEMORY = 1024 * 1024
+READ_SIZE = 64 * 1024
+
+
+def insert_grades(session, rows: list[dict]) -> int:
+    """Insert grade rows with chunked executemany, in the caller's transaction."""
+    created_at = datetime.now(pytz.UTC)
+    for i in range(0, len(rows), GRADE_CHUNK_SIZE):
+        chunk = rows[i:i + GRADE_CHUNK_SIZE]
+        session.exec(insert(Grade), params=[{**row, "created_at": created_at} for row in chunk])
+    return len(rows)
+
+
+async def spool(chunks: AsyncIterator[bytes]) -> tempfile.SpooledTemporaryFile:
+    """Copy an upload to a spooled temporary file, rewound for reading.
+
+    The request body has to be read before the streamed response starts, the
+    ASGI middlewares do not deliver it to a response generator.
+    """
+    body = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)  # noqa: SIM115  closed by the route
+    async for chunk in chunks:
+        body.write(chunk)
+    body.seek(0)
+    return body
+
+
+async def read_chunks(body) -> AsyncIterator[bytes]:
+    while chunk := body.read(READ_SIZE):
+        yield chunk
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Split a byte stream into decoded lines, whatever the chunk boundaries."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    buffer += decoder.decode(b"", final=True)
+    if buffer.strip():
+        yield buffer.rstrip("\r")
+
+
+class RowParser:
+    """Turns one line of an NDJSON or CSV upload into a grade dict."""
+
+    def __init__(self, fmt: str):
+        self.fmt = fmt
+        self.columns: list[str] | None = None
+        self.delimiter = ","
+
+    def parse(self, line: str) -> dict | None:
+        """Return the raw row, or None for blank and header lines. Raises ValueError."""
+        if not line.strip():
+            return None
+        if self.fmt == "ndjson":
+            row = json.loads(line)
+            if not isinstance(row, dict):
+                raise ValueError("Each line must be a JSON object")
+            return row
+
+        if self.columns is None:
+            # French spreadsheets export with ';' and decimal commas
+            self.delimiter = ";" if line.count(";") > line.count(",") else ","
+            columns = [c.strip().lower() for c in next(csv.reader([line], delimiter=self.delimiter))]
+            missing = {"subject", "date", "value"} - set(columns)
+            if missing:
+                raise ValueError(f"Missing CSV column(s): {', '.join(sorted(missing))}")
+            self.columns = columns
+            return None
+
+        values = next(csv.reader([line], delimiter=self.delimiter))
+        if len(values) != len(self.columns):
+            raise ValueError(f"Expected {len(self.columns)} fields, got {len(values)}")
+        row = dict(zip(self.columns, values, strict=True))
+        row["value"] = row["value"].strip().replace(",", ".")
+        return row
+
+
+def _validate(row: dict) -> dict:
+    grade = GradeCreate.model_validate(row)
+    return {"subject": grade.subject, "date": grade.date, "value": grade.value}
+
+
+def _error_message(exc: Exception) -> str:
+    if isinstance(exc, ValidationError):
+        return "; ".join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in exc.errors())
+    return str(exc)
+
+
+def _write_chunk(rows: list[dict], replace: bool) -> int:
+    """Commit one chunk; the first chunk of a replace import also drops the stored grades."""
+    with get_session() as session:
+        deleted = session.exec(delete(Grade)).rowcount if replace else 0
+        insert_grades(session, rows)
+    invalidate_grade_summary()
+    return deleted
+
+
+async def stream_import(chunks: AsyncIterator[bytes], fmt: str, replace: bool) -> AsyncIterator[str]:
+    """Import grades from `chunks`, yielding a JSON progress line after each committed chunk.
+
+    Every line has "event" ("progress", "done" or "failed"), the number of data
+    rows read and imported so far and, for progress lines, the rows rejected
+    since the previous line with their line number.
+    """
+    parser = RowParser(fmt)
+    pending: list[dict] = []
+    errors: list[dict] = []
+    read = imported = rejected = deleted = 0
+    line_no = 0
+    must_replace = replace  # grades are only dropped once a valid chunk is ready
+
+    def progress(event: str, **extra) -> str:
+        return json.dumps({"event": event, "rows": read, "imported": imported, "rejected": rejected, **extra}) + "\n"
+
+    try:
+        async for line in iter_lines(chunks):
+            line_no += 1
+            try:
+                row = parser.parse(line)
+                if row is None:
+                    continue
+                pending.append(_validate(row))
+            except (ValueError, ValidationError) as e:
+                if parser.columns is None and fmt == "csv":
+                    raise  # unusable header, nothing else can be read
+                rejected += 1
+                errors.append({"line": line_no, "error": _error_message(e)})
+            read += 1
+
+            if len(pending) >= GRADE_CHUNK_SIZE or len(errors) >= ERRORS_PER_PROGRESS:
+                if pending:
+                    deleted += await asyncio.to_thread(_write_chunk, pending, must_replace)
+                    must_replace = False
+                    imported += len(pending)
+                    pending = []
+                yield progress("progress", errors=errors)
+                errors = []
+
+        if pending:
+            deleted += await asyncio.to_thread(_write_chunk, pending, must_replace)
+            imported += len(pending)
+        if errors:
+            yield progress("progress", errors=errors)
+        logger.info(f"Grade import: {imported} imported, {rejected} rejected, {deleted} replaced")
+        yield progress("done", deleted=deleted)
+
+    except Exception as e:
+        logger.error(f"Grade import failed after {imported} grade(s): {e}")
+        yield progress("failed", error=_error_message(e))
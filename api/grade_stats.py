@@ -0,0 +1,111 @@
+"""
+Grade averages for /hyperplanning/grades/summary.
+Per-subject aggregates come from one GROUP BY over the (subject, date) index.
+The summary is cached until grades are imported or cleared.
+"""
+
+import re
+from datetime import date, datetime
+
+from sqlalchemy import func
+from sqlmodel import select
+
+from db import get_session
+from models import Grade
+
+# Summaries by trend window, dropped by invalidate_grade_summary()
+_summary_cache: dict[int, dict] = {}
+
+# Month prefixes as written by Hyperplanning ("13 déc."), longest first where they overlap
+_MONTHS = (
+    ("janv", 1), ("jan", 1), ("févr", 2), ("fév", 2), ("fev", 2), ("mars", 3), ("mar", 3),
+    ("avr", 4), ("mai", 5), ("juin", 6), ("juil", 7), ("août", 8), ("aou", 8),
+    ("sept", 9), ("sep", 9), ("oct", 10), ("nov", 11), ("déc", 12), ("dec", 12),
+)
+_DAY_MONTH = re.compile(r"^(\d{1,2})\s+([^\s\d.]+)\.?(?:\s+(\d{4}))?$")
+
+
+def invalidate_grade_summary() -> None:
+    """Drop cached summaries, called whenever grades are written."""
+    _summary_cache.clear()
+
+
+def grade_day(text: str, today: date) -> date | None:
+    """Parse a grade date: ISO, dd/mm/yyyy or "13 déc." (latest such day up to `today`)."""
+    text = text.strip().lower()
+    for fmt in ("%Y-%m-%d", "%d/%m/%Y"):
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            pass
+
+    match = _DAY_MONTH.match(text)
+    if not match:
+        return None
+    day, name, year = match.groups()
+    month = next((number for prefix, number in _MONTHS if name.startswith(prefix)), None)
+    if month is None:
+        return None
+    try:
+        if year:
+            return date(int(year), month, int(day))
+        parsed = date(today.year, month, int(day))
+        return parsed if parsed <= today else date(today.year - 1, month, int(day))
+    except ValueError:
+        return None
+
+
+def _trend(rows, window: int, today: date) -> dict:
+    """Rolling mean over the last `window` grades, in date order; undated grades are left out."""
+    dated = sorted(
+        (day, grade_id, value)
+        for grade_id, text, value in rows
+        if (day := grade_day(text, today)) is not None
+    )
+    points = []
+    total = 0.0
+    for i, (day, _, value) in enumerate(dated):
+        total += value
+        if i >= window:
+            total -= dated[i - window][2]
+        points.append({"date": day.isoformat(), "value": value, "average": round(total / min(i + 1, window), 2)})
+
+    delta = None
+    if len(points) > window:
+        delta = round(points[-1]["average"] - points[-1 - window]["average"], 2)
+    return {"window": window, "points": points, "delta": delta, "undated": len(rows) - len(dated)}
+
+
+def grade_summary(window: int) -> dict:
+    cached = _summary_cache.get(window)
+    if cached is not None:
+        return cached
+
+    with get_session() as session:
+        groups = session.exec(
+            select(
+                Grade.subject,
+                func.count(),
+                func.avg(Grade.value),
+                func.min(Grade.value),
+                func.max(Grade.value),
+            ).group_by(Grade.subject).order_by(Grade.subject)
+        ).all()
+        rows = session.exec(select(Grade.id, Grade.date, Grade.value)).all()
+
+    subjects = [
+        {"subject": subject, "count": count, "mean": round(mean, 2), "min": low, "max": high}
+        for subject, count, mean, low, high in groups
+    ]
+    count = sum(s["count"] for s in subjects)
+    summary = {
+        "count": count,
+        # Every grade weighs the same, so subjects weigh by their number of grades
+        "overall_average": round(sum(mean * n for _, n, mean, _, _ in groups) / count, 2) if count else None,
+        # Each subject weighs the same, like a report card without coefficients
+        "subject_average": round(sum(mean for _, _, mean, _, _ in groups) / len(groups), 2) if groups else None,
+        "subjects": subjects,
+        "trend": _trend(rows, window, date.today()),
+    }
+    _summary_cache[window] = summary
+    return summary
@@ -0,0 +1,140 @@
+"""
+Streaming reader for iCalendar feeds.
+Unfolds lines as they arrive and yields the handful of VEVENT properties the
+app uses, without holding the body or a component tree in memory.
+"""
+
+from collections.abc import Iterable, Iterator
+from datetime import date, datetime
+
+import pytz
+
+# VEVENT properties kept, everything else is skipped while reading
+VEVENT_FIELDS = {"UID", "SUMMARY", "LOCATION", "DESCRIPTION", "DTSTART", "DTEND", "SEQUENCE", "LAST-MODIFIED"}
+
+_TEXT_ESCAPES = {"n": "\n", "N": "\n", ",": ",", ";": ";", "\\": "\\"}
+
+
+def unfold(lines: Iterable[bytes]) -> Iterator[str]:
+    """Join folded continuation lines (RFC 5545 3.1) and decode them."""
+    current = None
+    for line in lines:
+        line = line.rstrip(b"\r\n")
+        if not line:
+            # Response.iter_lines() yields an empty line when a chunk ends
+            # between CR and LF; it must not end the property being unfolded.
+            continue
+        if line[:1] in (b" ", b"\t"):
+            if current is not None:
+                current += line[1:]
+            continue
+        if current is not None:
+            yield current.decode("utf-8", errors="replace")
+        current = line
+    if current is not None:
+        yield current.decode("utf-8", errors="replace")
+
+
+def split_property(line: str) -> tuple[str, dict[str, str], str]:
+    """Split `NAME;PARAM=x;PARAM="y:z":value` into its name, params and value."""
+    in_quotes = False
+    for i, char in enumerate(line):
+        if char == '"':
+            in_quotes = not in_quotes
+        elif char == ":" and not in_quotes:
+            head, value = line[:i], line[i + 1:]
+            break
+    else:
+        return line.upper(), {}, ""
+
+    name, *raw_params = head.split(";")
+    params = {}
+    for param in raw_params:
+        key, _, param_value = param.partition("=")
+        params[key.upper()] = param_value.strip('"')
+    return name.upper(), params, value
+
+
+def unescape_text(value: str) -> str:
+    out = []
+    chars = iter(value)
+    for char in chars:
+        if char == "\\":
+            escaped = next(chars, "")
+            out.append(_TEXT_ESCAPES.get(escaped, escaped))
+        else:
+            out.append(char)
+    return "".join(out)
+
+
+def parse_datetime(value: str, params: dict[str, str], default_tz) -> date | datetime:
+    """Parse a DATE or DATE-TIME value; UTC and TZID values come back aware, floating ones naive."""
+    value = value.strip()
+    if params.get("VALUE") == "DATE" or len(value) == 8:
+        return datetime.strptime(value[:8], "%Y%m%d").date()
+
+    parsed = datetime.strptime(value.rstrip("Z")[:15], "%Y%m%dT%H%M%S")
+    if value.endswith("Z"):
+        return pytz.UTC.localize(parsed)
+    if "TZID" in params:
+        try:
+            tz = pytz.timezone(params["TZID"])
+        except pytz.UnknownTimeZoneError:
+            tz = default_tz
+        return tz.localize(parsed)
+    return parsed
+
+
+def iter_vevents(lines: Iterable[bytes], default_tz=pytz.UTC) -> Iterator[dict]:
+    """Yield one dict per VEVENT keyed by the snake_cased VEVENT_FIELDS (last_modified, ...).
+
+    Text values are unescaped, DTSTART/DTEND/LAST-MODIFIED are parsed and
+    SEQUENCE is an int. Properties of nested components (VALARM) are ignored.
+    Raises ValueError, once the events read so far were yielded, for a body
+    that isn't a calendar (an HTML error page) or was cut short.
+    """
+    event = None
+    depth = 0
+    started = ended = False
+    for line in unfold(lines):
+        name, params, value = split_property(line)
+
+        if not started:
+            if name.lstrip("\ufeff") != "BEGIN" or value.upper() != "VCALENDAR":
+                raise ValueError("Not an iCalendar body: it does not start with BEGIN:VCALENDAR")
+            started = True
+            continue
+        if name == "END" and event is None and value.upper() == "VCALENDAR":
+            ended = True
+            continue
+
+        if name == "BEGIN":
+            if event is not None:
+                depth += 1
+            elif value.upper() == "VEVENT":
+                event = {}
+            continue
+        if name == "END":
+            if event is not None:
+                if depth:
+                    depth -= 1
+                elif value.upper() == "VEVENT":
+                    yield event
+                    event = None
+            continue
+
+        if event is None or depth or name not in VEVENT_FIELDS:
+            continue
+
+        key = name.lower().replace("-", "_")
+        if name in ("DTSTART", "DTEND", "LAST-MODIFIED"):
+            event[key] = parse_datetime(value, params, default_tz)
+        elif name == "SEQUENCE":
+            event[key] = int(value or 0)
+        else:
+            event[key] = unescape_text(value)
+
+    if not started:
+        raise ValueError("Not an iCalendar body: it is empty")
+    if not ended:
+        raise ValueError("Truncated iCalendar body: no END:VCALENDAR")
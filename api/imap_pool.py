@@ -0,0 +1,170 @@
+"""
+Pool of logged-in IMAP sessions shared by the email routes.
+Opening a session costs a TCP connection, STARTTLS and LOGIN, so sessions are
+kept open between requests. A request checks out one session for its whole
+duration. A session that sat idle is checked with NOOP before being reused,
+dropped once idle past the timeout, and replaced when its connection breaks.
+"""
+
+import contextlib
+import imaplib
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+
+from logger import setup_logger
+
+logger = setup_logger("imap_pool")
+
+# Errors after which a session's connection can't be trusted any more
+CONNECTION_ERRORS = (imaplib.IMAP4.abort, OSError, EOFError)
+
+
+class MailUnavailable(Exception):
+    """No IMAP session could be checked out, the message is shown to the user."""
+
+
+@dataclass
+class PoolMetrics:
+    checkouts: int = 0
+    wait_seconds: float = 0.0  # summed over checkouts
+    max_wait_seconds: float = 0.0  # including checkouts that timed out
+    timeouts: int = 0  # checkouts that gave up waiting for a free slot
+    opened: int = 0  # logins
+    closed: int = 0  # sessions logged out or dropped, for any of the reasons below
+    expired: int = 0  # idle past the idle timeout
+    failed_checks: int = 0  # NOOP failed before reuse
+    broken: int = 0  # connection error while checked out
+
+
+class ImapPool:
+    """At most `size` sessions, each used by one request at a time."""
+
+    def __init__(
+        self,
+        connect: Callable[[], imaplib.IMAP4],
+        size: int = 4,
+        idle_timeout: float = 300.0,
+        check_after: float = 15.0,
+        wait_timeout: float = 10.0,
+    ):
+        self._connect = connect
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after  # idle seconds after which a session gets a NOOP
+        self.wait_timeout = wait_timeout
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle: list[tuple[imaplib.IMAP4, float]] = []  # (session, last used), most recent last
+        self._in_use = 0
+        self._lock = threading.Lock()
+        self.metrics = PoolMetrics()
+
+    @contextmanager
+    def session(self) -> Iterator[imaplib.IMAP4]:
+        """Check out a logged-in session, returned to the pool on exit.
+
+        A connection error inside the block drops the session instead, so the
+        next checkout logs in again. Other errors (a NO or BAD reply, a parsing
+        bug) leave the connection usable and the session goes back to the pool.
+        """
+        started = time.monotonic()
+        acquired = self._slots.acquire(timeout=self.wait_timeout)
+        waited = time.monotonic() - started
+        with self._lock:
+            self.metrics.max_wait_seconds = max(self.metrics.max_wait_seconds, waited)
+            if not acquired:
+                self.metrics.timeouts += 1
+            else:
+                self.metrics.checkouts += 1
+                self.metrics.wait_seconds += waited
+                self._in_use += 1
+        if not acquired:
+            raise MailUnavailable("All mail connections are busy")
+
+        try:
+            mail = self._checkout()
+            try:
+                yield mail
+            except CONNECTION_ERRORS:
+                with self._lock:
+                    self.metrics.broken += 1
+                self._close(mail)
+                raise
+            except BaseException:
+                self._checkin(mail)
+                raise
+            self._checkin(mail)
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    def _checkout(self) -> imaplib.IMAP4:
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                mail, last_used = self._idle.pop()
+
+            idle = time.monotonic() - last_used
+            if idle > self.idle_timeout:
+                with self._lock:
+                    self.metrics.expired += 1
+                self._close(mail)
+                continue
+            if idle > self.check_after:
+                try:
+                    mail.noop()
+                except (imaplib.IMAP4.error, *CONNECTION_ERRORS) as e:
+                    logger.info(f"Dropping dead IMAP session: {e}")
+                    with self._lock:
+                        self.metrics.failed_checks += 1
+                    self._close(mail)
+                    continue
+            return mail
+
+        # Raises MailUnavailable when the server can't be reached
+        mail = self._connect()
+        with self._lock:
+            self.metrics.opened += 1
+        return mail
+
+    def _checkin(self, mail: imaplib.IMAP4) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._idle.append((mail, now))
+            # The least recently used sessions are at the front
+            expired = []
+            while self._idle and now - self._idle[0][1] > self.idle_timeout:
+                expired.append(self._idle.pop(0)[0])
+            self.metrics.expired += len(expired)
+        for session in expired:
+            self._close(session)
+
+    def _close(self, mail: imaplib.IMAP4) -> None:
+        with contextlib.suppress(Exception):
+            mail.logout()
+        with self._lock:
+            self.metrics.closed += 1
+
+    def close_all(self) -> None:
+        """Log out every idle session, e.g. on shutdown."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for mail, _ in idle:
+            self._close(mail)
+
+    def stats(self) -> dict:
+        with self._lock:
+            metrics = asdict(self.metrics)
+            in_use, idle = self._in_use, len(self._idle)
+        checkouts = metrics["checkouts"]
+        return {
+            "size": self.size,
+            "in_use": in_use,
+            "idle": idle,
+            **metrics,
+            "avg_wait_ms": round(metrics["wait_seconds"] / checkouts * 1000, 2) if checkouts else 0.0,
+        }
@@ -0,0 +1,413 @@
+"""
+Parsing of IMAP responses as handed back by imaplib.
+imaplib splits a FETCH response around its literals: a message is a (prefix, literal)
+tuple per literal followed by the bytes after the last one. The helpers here put
+each message back together and parse its items in a single pass, so one command
+can cover a whole page of messages.
+"""
+
+import binascii
+import quopri
+import re
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from datetime import datetime
+from email.header import decode_header
+from email.message import Message
+from email.parser import BytesHeaderParser
+from urllib.parse import unquote
+
+# Header fields listed in the mailbox views and used to thread them, fetched without the rest of the header
+LIST_HEADER_FIELDS = ("SUBJECT", "FROM", "DATE", "MESSAGE-ID", "IN-REPLY-TO", "REFERENCES")
+LIST_FETCH_ITEMS = f"(UID FLAGS INTERNALDATE BODY.PEEK[HEADER.FIELDS ({' '.join(LIST_HEADER_FIELDS)})])"
+
+# Items fetched to open a message: its listing fields and MIME tree, not its content
+STRUCTURE_FETCH_ITEMS = LIST_FETCH_ITEMS[:-1] + " BODYSTRUCTURE)"
+
+# An atom, with the bracketed section of BODY[...] items kept in it
+_ATOM = re.compile(rb'[^\s()"]+?(?:\[[^\]]*\](?:<\d+>)?)?(?=[\s()"]|$)')
+_LITERAL = re.compile(rb"\{(\d+)\}$")
+_QUOTED = re.compile(rb'"((?:[^"\\]|\\.)*)"')
+_QUOTED_ESCAPE = re.compile(rb"\\(.)")
+# Parenthesis tokens, kept apart from quoted strings that happen to be "(" or ")"
+_OPEN, _CLOSE = object(), object()
+_SECTION_ITEM = re.compile(r"BODY\[([\d.]+)\](?:<\d+>)?")
+# A Message-ID, several of them in References, possibly folded over lines
+_MESSAGE_ID = re.compile(r"<[^<>\s]+>")
+
+
+def _tokens(segments: list[tuple[bytes, bytes | None]]) -> Iterator:
+    """Tokens of a response whose literals were cut out by imaplib.
+
+    Atoms and quoted strings come out as str (NIL as None), literals as bytes.
+    """
+    for text, literal in segments:
+        pos = 0
+        while pos < len(text):
+            char = text[pos:pos + 1]
+            if char.isspace():
+                pos += 1
+            elif char in b"()":
+                yield _OPEN if char == b"(" else _CLOSE
+                pos += 1
+            elif char == b'"':
+                match = _QUOTED.match(text, pos)
+                yield _QUOTED_ESCAPE.sub(rb"\1", match.group(1)).decode(errors="replace")
+                pos = match.end()
+            elif char == b"{" and _LITERAL.match(text, pos):
+                # The literal's bytes were read separately by imaplib
+                yield literal
+                pos = len(text)
+            else:
+                match = _ATOM.match(text, pos)
+                atom = match.group().decode(errors="replace")
+                yield None if atom.upper() == "NIL" else atom
+                pos = match.end()
+
+
+def parse_list(segments: list[tuple[bytes, bytes | None]]) -> list:
+    """Parse a response into nested lists of tokens."""
+    stack: list[list] = [[]]
+    for token in _tokens(segments):
+        if token is _OPEN:
+            stack.append([])
+        elif token is _CLOSE:
+            done = stack.pop()
+            stack[-1].append(done)
+        else:
+            stack[-1].append(token)
+    return stack[0]
+
+
+def _messages(data: list) -> Iterator[list[tuple[bytes, bytes | None]]]:
+    """Group imaplib's FETCH or STATUS data into one list of (text, literal) segments per response."""
+    current: list[tuple[bytes, bytes | None]] = []
+    for part in data:
+        if part is None:
+            continue
+        text, literal = part if isinstance(part, tuple) else (part, None)
+        # The text after a literal carries on the same message
+        if current and text[:1] not in (b" ", b")"):
+            yield current
+            current = []
+        current.append((text, literal))
+    if current:
+        yield current
+
+
+def iter_fetch(data: list) -> Iterator[tuple[int, dict]]:
+    """(sequence number, {ITEM NAME: value}) for each message of a FETCH response."""
+    for segments in _messages(data):
+        parsed = parse_list(segments)
+        if len(parsed) < 2 or not isinstance(parsed[1], list):
+            continue
+        number, items = parsed[0], parsed[1]
+        yield int(number), {str(name).upper(): value for name, value in zip(items[::2], items[1::2], strict=False)}
+
+
+def decode_email_header(header):
+    if not header:
+        return "(No subject)"
+    decoded_list = decode_header(header)
+    result = ""
+    for text, encoding in decoded_list:
+        if isinstance(text, bytes):
+            result += text.decode(encoding if encoding else "utf-8", errors="ignore")
+        else:
+            result += str(text)
+    return result
+
+
+def quote_mailbox(name: str) -> str:
+    """Quote a mailbox name for a command argument."""
+    return '"' + name.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def parse_internaldate(value: str | None) -> datetime | None:
+    """Parse an INTERNALDATE such as " 7-Mar-2025 09:15:00 +0100"."""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value.strip(), "%d-%b-%Y %H:%M:%S %z")
+    except ValueError:
+        return None
+
+
+@dataclass
+class BodyPart:
+    """A leaf of a message's BODYSTRUCTURE."""
+    section: str  # part specifier for BODY[section], e.g. "1.2"
+    content_type: str  # lowercase, e.g. "text/plain"
+    params: dict[str, str]
+    encoding: str  # Content-Transfer-Encoding, lowercase
+    size: int  # encoded size in octets
+    disposition: str | None = None  # "inline" or "attachment", lowercase
+    disposition_params: dict[str, str] = field(default_factory=dict)
+
+    @property
+    def charset(self) -> str:
+        return self.params.get("charset") or "utf-8"
+
+    @property
+    def filename(self) -> str | None:
+        name = _param(self.disposition_params, "filename") or _param(self.params, "name")
+        return decode_email_header(name) if name else None
+
+    @property
+    def is_text(self) -> bool:
+        """A text/plain or text/html part shown as the message body."""
+        return self.content_type in ("text/plain", "text/html") and self.disposition != "attachment"
+
+    @property
+    def decoded_size(self) -> int:
+        """Size once the transfer encoding is removed, estimated for base64."""
+        # Base64 lines are 76 characters and a CRLF for 57 bytes of content
+        return self.size * 57 // 78 if self.encoding == "base64" else self.size
+
+
+def _param(params: dict[str, str], name: str) -> str | None:
+    """A MIME parameter, including its RFC 2231 form (name*=utf-8''...)."""
+    if name in params:
+        return params[name]
+    encoded = params.get(name + "*")
+    if not encoded:
+        return None
+    # charset'language'percent-encoded-value
+    charset, _, value = encoded.split("'", 2) if encoded.count("'") >= 2 else ("", "", encoded)
+    return unquote(value, encoding=charset or "utf-8", errors="replace")
+
+
+def _params(values) -> dict[str, str]:
+    if not isinstance(values, list):
+        return {}
+    return {str(k).lower(): str(v) for k, v in zip(values[::2], values[1::2], strict=False) if v is not None}
+
+
+def parse_bodystructure(node: list, section: str = "") -> list[BodyPart]:
+    """The leaf parts of a parsed BODYSTRUCTURE, in document order."""
+    if node and isinstance(node[0], list):
+        # Multipart: the children come first, then the subtype and extension data
+        parts = []
+        for i, child in enumerate(node, 1):
+            if not isinstance(child, list):
+                break
+            parts += parse_bodystructure(child, f"{section}.{i}" if section else str(i))
+        return parts
+
+    main, sub = str(node[0]).lower(), str(node[1]).lower()
+    # Extension data (MD5, then disposition) follows the type-specific fields
+    if main == "text":
+        extension = 8
+    elif (main, sub) in (("message", "rfc822"), ("message", "global")):
+        extension = 10
+    else:
+        extension = 7
+    disposition = node[extension + 1] if len(node) > extension + 1 else None
+    if not isinstance(disposition, list) or not disposition:
+        disposition = [None, None]
+    return [BodyPart(
+        section=section or "1",
+        content_type=f"{main}/{sub}",
+        params=_params(node[2]),
+        encoding=str(node[5] or "7bit").lower(),
+        size=int(node[6] or 0),
+        disposition=str(disposition[0]).lower() if disposition[0] else None,
+        disposition_params=_params(disposition[1] if len(disposition) > 1 else None),
+    )]
+
+
+def decode_transfer(data: bytes, encoding: str) -> bytes:
+    """Undo a Content-Transfer-Encoding, tolerating content cut short by a partial fetch."""
+    if encoding == "base64":
+        compact = re.sub(rb"[^A-Za-z0-9+/=]", b"", data)
+        # A partial fetch may stop in the middle of a 4-character group
+        return binascii.a2b_base64(compact[:len(compact) // 4 * 4])
+    if encoding == "quoted-printable":
+        return quopri.decodestring(re.sub(rb"=[0-9A-Fa-f]?$", b"", data))
+    return data
+
+
+def decode_text(data: bytes, charset: str) -> str:
+    try:
+        return data.decode(charset, errors="replace")
+    except LookupError:
+        return data.decode("utf-8", errors="replace")
+
+
+@dataclass
+class FetchedHeaders:
+    """A message as listed in the mailbox views."""
+    seq: int
+    uid: int | None
+    flags: tuple[str, ...]
+    internaldate: datetime | None
+    headers: Message = field(repr=False)
+    parts: list[BodyPart] = field(default_factory=list)  # with bodystructure=True
+
+    @property
+    def seen(self) -> bool:
+        return "\\Seen" in self.flags
+
+
+def _header_literal(items: dict) -> bytes:
+    for name, value in items.items():
+        if name.startswith("BODY[HEADER") and isinstance(value, bytes):
+            return value
+    return b""
+
+
+def fetch_headers(mail, message_set: str, uid: bool = False, bodystructure: bool = False) -> list[FetchedHeaders]:
+    """Fetch the listing headers of every message in `message_set` with one FETCH.
+
+    `message_set` holds UIDs rather than sequence numbers when `uid` is set.
+    With `bodystructure`, the MIME parts are listed too.
+    """
+    items = STRUCTURE_FETCH_ITEMS if bodystructure else LIST_FETCH_ITEMS
+    if uid:
+        status, data = mail.uid("FETCH", message_set, items)
+    else:
+        status, data = mail.fetch(message_set, items)
+    if status != "OK":
+        raise mail.error(f"FETCH failed: {data}")
+
+    parser = BytesHeaderParser()
+    fetched = []
+    for seq, items in iter_fetch(data):
+        literal = _header_literal(items)
+        # Unsolicited FETCH responses (flag changes from another client) carry no header
+        if not literal:
+            continue
+        fetched.append(FetchedHeaders(
+            seq=seq,
+            uid=int(items["UID"]) if "UID" in items else None,
+            flags=tuple(items.get("FLAGS") or ()),
+            internaldate=parse_internaldate(items.get("INTERNALDATE")),
+            headers=parser.parsebytes(literal),
+            parts=parse_bodystructure(items["BODYSTRUCTURE"]) if bodystructure and items.get("BODYSTRUCTURE") else [],
+        ))
+    return fetched
+
+
+def fetch_sections(mail, uid: str, sections: list[str], max_bytes: int) -> dict[str, bytes]:
+    """The first `max_bytes` of each body section of one message, in one UID FETCH.
+
+    BODY.PEEK leaves the message's \\Seen flag alone.
+    """
+    items = " ".join(f"BODY.PEEK[{section}]<0.{max_bytes}>" for section in sections)
+    status, data = mail.uid("FETCH", uid, f"({items})")
+    if status != "OK":
+        raise mail.error(f"FETCH failed: {data}")
+    contents = {}
+    for _, values in iter_fetch(data):
+        for name, value in values.items():
+            match = _SECTION_ITEM.fullmatch(name)
+            if match:
+                # An empty section comes back as "" or NIL rather than a literal
+                contents[match.group(1)] = value if isinstance(value, bytes) else b""
+    return contents
+
+
+def fetch_partial(mail, uid: str, section: str, offset: int, length: int) -> bytes:
+    """`length` bytes of a body section from `offset`, empty past its end."""
+    status, data = mail.uid("FETCH", uid, f"(BODY.PEEK[{section}]<{offset}.{length}>)")
+    if status != "OK":
+        raise mail.error(f"FETCH failed: {data}")
+    for _, values in iter_fetch(data):
+        for name, value in values.items():
+            if _SECTION_ITEM.fullmatch(name):
+                return value if isinstance(value, bytes) else b""
+    return b""
+
+
+def fetch_flags(mail, uid_set: str, changedsince: int | None = None) -> dict[int, tuple[str, ...]]:
+    """FLAGS by UID for the messages in `uid_set`.
+
+    With `changedsince` (CONDSTORE), only the messages whose flags changed after
+    that mod-sequence are returned.
+    """
+    items = "(UID FLAGS)" if changedsince is None else f"(UID FLAGS) (CHANGEDSINCE {changedsince})"
+    status, data = mail.uid("FETCH", uid_set, items)
+    if status != "OK":
+        raise mail.error(f"FETCH failed: {data}")
+    return {
+        int(values["UID"]): tuple(values.get("FLAGS") or ())
+        for _, values in iter_fetch(data)
+        if "UID" in values and "FLAGS" in values
+    }
+
+
+def parse_status(data: list) -> dict[str, dict[str, int]]:
+    """{mailbox: {ITEM: number}} from the data of STATUS responses."""
+    statuses = {}
+    for segments in _messages(data):
+        parsed = parse_list(segments)
+        if len(parsed) < 2 or not isinstance(parsed[-1], list):
+            continue
+        name = parsed[0].decode(errors="replace") if isinstance(parsed[0], bytes) else str(parsed[0])
+        # INBOX is case-insensitive, other names are not
+        name = "INBOX" if name.upper() == "INBOX" else name
+        items = parsed[-1]
+        statuses[name] = {str(item).upper(): int(value) for item, value in zip(items[::2], items[1::2], strict=False)}
+    return statuses
+
+
+def fetch_status(mail, names: list[str], items: str = "(MESSAGES UNSEEN UIDNEXT)") -> dict[str, dict[str, int]]:
+    """STATUS of several mailboxes, without selecting them. Unknown mailboxes are left out.
+
+    Servers with LIST-STATUS (RFC 5819) answer for every mailbox in one LIST,
+    others get one STATUS command per mailbox.
+    """
+    wanted = {"INBOX" if name.upper() == "INBOX" else name for name in names}
+    if len(wanted) > 1 and "LIST-STATUS" in mail.capabilities:
+        status, data = mail.list('""', f'"*" RETURN (STATUS {items})')
+        if status != "OK":
+            raise mail.error(f"LIST failed: {data}")
+        _, data = mail.response("STATUS")
+        return {name: counts for name, counts in parse_status(data).items() if name in wanted}
+
+    statuses = {}
+    for name in wanted:
+        status, data = mail.status(quote_mailbox(name), items)
+        if status == "OK":
+            statuses.update(parse_status(data))
+    return statuses
+
+
+def search_uids(mail, criteria: str = "ALL") -> list[int]:
+    status, data = mail.uid("SEARCH", criteria)
+    if status != "OK":
+        raise mail.error(f"SEARCH failed: {data}")
+    return [int(uid) for uid in (data[0] or b"").split()]
+
+
+def _thread_uids(node: list) -> Iterator[int]:
+    for item in node:
+        if isinstance(item, list):
+            yield from _thread_uids(item)
+        else:
+            yield int(item)
+
+
+def fetch_threads(mail, algorithm: str = "REFERENCES") -> list[list[int]]:
+    """The UIDs of each conversation of the selected folder, as threaded by the server.
+
+    A THREAD response nests replies, "(1 2 (3)(4 5))" is one conversation
+    where 3 and 4 both answer 2. Only the grouping is kept here.
+    """
+    status, data = mail.uid("THREAD", algorithm, "UTF-8", "ALL")
+    if status != "OK":
+        raise mail.error(f"THREAD failed: {data}")
+    threads = parse_list([(data[0] or b"", None)])
+    return [list(_thread_uids(thread)) for thread in threads if isinstance(thread, list)]
+
+
+def message_ids(value: str | None) -> list[str]:
+    """The Message-IDs in a Message-ID, In-Reply-To or References header."""
+    return _MESSAGE_ID.findall(str(value)) if value else []
+
+
+def response_code(mail, name: str) -> int | None:
+    """Numeric value of a response code such as [UIDVALIDITY 42] from the last command."""
+    _, values = mail.response(name)
+    value = values[-1] if values else None
+    return int(value) if value else None
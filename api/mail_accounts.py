@@ -0,0 +1,100 @@
+"""
+Mail from every configured IMAP account at once.
+The Proton Bridge and the accounts of MAIL_ACCOUNTS each have their own session
+pool, listing cache and STATUS cache. The aggregated routes refresh all of them
+concurrently in a bounded thread pool and wait for each at most its own
+timeout. An account that is slow or down is then read from its caches rather
+than holding up the response, while its refresh carries on in the background
+for the next call. Its results are merged with the other accounts' by date.
+"""
+
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+
+from config import get_settings
+from logger import setup_logger
+from mail_cache import MailCache
+from mail_status import StatusCache
+from models import MailHeader
+
+settings = get_settings()
+logger = setup_logger("mail_accounts")
+
+# Account refreshes run in these threads, so a burst of requests never opens more connections
+FETCH_POOL = ThreadPoolExecutor(max_workers=settings.mail_fetch_workers, thread_name_prefix="mail-account")
+
+# Refreshes still running, by (kind, account name): later calls wait on them instead of starting another
+_running: dict[tuple[str, str], Future] = {}
+_running_lock = threading.Lock()
+
+
+@dataclass
+class MailAccount:
+    name: str
+    cache: MailCache
+    status: StatusCache
+    timeout: float  # seconds the aggregated routes wait for this account
+
+
+def _submit(kind: str, account: MailAccount, refresh: Callable[[MailAccount], object]) -> Future:
+    with _running_lock:
+        future = _running.get((kind, account.name))
+        if future is None or future.done():
+            future = _running[(kind, account.name)] = FETCH_POOL.submit(refresh, account)
+    return future
+
+
+def refresh_all(accounts: list[MailAccount], kind: str, refresh: Callable[[MailAccount], object]) -> dict[str, str]:
+    """Run `refresh(account)` for every account concurrently, waiting for each at most its timeout.
+
+    Returns an error per account that failed or didn't finish in time, whose
+    cached values are then the ones to serve.
+    """
+    started = time.monotonic()
+    futures = [(account, _submit(kind, account, refresh)) for account in accounts]
+    errors = {}
+    for account, future in futures:
+        try:
+            future.result(timeout=max(0.0, started + account.timeout - time.monotonic()))
+        except TimeoutError:
+            errors[account.name] = f"No response within {account.timeout:g}s"
+        except Exception as e:
+            errors[account.name] = str(e)
+    for name, error in errors.items():
+        logger.warning(f"Mail account {name} unavailable, serving cached values: {error}")
+    return errors
+
+
+def unread_counts(accounts: list[MailAccount]) -> tuple[dict[str, int | None], dict[str, str]]:
+    """Unread inbox messages per account, None for an account with nothing cached yet, and the errors."""
+    errors = refresh_all(accounts, "status", lambda account: account.status.get(["INBOX"]))
+    counts = {}
+    for account in accounts:
+        inbox = account.status.cached("INBOX")
+        counts[account.name] = inbox.unseen if inbox else None
+    return counts, errors
+
+
+def recent_unread(
+    accounts: list[MailAccount], limit: int
+) -> tuple[int, list[tuple[str, MailHeader]], dict[str, int | None], dict[str, str]]:
+    """The `limit` latest unread inbox messages of all accounts, newest first.
+
+    Returns the total unread count, the (account name, message) pairs, the
+    unread count of each account (None with nothing cached yet) and the errors.
+    """
+    errors = refresh_all(accounts, "inbox", lambda account: account.cache.sync("INBOX"))
+    counts: dict[str, int | None] = {}
+    feed: list[tuple[str, MailHeader]] = []
+    for account in accounts:
+        folder = account.cache.folder("INBOX")
+        if folder is None:
+            counts[account.name] = None
+            continue
+        counts[account.name], rows = account.cache.unread(folder, limit)
+        feed += [(account.name, row) for row in rows]
+    feed.sort(key=lambda item: (item[1].received_at, item[1].uid), reverse=True)
+    return sum(count or 0 for count in counts.values()), feed[:limit], counts, errors
@@ -0,0 +1,178 @@
+"""
+Streaming download of a single MIME part over IMAP partial fetches.
+The part is read in BODY.PEEK[section]<offset.length> chunks and its transfer
+encoding is undone incrementally, so memory stays constant whatever the size.
+Byte ranges are served by seeking in the encoded part: directly for identity
+encodings, and by whole lines for base64, whose lines all have the same length
+except the last one. Quoted-printable parts can only be streamed from the start.
+"""
+
+import binascii
+import quopri
+import re
+from collections.abc import Iterator
+from dataclasses import dataclass
+
+from imap_pool import ImapPool
+from imap_protocol import BodyPart, fetch_partial, quote_mailbox
+
+# Encoded bytes per partial FETCH
+CHUNK_SIZE = 256 * 1024
+
+_NOT_BASE64 = re.compile(rb"[^A-Za-z0-9+/=]")
+
+
+class Base64Decoder:
+    def __init__(self):
+        self._pending = b""  # characters of an incomplete 4-character group
+
+    def feed(self, data: bytes) -> bytes:
+        data = self._pending + _NOT_BASE64.sub(b"", data)
+        whole = len(data) // 4 * 4
+        self._pending = data[whole:]
+        return binascii.a2b_base64(data[:whole])
+
+    def flush(self) -> bytes:
+        pending, self._pending = self._pending, b""
+        return binascii.a2b_base64(pending + b"=" * (-len(pending) % 4)) if pending.strip(b"=") else b""
+
+
+class QuotedPrintableDecoder:
+    def __init__(self):
+        self._pending = b""  # the last, possibly incomplete, line
+
+    def feed(self, data: bytes) -> bytes:
+        data = self._pending + data
+        end = data.rfind(b"\n") + 1
+        self._pending = data[end:]
+        return quopri.decodestring(data[:end])
+
+    def flush(self) -> bytes:
+        pending, self._pending = self._pending, b""
+        return quopri.decodestring(pending)
+
+
+class IdentityDecoder:
+    def feed(self, data: bytes) -> bytes:
+        return data
+
+    def flush(self) -> bytes:
+        return b""
+
+
+def decoder_for(encoding: str):
+    if encoding == "base64":
+        return Base64Decoder()
+    if encoding == "quoted-printable":
+        return QuotedPrintableDecoder()
+    return IdentityDecoder()
+
+
+@dataclass
+class PartLayout:
+    """Where decoded bytes sit in the encoded part."""
+    size: int | None  # decoded size, None when unknown
+    # Base64 only: encoded bytes per line including the line break, decoded bytes per line
+    line_bytes: int = 0
+    line_content: int = 0
+
+    @property
+    def seekable(self) -> bool:
+        return self.size is not None
+
+    def locate(self, start: int) -> tuple[int, int]:
+        """(encoded offset to read from, decoded bytes to drop) for decoded offset `start`."""
+        if not self.line_bytes:
+            return start, 0
+        line = start // self.line_content
+        return line * self.line_bytes, start - line * self.line_content
+
+
+def part_layout(mail, uid: str, part: BodyPart) -> PartLayout:
+    """Work out the decoded size and line layout of a part, with two small fetches for base64."""
+    if part.encoding in ("7bit", "8bit", "binary"):
+        return PartLayout(size=part.size)
+    if part.encoding != "base64" or not part.size:
+        return PartLayout(size=None)
+
+    head = fetch_partial(mail, uid, part.section, 0, 1024)
+    newline = b"\r\n" if b"\r\n" in head else b"\n"
+    line_length = head.find(newline)
+    if line_length <= 0:
+        # A single line: small enough to have been read whole
+        if len(head) >= part.size:
+            return PartLayout(size=len(Base64Decoder().feed(head)))
+        return PartLayout(size=None)
+    if line_length % 4:
+        return PartLayout(size=None)
+    line_bytes = line_length + len(newline)
+
+    # The last line is the only shorter one, its length gives the exact size
+    tail_start = max(0, part.size - line_bytes - len(newline))
+    tail = fetch_partial(mail, uid, part.section, tail_start, part.size - tail_start)
+    content = tail.rstrip(b"\r\n")
+    last_line = content.rsplit(newline, 1)[-1]
+    last_start = tail_start + len(content) - len(last_line)
+    if last_start % line_bytes or len(last_line) > line_length or len(last_line) % 4:
+        return PartLayout(size=None)
+    size = last_start // line_bytes * (line_length // 4 * 3) + len(binascii.a2b_base64(last_line))
+    return PartLayout(size=size, line_bytes=line_bytes, line_content=line_length // 4 * 3)
+
+
+_BYTE_RANGE = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+def parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """The (start, end) inclusive byte range of a Range header.
+
+    None when the header should be ignored (malformed or several ranges),
+    ValueError when the range lies outside the part.
+    """
+    match = _BYTE_RANGE.fullmatch(header.strip())
+    if match is None or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first == "":
+        # Suffix range: the last N bytes
+        length = int(last)
+        if not length or not size:
+            raise ValueError(header)
+        return max(0, size - length), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError(header)
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+def stream_part(
+    pool: ImapPool, folder: str, uid: str, part: BodyPart, layout: PartLayout,
+    start: int = 0, end: int | None = None,
+) -> Iterator[bytes]:
+    """Decoded bytes `start` to `end` (inclusive, None for the end) of a part.
+
+    The pooled session is held until the last chunk has been sent.
+    """
+    offset, skip = layout.locate(start)
+    remaining = None if end is None else end - start + 1
+    decoder = decoder_for(part.encoding)
+
+    with pool.session() as mail:
+        mail.select(quote_mailbox(folder), readonly=True)
+        while remaining is None or remaining > 0:
+            chunk = fetch_partial(mail, uid, part.section, offset, CHUNK_SIZE)
+            offset += len(chunk)
+            data = decoder.feed(chunk)
+            if len(chunk) < CHUNK_SIZE:
+                data += decoder.flush()
+
+            if skip:
+                data, skip = data[skip:], max(0, skip - len(data))
+            if remaining is not None:
+                data = data[:remaining]
+                remaining -= len(data)
+            if data:
+                yield data
+            if len(chunk) < CHUNK_SIZE:
+                break
@@ -0,0 +1,275 @@
+"""
+Local copy of the mailbox listings, kept in the MailFolder and MailHeader tables.
+Messages are keyed by (UIDVALIDITY, UID), which survive expunges unlike sequence
+numbers. A sync only asks the server for what changed: the headers of UIDs above
+the last cached one, and flag changes since the stored HIGHESTMODSEQ when the
+server supports CONDSTORE (the flags of every message otherwise). Listings,
+paging and unread counts are then queries on the local tables. Conversation
+threads are updated at the end of each sync, see mail_threads.
+"""
+
+import imaplib
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from sqlalchemy import bindparam, delete, func, insert, update
+from sqlmodel import select
+
+from db import get_session
+from imap_pool import CONNECTION_ERRORS, ImapPool, MailUnavailable
+from imap_protocol import (
+    FetchedHeaders,
+    decode_email_header,
+    fetch_flags,
+    fetch_headers,
+    quote_mailbox,
+    response_code,
+    search_uids,
+)
+from logger import setup_logger
+from mail_threads import backfill_headers, clear_threads, thread_fields, update_threads
+from models import MailFolder, MailHeader
+
+logger = setup_logger("mail_cache")
+
+# UIDs per header FETCH while catching up on a large mailbox
+SYNC_BATCH = 500
+
+
+def _received_at(message: FetchedHeaders) -> datetime:
+    """INTERNALDATE as naive UTC, falling back on the Date header."""
+    received = message.internaldate
+    if received is None:
+        try:
+            received = parsedate_to_datetime(message.headers.get("Date", ""))
+        except (TypeError, ValueError):
+            received = datetime.now(timezone.utc)
+    if received.tzinfo is None:
+        return received
+    return received.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _header_row(folder: MailFolder, message: FetchedHeaders) -> dict:
+    return {
+        "folder_id": folder.id,
+        "uidvalidity": folder.uidvalidity,
+        "uid": message.uid,
+        "subject": decode_email_header(message.headers["Subject"]),
+        "sender": message.headers.get("From", "Unknown"),
+        "date": message.headers.get("Date", ""),
+        "received_at": _received_at(message),
+        "seen": message.seen,
+        **thread_fields(message),
+    }
+
+
+def _load_folder(account: str, name: str, uidvalidity: int) -> MailFolder:
+    """The folder's sync state, emptied if the server reset its UIDs."""
+    with get_session() as session:
+        folder = session.exec(
+            select(MailFolder).where(MailFolder.account == account, MailFolder.name == name)
+        ).first()
+        if folder is None:
+            folder = MailFolder(account=account, name=name, uidvalidity=uidvalidity)
+            session.add(folder)
+            session.flush()
+        elif folder.uidvalidity != uidvalidity:
+            # Every cached UID now points to an unknown message
+            logger.info(f"UIDVALIDITY of {account}/{name} changed, resyncing")
+            session.exec(delete(MailHeader).where(MailHeader.folder_id == folder.id))
+            clear_threads(session, folder)
+            folder.uidvalidity = uidvalidity
+            folder.last_uid = 0
+            folder.highestmodseq = None
+            session.add(folder)
+    return folder
+
+
+def sync_folder(mail: imaplib.IMAP4, account: str, name: str = "INBOX") -> dict[str, int]:
+    """Bring the cached listing of `name` up to date with the server."""
+    status, data = mail.select(quote_mailbox(name), readonly=True)
+    if status != "OK":
+        raise mail.error(f"Cannot open {name}: {data}")
+    exists = int(data[0])
+    uidvalidity = response_code(mail, "UIDVALIDITY") or 0
+    uidnext = response_code(mail, "UIDNEXT")
+    highestmodseq = response_code(mail, "HIGHESTMODSEQ")
+
+    folder = _load_folder(account, name, uidvalidity)
+    with get_session() as session:
+        stored = dict(session.exec(
+            select(MailHeader.uid, MailHeader.seen).where(MailHeader.folder_id == folder.id)
+        ).all())
+
+    # New messages, in batches of UIDs so a first sync never holds the whole mailbox
+    added = 0
+    last_uid = folder.last_uid
+    if uidnext is None or uidnext > last_uid + 1:
+        low = last_uid + 1
+        while True:
+            high = low + SYNC_BATCH - 1
+            last_batch = uidnext is None or high >= uidnext - 1
+            # "n:*" still returns the newest message when n is past it, hence the filter
+            message_set = f"{low}:*" if last_batch else f"{low}:{high}"
+            batch = [m for m in fetch_headers(mail, message_set, uid=True) if m.uid >= low and m.uid not in stored]
+            if batch:
+                with get_session() as session:
+                    session.exec(insert(MailHeader), params=[_header_row(folder, m) for m in batch])
+                added += len(batch)
+                last_uid = max(last_uid, *(m.uid for m in batch))
+                stored.update((m.uid, m.seen) for m in batch)
+            if last_batch:
+                break
+            low = high + 1
+        if uidnext is not None:
+            last_uid = max(last_uid, uidnext - 1)
+
+    # Flag changes and expunges among the messages cached before this sync
+    changed: dict[int, bool] = {}
+    removed: list[int] = []
+    if folder.last_uid:
+        known = f"1:{folder.last_uid}"
+        if highestmodseq is not None and folder.highestmodseq is not None:
+            if highestmodseq != folder.highestmodseq:
+                flags = fetch_flags(mail, known, changedsince=folder.highestmodseq)
+                changed = {uid: "\\Seen" in f for uid, f in flags.items() if uid in stored}
+            # CONDSTORE alone does not report expunges, the message count does
+            if exists != len(stored):
+                present = set(search_uids(mail))
+                removed = [uid for uid in stored if uid not in present]
+        else:
+            flags = fetch_flags(mail, known)
+            changed = {uid: "\\Seen" in f for uid, f in flags.items() if uid in stored}
+            removed = [uid for uid in stored if uid <= folder.last_uid and uid not in flags]
+        changed = {uid: seen for uid, seen in changed.items() if stored[uid] != seen}
+
+    touched: set[int] = set()
+    with get_session() as session:
+        if changed:
+            table = MailHeader.__table__
+            session.exec(
+                update(table)
+                .where(table.c.folder_id == folder.id, table.c.uid == bindparam("msg_uid"))
+                .values(seen=bindparam("msg_seen")),
+                params=[{"msg_uid": uid, "msg_seen": seen} for uid, seen in changed.items()],
+            )
+        for i in range(0, len(removed), SYNC_BATCH):
+            batch = MailHeader.folder_id == folder.id, MailHeader.uid.in_(removed[i:i + SYNC_BATCH])
+            touched.update(session.exec(select(MailHeader.thread_id).where(*batch, MailHeader.thread_id.is_not(None))).all())
+            session.exec(delete(MailHeader).where(*batch))
+        session.exec(update(MailFolder).where(MailFolder.id == folder.id).values(
+            last_uid=last_uid,
+            highestmodseq=highestmodseq,
+            synced_at=datetime.now(timezone.utc).replace(tzinfo=None),
+        ))
+
+    # Messages cached before threading get their Message-IDs first
+    backfill_headers(mail, folder)
+    update_threads(mail, folder, touched)
+
+    return {"added": added, "updated": len(changed), "removed": len(removed)}
+
+
+class MailCache:
+    """Synced listings of one account's folders, shared by every request.
+
+    Syncs run at most once per `sync_interval` per folder, concurrent requests
+    wait for the running one. When the server can't be reached, the last synced
+    listing is served.
+    """
+
+    def __init__(self, account: str, pool: ImapPool, sync_interval: float):
+        self.account = account
+        self.pool = pool
+        self.sync_interval = sync_interval
+        self._synced: dict[str, float] = {}  # folder name -> monotonic time of the last sync
+        self._locks: dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock(self, name: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(name, threading.Lock())
+
+    def folder(self, name: str = "INBOX") -> MailFolder | None:
+        with get_session() as session:
+            return session.exec(
+                select(MailFolder).where(MailFolder.account == self.account, MailFolder.name == name)
+            ).first()
+
+    def sync(self, name: str = "INBOX", force: bool = False) -> MailFolder:
+        """The folder's sync state after syncing it, unless it was synced within sync_interval."""
+        with self._lock(name):
+            synced = self._synced.get(name)
+            if not force and synced is not None and time.monotonic() - synced < self.sync_interval:
+                folder = self.folder(name)
+                if folder is not None:
+                    return folder
+
+            try:
+                with self.pool.session() as mail:
+                    counts = sync_folder(mail, self.account, name)
+            except (MailUnavailable, imaplib.IMAP4.error, *CONNECTION_ERRORS) as e:
+                folder = self.folder(name)
+                if folder is None:
+                    raise
+                logger.warning(f"Mail sync of {name} failed, serving cached listing: {e}")
+                return folder
+
+            if any(counts.values()):
+                logger.info(f"Mail synced from {self.account}/{name}: {counts}")
+            self._synced[name] = time.monotonic()
+            return self.folder(name)
+
+    def unread(self, folder: MailFolder, limit: int) -> tuple[int, list[MailHeader]]:
+        """Number of unread messages and the `limit` most recent of them."""
+        with get_session() as session:
+            count = session.exec(
+                select(func.count()).select_from(MailHeader)
+                .where(MailHeader.folder_id == folder.id, MailHeader.seen.is_(False))
+            ).one()
+            latest = session.exec(
+                select(MailHeader)
+                .where(MailHeader.folder_id == folder.id, MailHeader.seen.is_(False))
+                .order_by(MailHeader.received_at.desc(), MailHeader.uid.desc())
+                .limit(limit)
+            ).all()
+        return count, list(latest)
+
+    def since(self, folder: MailFolder, uid: int) -> list[MailHeader]:
+        """Messages with a UID above `uid`, oldest first."""
+        with get_session() as session:
+            rows = session.exec(
+                select(MailHeader).where(MailHeader.folder_id == folder.id, MailHeader.uid > uid).order_by(MailHeader.uid)
+            ).all()
+        return list(rows)
+
+    def page(self, folder: MailFolder, offset: int, limit: int, newest_first: bool = True) -> tuple[int, list[MailHeader]]:
+        """Total number of messages and one page of them by arrival date."""
+        order = (
+            (MailHeader.received_at.desc(), MailHeader.uid.desc()) if newest_first
+            else (MailHeader.received_at, MailHeader.uid)
+        )
+        with get_session() as session:
+            total = session.exec(
+                select(func.count()).select_from(MailHeader).where(MailHeader.folder_id == folder.id)
+            ).one()
+            rows = session.exec(
+                select(MailHeader).where(MailHeader.folder_id == folder.id).order_by(*order).offset(offset).limit(limit)
+            ).all()
+        return total, list(rows)
+
+    def mark_seen(self, name: str, uid: int) -> None:
+        """Record locally that a message was read through this app."""
+        with get_session() as session:
+            session.exec(
+                update(MailHeader)
+                .where(MailHeader.uid == uid, MailHeader.folder_id.in_(
+                    select(MailFolder.id).where(MailFolder.account == self.account, MailFolder.name == name)
+                ))
+                .values(seen=True)
+            )
+
+    def clear(self) -> None:
+        self._synced.clear()
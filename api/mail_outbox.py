@@ -0,0 +1,264 @@
+"""
+Outgoing mail, queued in the OutboxMessage table and sent by a background worker.
+The send endpoint only stores the message, so it answers at once. A single
+worker thread drains the queue over one logged-in SMTP connection, kept open
+across messages and bursts rather than a connect, STARTTLS and login per
+email. Temporary failures are retried with exponential backoff, permanent
+rejections (5xx replies) fail the message at once.
+"""
+
+import smtplib
+import threading
+import time
+from collections.abc import Callable
+from datetime import datetime, timedelta, timezone
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import format_datetime, make_msgid
+
+from sqlalchemy import update
+from sqlmodel import select
+
+from db import get_session
+from imap_pool import MailUnavailable
+from logger import setup_logger
+from models import OutboxMessage
+
+logger = setup_logger("mail_outbox")
+
+# Messages claimed from the queue at a time
+BATCH_SIZE = 20
+# Attempts before a message is given up as failed
+MAX_ATTEMPTS = 6
+# Delay before the first retry, doubled after each failed attempt up to RETRY_MAX
+RETRY_BASE = 30.0
+RETRY_MAX = 3600.0
+# A connection unused for this long is checked with NOOP before sending
+NOOP_AFTER = 15.0
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def build_message(row: OutboxMessage) -> MIMEMultipart:
+    message = MIMEMultipart()
+    message["From"] = row.sender
+    message["To"] = row.to
+    message["Subject"] = row.subject
+    message["Date"] = format_datetime(row.created_at.replace(tzinfo=timezone.utc))
+    message["Message-ID"] = row.message_id
+    message.attach(MIMEText(row.body, "plain"))
+    return message
+
+
+def _permanent(error: Exception) -> bool:
+    """Whether retrying can't help: the server rejected the message itself."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(500 <= code < 600 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        # Wrong credentials are fixed in the configuration, the message is fine
+        return False
+    return isinstance(error, smtplib.SMTPResponseException) and 500 <= error.smtp_code < 600
+
+
+def _connection_failed(error: Exception) -> bool:
+    """Whether the SMTP session failed, rather than the server refusing this message."""
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return True
+    return not isinstance(error, (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused))
+
+
+class OutboxWorker:
+    """Sends queued messages from a background thread over one reused SMTP session.
+
+    The thread starts with the first queued message (or on startup when messages
+    are left from a previous run) and the session is logged out after
+    `idle_timeout` seconds without mail.
+    """
+
+    def __init__(self, connect: Callable[[], smtplib.SMTP], idle_timeout: float = 300.0,
+                 batch_size: int = BATCH_SIZE, max_attempts: int = MAX_ATTEMPTS, retry_base: float = RETRY_BASE):
+        self.connect = connect
+        self.idle_timeout = idle_timeout
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.logins = 0
+        self._smtp: smtplib.SMTP | None = None
+        self._last_used = 0.0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        with self._lock:
+            if self.running:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="mail-outbox", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self._hang_up()
+
+    def enqueue(self, sender: str, to: str, subject: str, body: str) -> OutboxMessage:
+        """Store a message for sending and wake the worker."""
+        domain = sender.rpartition("@")[2] or None
+        row = OutboxMessage(sender=sender, to=to, subject=subject, body=body, message_id=make_msgid(domain=domain))
+        with get_session() as session:
+            session.add(row)
+        self._wake.set()
+        self.start()
+        return row
+
+    def resume(self) -> None:
+        """Requeue messages a previous run stopped in the middle of, and start if any are waiting."""
+        with get_session() as session:
+            session.exec(update(OutboxMessage).where(OutboxMessage.status == "sending").values(status="queued"))
+            waiting = session.exec(select(OutboxMessage.id).where(OutboxMessage.status == "queued").limit(1)).first()
+        if waiting is not None:
+            self.start()
+
+    def get(self, message_id: int) -> OutboxMessage | None:
+        with get_session() as session:
+            return session.get(OutboxMessage, message_id)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                self.drain()
+            except Exception as e:
+                logger.error(f"Outbox worker failed: {e}")
+                self._stop.wait(self.retry_base)
+                continue
+            self._wake.wait(self._next_wait())
+        self._hang_up()
+
+    def _next_wait(self) -> float:
+        """Seconds until the next retry is due or the idle session should be logged out."""
+        with get_session() as session:
+            due = session.exec(
+                select(OutboxMessage.next_attempt_at)
+                .where(OutboxMessage.status == "queued")
+                .order_by(OutboxMessage.next_attempt_at)
+                .limit(1)
+            ).first()
+        waits = [60.0]
+        if due is not None:
+            waits.append((due - _utcnow()).total_seconds())
+        if self._smtp is not None:
+            waits.append(self._last_used + self.idle_timeout - time.monotonic())
+        return max(0.0, min(waits))
+
+    def drain(self) -> int:
+        """Send every message that is due, batch by batch. Returns how many were sent."""
+        sent = 0
+        connection_failed = False
+        while not connection_failed and not self._stop.is_set():
+            batch = self._claim()
+            if not batch:
+                break
+            for i, row in enumerate(batch):
+                error = self._send(row)
+                if error is None:
+                    sent += 1
+                    continue
+                retry_at = self._record_failure(row, error)
+                if _connection_failed(error):
+                    # The rest of the batch would fail the same way, it waits for the retry
+                    self._postpone(batch[i + 1:], retry_at or _utcnow() + timedelta(seconds=self.retry_base))
+                    connection_failed = True
+                    break
+
+        if self._smtp is not None and time.monotonic() - self._last_used >= self.idle_timeout:
+            self._hang_up()
+        return sent
+
+    def _claim(self) -> list[OutboxMessage]:
+        with get_session() as session:
+            rows = list(session.exec(
+                select(OutboxMessage)
+                .where(OutboxMessage.status == "queued", OutboxMessage.next_attempt_at <= _utcnow())
+                .order_by(OutboxMessage.id)
+                .limit(self.batch_size)
+            ).all())
+            if rows:
+                session.exec(
+                    update(OutboxMessage)
+                    .where(OutboxMessage.id.in_([row.id for row in rows]))
+                    .values(status="sending")
+                )
+        return rows
+
+    def _session(self) -> smtplib.SMTP:
+        if self._smtp is not None and time.monotonic() - self._last_used >= NOOP_AFTER:
+            try:
+                code, _ = self._smtp.noop()
+            except (smtplib.SMTPException, OSError):
+                code = None
+            if code != 250:
+                self._hang_up()
+        if self._smtp is None:
+            self._smtp = self.connect()
+            self.logins += 1
+        return self._smtp
+
+    def _hang_up(self) -> None:
+        smtp, self._smtp = self._smtp, None
+        if smtp is not None:
+            try:
+                smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                smtp.close()
+
+    def _send(self, row: OutboxMessage) -> Exception | None:
+        try:
+            self._session().send_message(build_message(row))
+        except (MailUnavailable, smtplib.SMTPException, OSError) as e:
+            if _connection_failed(e):
+                self._hang_up()
+            return e
+        self._last_used = time.monotonic()
+        with get_session() as session:
+            session.exec(update(OutboxMessage).where(OutboxMessage.id == row.id).values(
+                status="sent", attempts=row.attempts + 1, sent_at=_utcnow(), last_error=None,
+            ))
+        return None
+
+    def _record_failure(self, row: OutboxMessage, error: Exception) -> datetime | None:
+        """Schedule a retry, or fail the message. Returns the retry time."""
+        attempts = row.attempts + 1
+        retry_at = None
+        if not _permanent(error) and attempts < self.max_attempts:
+            retry_at = _utcnow() + timedelta(seconds=min(self.retry_base * 2 ** (attempts - 1), RETRY_MAX))
+        logger.warning(f"Sending email {row.id} failed (attempt {attempts}): {error}")
+        with get_session() as session:
+            session.exec(update(OutboxMessage).where(OutboxMessage.id == row.id).values(
+                status="queued" if retry_at else "failed",
+                attempts=attempts,
+                last_error=str(error)[:500],
+                next_attempt_at=retry_at or row.next_attempt_at,
+            ))
+        return retry_at
+
+    def _postpone(self, rows: list[OutboxMessage], retry_at: datetime) -> None:
+        if not rows:
+            return
+        with get_session() as session:
+            session.exec(
+                update(OutboxMessage)
+                .where(OutboxMessage.id.in_([row.id for row in rows]))
+                .values(status="queued", next_attempt_at=retry_at)
+            )
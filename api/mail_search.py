@@ -0,0 +1,237 @@
+"""
+Full-text search over cached mail, in an SQLite FTS5 table.
+IMAP SEARCH TEXT against Proton Bridge decrypts every message on each query,
+so subjects, senders and text bodies are copied once into `mailsearch`, keyed
+by MailHeader.id, and queries are answered locally with bm25 ranking.
+A background MailIndexer fetches the text of messages not indexed yet in small
+batches, at a capped number of messages per second so it never crowds out the
+requests sharing the IMAP pool. Rows leave the index with their MailHeader.
+"""
+
+import html
+import imaplib
+import re
+import threading
+import time
+from collections import defaultdict
+
+from sqlalchemy import bindparam, func, text, update
+from sqlmodel import select
+
+from db import engine, get_session
+from imap_pool import CONNECTION_ERRORS, ImapPool, MailUnavailable
+from imap_protocol import (
+    decode_email_header,
+    decode_text,
+    decode_transfer,
+    fetch_headers,
+    fetch_sections,
+    quote_mailbox,
+)
+from logger import setup_logger
+from models import MailFolder, MailHeader
+
+logger = setup_logger("mail_search")
+
+# Pause before retrying after the server couldn't be reached
+RETRY_DELAY = 30.0
+
+# Accents are ignored so "reunion" finds "réunion"
+_SCHEMA = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS mailsearch "
+    "USING fts5(subject, sender, body, tokenize = 'unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS mailheader_unindex AFTER DELETE ON mailheader "
+    "BEGIN DELETE FROM mailsearch WHERE rowid = old.id; END",
+)
+
+_WORD = re.compile(r"\w+")
+_TAG = re.compile(r"<(script|style)\b.*?</\1\s*>|<[^>]+>", re.I | re.S)
+# Around matched terms in snippets, swapped for <mark> once the text is escaped
+_MARK_START, _MARK_END = "\x02", "\x03"
+
+
+def create_search_table() -> None:
+    """Create the FTS5 table and the trigger dropping deleted messages from it."""
+    with engine.begin() as conn:
+        for statement in _SCHEMA:
+            conn.execute(text(statement))
+
+
+def html_to_text(markup: str) -> str:
+    return " ".join(html.unescape(_TAG.sub(" ", markup)).split())
+
+
+def fts_query(query: str) -> str | None:
+    """An FTS5 query matching every word of `query`, the last one as a prefix."""
+    words = _WORD.findall(query)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def _message_text(mail, uid: int, parts, max_bytes: int) -> str:
+    """The plain text body of a message, or its HTML body without the markup."""
+    texts = [p for p in parts if p.is_text]
+    body = next((p for p in texts if p.content_type == "text/plain"), None) or next(iter(texts), None)
+    if body is None:
+        return ""
+    content = fetch_sections(mail, str(uid), [body.section], max_bytes).get(body.section, b"")
+    decoded = decode_text(decode_transfer(content, body.encoding), body.charset)
+    return html_to_text(decoded) if body.content_type == "text/html" else decoded
+
+
+class MailIndexer:
+    """Adds the text of an account's cached messages to the search index, newest first."""
+
+    def __init__(self, account: str, pool: ImapPool, batch_size: int = 50, rate: float = 20.0,
+                 max_bytes: int = 256_000, idle_interval: float = 60.0):
+        self.account = account
+        self.pool = pool
+        self.batch_size = batch_size
+        self.rate = rate  # messages per second, at most
+        self.max_bytes = max_bytes
+        self.idle_interval = idle_interval
+        self.last_rate: float | None = None  # messages per second in the last batch
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="mail-indexer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                indexed = self.index_batch()
+            except (MailUnavailable, imaplib.IMAP4.error, *CONNECTION_ERRORS) as e:
+                logger.warning(f"Mail indexing paused, retrying in {RETRY_DELAY:.0f}s: {e}")
+                self._stop.wait(RETRY_DELAY)
+                continue
+            except Exception as e:
+                logger.error(f"Mail indexing failed: {e}")
+                self._stop.wait(RETRY_DELAY)
+                continue
+            if not indexed:
+                self._stop.wait(self.idle_interval)
+
+    def _pending(self) -> list:
+        with get_session() as session:
+            return list(session.exec(
+                select(MailHeader.id, MailHeader.uid, MailHeader.subject, MailHeader.sender, MailFolder.name)
+                .join(MailFolder, MailFolder.id == MailHeader.folder_id)
+                .where(MailFolder.account == self.account, MailHeader.indexed.is_not(True))
+                .order_by(MailHeader.received_at.desc())
+                .limit(self.batch_size)
+            ).all())
+
+    def index_batch(self) -> int:
+        """Index up to batch_size messages, then wait out the rate cap. Returns how many."""
+        started = time.monotonic()
+        pending = self._pending()
+        if not pending:
+            return 0
+
+        by_folder = defaultdict(list)
+        for row in pending:
+            by_folder[row.name].append(row)
+
+        documents = []
+        with self.pool.session() as mail:
+            for name, rows in by_folder.items():
+                mail.select(quote_mailbox(name), readonly=True)
+                # One FETCH for the MIME trees, then one per message for its text part
+                found = fetch_headers(mail, ",".join(str(row.uid) for row in rows), uid=True, bodystructure=True)
+                parts = {message.uid: message.parts for message in found}
+                for row in rows:
+                    # Expunged since the last sync: indexed empty, the next sync deletes it
+                    body = _message_text(mail, row.uid, parts[row.uid], self.max_bytes) if row.uid in parts else ""
+                    documents.append({
+                        "id": row.id,
+                        "subject": row.subject,
+                        "sender": decode_email_header(row.sender),
+                        "body": body,
+                    })
+
+        with get_session() as session:
+            session.connection().execute(
+                text("INSERT OR REPLACE INTO mailsearch(rowid, subject, sender, body) "
+                     "VALUES (:id, :subject, :sender, :body)"),
+                documents,
+            )
+            table = MailHeader.__table__
+            session.exec(
+                update(table).where(table.c.id == bindparam("header_id")).values(indexed=True),
+                params=[{"header_id": doc["id"]} for doc in documents],
+            )
+
+        elapsed = time.monotonic() - started
+        self.last_rate = len(documents) / elapsed if elapsed else None
+        pause = len(documents) / self.rate - elapsed
+        if pause > 0:
+            self._stop.wait(pause)
+        return len(documents)
+
+    def status(self) -> dict:
+        """Indexing progress of the account's cached messages."""
+        with get_session() as session:
+            total, indexed = session.exec(
+                select(func.count(), func.count().filter(MailHeader.indexed.is_(True)))
+                .select_from(MailHeader)
+                .join(MailFolder, MailFolder.id == MailHeader.folder_id)
+                .where(MailFolder.account == self.account)
+            ).one()
+        return {
+            "total": total,
+            "indexed": indexed,
+            "pending": total - indexed,
+            "progress": indexed / total if total else 1.0,
+            "running": self.running,
+            "rate": self.last_rate,
+        }
+
+
+def search(account: str, query: str, folder: str | None = None, limit: int = 20) -> list[tuple[MailHeader, str]]:
+    """Cached messages matching `query`, best first, with a snippet of the matching text.
+
+    Snippets are HTML-escaped with the matched terms in <mark>.
+    """
+    match = fts_query(query)
+    if match is None:
+        return []
+    folder_filter = "AND f.name = :folder" if folder else ""
+    statement = text(f"""
+        SELECT h.id, snippet(mailsearch, -1, :start, :end, '…', 12) AS snippet
+        FROM mailsearch
+        JOIN mailheader h ON h.id = mailsearch.rowid
+        JOIN mailfolder f ON f.id = h.folder_id
+        WHERE mailsearch MATCH :match AND f.account = :account {folder_filter}
+        ORDER BY bm25(mailsearch, 5.0, 2.0, 1.0)
+        LIMIT :limit
+    """)
+    with get_session() as session:
+        hits = session.connection().execute(statement, {
+            "start": _MARK_START, "end": _MARK_END, "match": match,
+            "account": account, "folder": folder, "limit": limit,
+        }).all()
+        headers = {
+            row.id: row for row in session.exec(select(MailHeader).where(MailHeader.id.in_([h.id for h in hits])))
+        }
+    return [
+        (headers[hit.id], html.escape(hit.snippet).replace(_MARK_START, "<mark>").replace(_MARK_END, "</mark>"))
+        for hit in hits if hit.id in headers
+    ]
@@ -0,0 +1,77 @@
+"""
+Message and unread counts of mail folders from STATUS, without selecting them.
+STATUS costs one short command per folder (or one LIST for all of them on
+servers with LIST-STATUS), where a listing needs SELECT, SEARCH and a header
+FETCH. Results are cached for a few seconds and concurrent callers share a
+single request to the server, so badge refreshes from many tabs stay cheap.
+"""
+
+import imaplib
+import threading
+import time
+from dataclasses import dataclass
+
+from imap_pool import CONNECTION_ERRORS, ImapPool, MailUnavailable
+from imap_protocol import fetch_status
+from logger import setup_logger
+
+logger = setup_logger("mail_status")
+
+
+@dataclass
+class FolderStatus:
+    messages: int
+    unseen: int
+    uidnext: int | None
+
+
+class StatusCache:
+    """STATUS counts of an account's folders, reused for `ttl` seconds.
+
+    When the server can't be reached, the last counts are served.
+    """
+
+    def __init__(self, pool: ImapPool, ttl: float):
+        self.pool = pool
+        self.ttl = ttl
+        self._counts: dict[str, tuple[float, FolderStatus]] = {}  # name -> (monotonic time, status)
+        self._lock = threading.Lock()
+
+    def get(self, names: list[str]) -> dict[str, FolderStatus]:
+        """Counts of the folders that exist among `names`."""
+        names = list(dict.fromkeys("INBOX" if name.upper() == "INBOX" else name for name in names))
+        # One caller at a time asks the server, the others then find its results fresh
+        with self._lock:
+            now = time.monotonic()
+            stale = [name for name in names if name not in self._counts or now - self._counts[name][0] >= self.ttl]
+            if stale:
+                try:
+                    with self.pool.session() as mail:
+                        statuses = fetch_status(mail, stale)
+                except (MailUnavailable, imaplib.IMAP4.error, *CONNECTION_ERRORS) as e:
+                    if not all(name in self._counts for name in names):
+                        raise
+                    logger.warning(f"Mail STATUS failed, serving cached counts: {e}")
+                else:
+                    now = time.monotonic()
+                    for name in stale:
+                        if name in statuses:
+                            items = statuses[name]
+                            self._counts[name] = (now, FolderStatus(
+                                messages=items.get("MESSAGES", 0),
+                                unseen=items.get("UNSEEN", 0),
+                                uidnext=items.get("UIDNEXT"),
+                            ))
+                        else:
+                            self._counts.pop(name, None)
+            return {name: self._counts[name][1] for name in names if name in self._counts}
+
+    def cached(self, name: str) -> FolderStatus | None:
+        """The last counts of a folder however old, without asking the server."""
+        # No lock: it is held by the STATUS a caller of this doesn't want to wait for
+        entry = self._counts.get("INBOX" if name.upper() == "INBOX" else name)
+        return entry[1] if entry else None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._counts.clear()
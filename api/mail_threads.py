@@ -0,0 +1,246 @@
+"""
+Conversation threads of the cached folders, kept in the MailThread table.
+Messages are threaded as they are synced, so listing conversations never needs
+the headers of the whole folder. Servers with THREAD=REFERENCES group the
+folder's messages in one command. Otherwise a JWZ-style fallback runs locally:
+a new message joins the thread of any Message-ID it shares with the messages
+already threaded, its own or one it replies to, through the id table kept in
+MailThreadRef, and threads it links together are merged. Each MailThread row
+holds its message count and latest message, so a page of conversations is one
+query on (folder_id, latest_at).
+"""
+
+import imaplib
+
+from sqlalchemy import bindparam, delete, func, insert, update
+from sqlmodel import select
+
+from db import get_session
+from imap_protocol import FetchedHeaders, fetch_headers, fetch_threads, message_ids
+from models import MailFolder, MailHeader, MailThread, MailThreadRef
+
+# Messages per header FETCH, and ids per IN (...) list
+BATCH_SIZE = 500
+
+
+def _chunks(values: list, size: int = BATCH_SIZE):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def thread_fields(message: FetchedHeaders) -> dict:
+    """The message_id and parent_ids columns of a fetched message."""
+    own = message_ids(message.headers.get("Message-ID"))
+    parents = message_ids(message.headers.get("References"))
+    # References may be missing or truncated, In-Reply-To still names the parent
+    parents += [parent for parent in message_ids(message.headers.get("In-Reply-To"))[:1] if parent not in parents]
+    return {"message_id": own[0] if own else "", "parent_ids": " ".join(parents)}
+
+
+def _linked_ids(row) -> list[str]:
+    return [mid for mid in dict.fromkeys([row.message_id or "", *(row.parent_ids or "").split()]) if mid]
+
+
+def backfill_headers(mail: imaplib.IMAP4, folder: MailFolder) -> int:
+    """Fetch the threading headers of messages cached before they were stored. Returns how many."""
+    with get_session() as session:
+        uids = list(session.exec(
+            select(MailHeader.uid).where(MailHeader.folder_id == folder.id, MailHeader.message_id.is_(None))
+        ).all())
+    table = MailHeader.__table__
+    for batch in _chunks(uids):
+        fields = {message.uid: thread_fields(message) for message in fetch_headers(mail, ",".join(map(str, batch)), uid=True)}
+        # Expunged meanwhile: blank, the sync deletes it
+        blank = {"message_id": "", "parent_ids": ""}
+        with get_session() as session:
+            session.exec(
+                update(table)
+                .where(table.c.folder_id == folder.id, table.c.uid == bindparam("msg_uid"))
+                .values(message_id=bindparam("msg_id"), parent_ids=bindparam("msg_parents")),
+                params=[
+                    {"msg_uid": uid, "msg_id": found["message_id"], "msg_parents": found["parent_ids"]}
+                    for uid, found in ((uid, fields.get(uid, blank)) for uid in batch)
+                ],
+            )
+    return len(uids)
+
+
+def _new_thread(session, folder: MailFolder) -> int:
+    thread = MailThread(folder_id=folder.id)
+    session.add(thread)
+    session.flush()
+    return thread.id
+
+
+def _assign(session, assigned: dict[int, int]) -> None:
+    """Set the thread of messages, by MailHeader.id."""
+    if assigned:
+        table = MailHeader.__table__
+        session.exec(
+            update(table).where(table.c.id == bindparam("header_id")).values(thread_id=bindparam("thread")),
+            params=[{"header_id": header_id, "thread": thread} for header_id, thread in assigned.items()],
+        )
+
+
+def _server_threads(mail: imaplib.IMAP4, session, folder: MailFolder) -> set[int]:
+    """Thread the folder as the server does, keeping existing thread ids. Returns the threads changed."""
+    groups = fetch_threads(mail)
+    by_uid = {
+        row.uid: row for row in session.exec(
+            select(MailHeader.id, MailHeader.uid, MailHeader.thread_id).where(MailHeader.folder_id == folder.id)
+        ).all()
+    }
+    assigned: dict[int, int] = {}
+    changed: set[int] = set()
+    used: set[int] = set()
+    for group in groups:
+        members = [by_uid[uid] for uid in group if uid in by_uid]
+        if not members:
+            continue
+        # The oldest thread among the members carries on, a thread the server split gets a new one
+        existing = sorted({row.thread_id for row in members if row.thread_id is not None} - used)
+        thread = existing[0] if existing else _new_thread(session, folder)
+        used.add(thread)
+        for row in members:
+            if row.thread_id != thread:
+                assigned[row.id] = thread
+                changed.add(thread)
+                if row.thread_id is not None:
+                    changed.add(row.thread_id)
+    _assign(session, assigned)
+    return changed
+
+
+def _local_threads(session, folder: MailFolder, pending: list) -> set[int]:
+    """Thread messages by the Message-IDs they share with threaded ones. Returns the threads changed."""
+    wanted = list({mid for row in pending for mid in _linked_ids(row)})
+    known: dict[str, int] = {}
+    for chunk in _chunks(wanted):
+        known.update(session.exec(
+            select(MailThreadRef.message_id, MailThreadRef.thread_id)
+            .where(MailThreadRef.folder_id == folder.id, MailThreadRef.message_id.in_(chunk))
+        ).all())
+
+    merged: dict[int, int] = {}  # thread -> the thread it was merged into
+
+    def resolve(thread: int) -> int:
+        while thread in merged:
+            thread = merged[thread]
+        return thread
+
+    assigned: dict[int, int] = {}
+    added: set[str] = set()
+    for row in pending:
+        ids = _linked_ids(row)
+        threads = sorted({resolve(known[mid]) for mid in ids if mid in known})
+        if threads:
+            thread = threads[0]
+            for other in threads[1:]:
+                merged[other] = thread
+        else:
+            thread = _new_thread(session, folder)
+        for mid in ids:
+            if mid not in known:
+                known[mid] = thread
+                added.add(mid)
+        assigned[row.id] = thread
+
+    _assign(session, {header_id: resolve(thread) for header_id, thread in assigned.items()})
+    if added:
+        session.exec(insert(MailThreadRef), params=[
+            {"folder_id": folder.id, "message_id": mid, "thread_id": resolve(known[mid])} for mid in added
+        ])
+    for old in merged:
+        new = resolve(old)
+        session.exec(update(MailHeader).where(MailHeader.folder_id == folder.id, MailHeader.thread_id == old).values(thread_id=new))
+        session.exec(update(MailThreadRef).where(MailThreadRef.folder_id == folder.id, MailThreadRef.thread_id == old).values(thread_id=new))
+    return set(assigned.values()) | set(merged) | {resolve(old) for old in merged}
+
+
+def _refresh(session, folder: MailFolder, threads: set[int]) -> None:
+    """Recompute the count and latest message of threads, deleting those left empty."""
+    table = MailThread.__table__
+    for chunk in _chunks(sorted(threads)):
+        rows = session.exec(
+            select(MailHeader.thread_id, MailHeader.uid, MailHeader.subject, MailHeader.sender,
+                   MailHeader.date, MailHeader.received_at)
+            .where(MailHeader.folder_id == folder.id, MailHeader.thread_id.in_(chunk))
+            .order_by(MailHeader.received_at, MailHeader.uid)
+        ).all()
+        summaries: dict[int, dict] = {}
+        for row in rows:
+            summary = summaries.setdefault(row.thread_id, {"thread": row.thread_id, "first_subject": row.subject, "count": 0})
+            summary["count"] += 1
+            summary.update(latest=row.received_at, latest_uid_=row.uid, latest_from=row.sender, latest_sent=row.date)
+        if summaries:
+            session.exec(
+                update(table).where(table.c.id == bindparam("thread")).values(
+                    subject=bindparam("first_subject"), message_count=bindparam("count"), latest_at=bindparam("latest"),
+                    latest_uid=bindparam("latest_uid_"), latest_sender=bindparam("latest_from"),
+                    latest_date=bindparam("latest_sent"),
+                ),
+                params=list(summaries.values()),
+            )
+        empty = [thread for thread in chunk if thread not in summaries]
+        if empty:
+            session.exec(delete(MailThreadRef).where(MailThreadRef.folder_id == folder.id, MailThreadRef.thread_id.in_(empty)))
+            session.exec(delete(MailThread).where(MailThread.id.in_(empty)))
+
+
+def update_threads(mail: imaplib.IMAP4, folder: MailFolder, touched: set[int] | None = None) -> int:
+    """Thread the folder's messages that aren't in a thread yet, and refresh the threads that changed.
+
+    `touched` are threads that lost messages since the last update. Returns how many messages were threaded.
+    """
+    with get_session() as session:
+        pending = session.exec(
+            select(MailHeader.id, MailHeader.message_id, MailHeader.parent_ids)
+            .where(MailHeader.folder_id == folder.id, MailHeader.thread_id.is_(None))
+            .order_by(MailHeader.uid)
+        ).all()
+        changed = set(touched or ())
+        if pending:
+            if "THREAD=REFERENCES" in mail.capabilities:
+                changed |= _server_threads(mail, session, folder)
+            else:
+                changed |= _local_threads(session, folder, pending)
+        if changed:
+            _refresh(session, folder, changed)
+    return len(pending)
+
+
+def clear_threads(session, folder: MailFolder) -> None:
+    """Forget the folder's threads, when its cached messages are dropped."""
+    session.exec(delete(MailThreadRef).where(MailThreadRef.folder_id == folder.id))
+    session.exec(delete(MailThread).where(MailThread.folder_id == folder.id))
+
+
+def page_threads(folder: MailFolder, offset: int, limit: int) -> tuple[int, list[tuple[MailThread, int]]]:
+    """Number of threads and one page of them by latest message, each with its unread count."""
+    unread = (
+        select(func.count()).select_from(MailHeader)
+        .where(MailHeader.folder_id == folder.id, MailHeader.thread_id == MailThread.id, MailHeader.seen.is_(False))
+        .scalar_subquery()
+    )
+    with get_session() as session:
+        total = session.exec(
+            select(func.count()).select_from(MailThread).where(MailThread.folder_id == folder.id)
+        ).one()
+        rows = session.exec(
+            select(MailThread, unread)
+            .where(MailThread.folder_id == folder.id)
+            .order_by(MailThread.latest_at.desc(), MailThread.id.desc())
+            .offset(offset).limit(limit)
+        ).all()
+    return total, [(thread, count) for thread, count in rows]
+
+
+def thread_messages(folder: MailFolder, thread_id: int) -> list[MailHeader]:
+    """The messages of a thread, oldest first."""
+    with get_session() as session:
+        rows = session.exec(
+            select(MailHeader)
+            .where(MailHeader.folder_id == folder.id, MailHeader.thread_id == thread_id)
+            .order_by(MailHeader.received_at, MailHeader.uid)
+        ).all()
+    return list(rows)
@@ -0,0 +1,206 @@
+"""
+Push notifications for one mail folder over a single IMAP IDLE connection.
+A background thread keeps the folder open in IDLE, and whenever the server
+reports EXISTS, EXPUNGE or FETCH it resyncs the header cache and broadcasts
+the unread count and newly arrived headers to every subscriber. Subscribers
+are asyncio queues, one per open event stream, so any number of browser tabs
+share the same IMAP connection. Servers without IDLE are polled instead.
+"""
+
+import asyncio
+import contextlib
+import imaplib
+import re
+import select
+import threading
+import time
+from collections.abc import Callable
+
+from imap_pool import CONNECTION_ERRORS, MailUnavailable
+from imap_protocol import quote_mailbox
+from logger import setup_logger
+from mail_cache import MailCache
+
+logger = setup_logger("mail_watcher")
+
+# RFC 2177: clients should re-issue IDLE at least every 29 minutes
+IDLE_RENEW = 29 * 60
+# How often a blocked read checks whether the watcher was stopped
+READ_POLL = 1.0
+# Pause before reconnecting after the connection failed
+RETRY_DELAY = 30.0
+# Events kept per subscriber that isn't reading, older ones are dropped
+QUEUE_SIZE = 100
+
+_MAILBOX_CHANGE = re.compile(rb"\* \d+ (EXISTS|EXPUNGE|FETCH)\b", re.I)
+
+
+class _LineReader:
+    """CRLF lines read straight from the socket of an IMAP connection in IDLE."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self._buffer = b""
+
+    def readline(self, timeout: float) -> bytes | None:
+        """The next line, None if none arrived within `timeout`, b"" at EOF."""
+        while b"\n" not in self._buffer:
+            # TLS sockets can hold decrypted bytes select() doesn't see
+            pending = getattr(self.sock, "pending", None)
+            if not (pending and pending()) and not select.select([self.sock], [], [], timeout)[0]:
+                return None
+            chunk = self.sock.recv(4096)
+            if not chunk:
+                return b""
+            self._buffer += chunk
+        line, _, self._buffer = self._buffer.partition(b"\n")
+        return line + b"\n"
+
+
+class MailWatcher:
+    """Keeps a folder's cached listing current and tells subscribers what changed.
+
+    Started lazily by the first subscriber, stopped on shutdown. The IDLE
+    session is opened with `connect` rather than taken from the request pool,
+    since it stays busy for as long as the watcher runs.
+    """
+
+    def __init__(self, connect: Callable[[], imaplib.IMAP4], cache: MailCache, folder: str = "INBOX",
+                 poll_interval: float = 60.0):
+        self.connect = connect
+        self.cache = cache
+        self.folder = folder
+        self.poll_interval = poll_interval
+        self.unread: int | None = None
+        self._subscribers: dict[asyncio.Queue, asyncio.AbstractEventLoop] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        with self._lock:
+            if self.running:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="mail-watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stop watching and end every subscriber's stream."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self._publish(None)
+
+    def subscribe(self) -> asyncio.Queue:
+        """A queue receiving (event, payload) tuples, then None once the watcher stops."""
+        queue = asyncio.Queue(QUEUE_SIZE)
+        with self._lock:
+            self._subscribers[queue] = asyncio.get_running_loop()
+        self.start()
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        with self._lock:
+            self._subscribers.pop(queue, None)
+
+    def _publish(self, event: tuple[str, object] | None) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers.items())
+        for queue, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, event)
+            except RuntimeError:
+                # The subscriber's event loop is gone
+                self.unsubscribe(queue)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                mail = self.connect()
+            except (MailUnavailable, imaplib.IMAP4.error, *CONNECTION_ERRORS) as e:
+                logger.warning(f"Mail watcher can't connect, retrying in {RETRY_DELAY:.0f}s: {e}")
+                self._stop.wait(RETRY_DELAY)
+                continue
+            try:
+                self._watch(mail)
+            except (MailUnavailable, imaplib.IMAP4.error, *CONNECTION_ERRORS) as e:
+                logger.warning(f"Mail watcher connection lost, reconnecting: {e}")
+                self._stop.wait(RETRY_DELAY)
+            except Exception as e:
+                logger.error(f"Mail watcher failed: {e}")
+                self._stop.wait(RETRY_DELAY)
+            finally:
+                # Mid-IDLE the connection can't be logged out cleanly
+                with contextlib.suppress(OSError):
+                    mail.shutdown()
+
+    def _watch(self, mail: imaplib.IMAP4) -> None:
+        status, data = mail.select(quote_mailbox(self.folder), readonly=True)
+        if status != "OK":
+            raise mail.error(f"Cannot open {self.folder}: {data}")
+        self.refresh()
+
+        if "IDLE" not in mail.capabilities:
+            logger.info(f"No IDLE support, polling {self.folder} every {self.poll_interval:.0f}s")
+            while not self._stop.wait(self.poll_interval):
+                mail.noop()
+                self.refresh()
+            return
+
+        reader = _LineReader(mail.sock)
+        while not self._stop.is_set():
+            if self._idle(mail, reader):
+                self.refresh()
+
+    def _idle(self, mail: imaplib.IMAP4, reader: _LineReader) -> bool:
+        """One IDLE command, ended by a mailbox change, the renew timeout or stop()."""
+        tag = mail._new_tag()
+        mail.sock.sendall(tag + b" IDLE\r\n")
+        line = reader.readline(READ_POLL * 10)
+        if not line or not line.startswith(b"+"):
+            raise mail.abort(f"IDLE refused: {line!r}")
+
+        changed = False
+        renew_at = time.monotonic() + IDLE_RENEW
+        while not changed and not self._stop.is_set() and time.monotonic() < renew_at:
+            line = reader.readline(READ_POLL)
+            if line is None:
+                continue
+            if not line or line.upper().startswith(b"* BYE"):
+                raise mail.abort("Connection closed during IDLE")
+            changed = bool(_MAILBOX_CHANGE.match(line))
+
+        mail.sock.sendall(b"DONE\r\n")
+        while True:
+            line = reader.readline(READ_POLL * 10)
+            if not line:
+                raise mail.abort("No reply to DONE")
+            if line.startswith(tag):
+                break
+        return changed
+
+    def refresh(self) -> None:
+        """Resync the folder, then publish new headers and the unread count if it changed."""
+        before = self.cache.folder(self.folder)
+        folder = self.cache.sync(self.folder, force=True)
+        # Everything is new on the first sync, that isn't worth a notification each
+        if before is not None:
+            for row in self.cache.since(folder, before.last_uid):
+                self._publish(("message", row))
+        count, _ = self.cache.unread(folder, limit=0)
+        if count != self.unread:
+            self.unread = count
+            self._publish(("unread", count))
+
+
+def _offer(queue: asyncio.Queue, event) -> None:
+    """Put an event on a subscriber queue, dropping its oldest one if it's full."""
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(event)
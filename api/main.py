@@ -1,3 +1,5 @@
+import asyncio
+import contextlib
 import os
 import sys
 import time
@@ -13,6 +15,7 @@ from slowapi.errors import RateLimitExceeded
 from slowapi.util import get_remote_address
 
 from auth import router as auth_router
+from calendar_cache import refresh_periodically
 from config import get_settings
 from db import init_db
 from exceptions import AppException, app_exception_handler, general_exception_handler
@@ -32,7 +35,30 @@ async def lifespan(app: FastAPI):
     logger.info(f"✅ {settings.app_name} v{settings.app_version} started")
     logger.info(f"📊 Database: {settings.database_url}")
     logger.info(f"🔒 Security: Rate limiting enabled ({settings.rate_limit_per_minute}/min)")
+
+    calendar_refresher = None
+    calendar_urls = [url for url in settings.calendar_urls if hyperplanning.validate_calendar_url(url)]
+    if settings.hyperplanning_background_refresh and calendar_urls:
+        calendar_refresher = asyncio.create_task(refresh_periodically(calendar_urls))
+        logger.info(f"📅 Refreshing {len(calendar_urls)} calendar(s) every {settings.hyperplanning_cache_ttl:.0f}s")
+
+    if settings.mail_search_indexing:
+        email.mail_indexer.start()
+    # Send what a previous run left in the outbox
+    email.mail_outbox.resume()
+
     yield
+
+    if calendar_refresher:
+        calendar_refresher.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await calendar_refresher
+    email.mail_watcher.stop()
+    email.mail_indexer.stop()
+    email.mail_outbox.stop()
+    email.mail_pool.close_all()
+    for account in email.extra_accounts:
+        account.cache.pool.close_all()
     logger.info(f"🛑 {settings.app_name} stopped")
 
 
@@ -1,10 +1,14 @@
 from __future__ import annotations
 
-from datetime import datetime, timezone
+from datetime import date, datetime, timezone
 
+import pytz
 from pydantic import field_validator
+from sqlalchemy import JSON, Column, Index, UniqueConstraint
 from sqlmodel import Field, SQLModel
 
+from config import get_settings
+
 VALID_STATUS = {"todo", "doing", "done", "archived"}
 VALID_PRIORITY = {"low", "normal", "high"}
 VALID_RECURRENCE = {"daily", "weekly", "monthly", None}
@@ -24,7 +28,9 @@ class Task(SQLModel, table=True):
 
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), index=True)
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), index=True)
-    completed_at: datetime | None = None
+    completed_at: datetime | None = Field(default=None, index=True)
+    # Day of completed_at in the user's timezone, stored so day buckets stay indexable
+    completed_local_date: date | None = Field(default=None, index=True)
 
     @field_validator('priority')
     @classmethod
@@ -48,6 +54,58 @@ class Task(SQLModel, table=True):
         return v
 
 
+def local_date(dt: datetime) -> date:
+    """Calendar day of `dt` in the configured user timezone (naive values are UTC)."""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(pytz.timezone(get_settings().user_timezone)).date()
+
+
+def split_tags(tags: str | None) -> list[str]:
+    """Split a comma-separated tags string into stripped, de-duplicated tags."""
+    if not tags:
+        return []
+    return list(dict.fromkeys(t.strip() for t in tags.split(",") if t.strip()))
+
+
+class TaskTag(SQLModel, table=True):
+    """One row per (tag, top-level task), denormalized for per-tag analytics.
+
+    Rows are clustered by tag (WITHOUT ROWID) so a GROUP BY tag is a single
+    ordered scan that never has to join back to the task table.
+    """
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    tag: str = Field(primary_key=True, max_length=500)
+    task_id: int = Field(primary_key=True, index=True)
+    status: str
+    due_date: datetime | None = None
+    completion_hours: float | None = None
+
+    @staticmethod
+    def rows_for(task: Task) -> list[dict]:
+        """Column values of the rows describing `task`, ready for a bulk insert."""
+        if task.parent_id is not None:
+            return []
+
+        completion_hours = None
+        if task.completed_at and task.created_at:
+            # SQLite hands datetimes back naive, both sides are UTC
+            delta = task.completed_at.replace(tzinfo=None) - task.created_at.replace(tzinfo=None)
+            completion_hours = delta.total_seconds() / 3600
+
+        return [
+            {
+                "tag": tag,
+                "task_id": task.id,
+                "status": task.status,
+                "due_date": task.due_date,
+                "completion_hours": completion_hours,
+            }
+            for tag in split_tags(task.tags)
+        ]
+
+
 class TaskCreate(SQLModel):
     title: str = Field(min_length=1, max_length=200)
     description: str | None = Field(default=None, max_length=2000)
@@ -125,6 +183,8 @@ class BulkDeletePayload(SQLModel):
 
 
 class Grade(SQLModel, table=True):
+    __table_args__ = (Index("ix_grade_subject_date", "subject", "date"),)
+
     id: int | None = Field(default=None, primary_key=True)
     subject: str = Field(index=True, min_length=1, max_length=200)
     date: str = Field(max_length=50)
@@ -148,3 +208,124 @@ class GradeOut(SQLModel):
 
 class GradeImportPayload(SQLModel):
     grades: list[GradeCreate] = Field(min_length=1, max_length=100)
+
+
+class Course(SQLModel, table=True):
+    """A Hyperplanning VEVENT, upserted by uid from each calendar download."""
+    __table_args__ = (Index("ix_course_subject_start", "subject", "start"),)
+
+    uid: str = Field(primary_key=True, max_length=500)
+    subject: str = Field(max_length=500)
+    start: datetime = Field(index=True)  # UTC
+    end: datetime  # UTC
+    room: str = ""
+    teacher: str = ""
+    type: str = ""
+    all_day: bool = False
+    sequence: int = 0
+    last_modified: datetime | None = None  # UTC
+    # Calendar URL the course came from, NULL for rows stored before multi-calendar support
+    feed: str | None = Field(default=None, index=True, max_length=2000)
+
+
+class CourseChange(SQLModel, table=True):
+    """A course added, moved or cancelled between two calendar downloads."""
+    id: int | None = Field(default=None, primary_key=True)
+    uid: str = Field(index=True, max_length=500)
+    kind: str  # "added", "updated" or "cancelled"
+    subject: str = Field(max_length=500)
+    start: datetime  # UTC
+    # Changed fields as {field: [old, new]}, empty for additions and cancellations
+    changes: dict = Field(default_factory=dict, sa_column=Column(JSON))
+    detected_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), index=True)
+
+
+class MailFolder(SQLModel, table=True):
+    """Sync state of an IMAP folder whose message listing is cached in MailHeader."""
+    __table_args__ = (UniqueConstraint("account", "name"),)
+
+    id: int | None = Field(default=None, primary_key=True)
+    account: str = Field(max_length=200)
+    name: str = Field(max_length=500)
+    uidvalidity: int
+    # Messages up to this UID are cached, the next sync fetches from last_uid + 1
+    last_uid: int = 0
+    # HIGHESTMODSEQ at the last sync, NULL when the server has no CONDSTORE
+    highestmodseq: int | None = None
+    synced_at: datetime | None = None  # UTC
+
+
+class MailHeader(SQLModel, table=True):
+    """Listing fields of a cached message, identified by (UIDVALIDITY, UID) within its folder."""
+    __table_args__ = (
+        UniqueConstraint("folder_id", "uidvalidity", "uid"),
+        Index("ix_mailheader_folder_received", "folder_id", "received_at"),
+        Index("ix_mailheader_folder_seen_received", "folder_id", "seen", "received_at"),
+        Index("ix_mailheader_folder_indexed", "folder_id", "indexed"),
+        Index("ix_mailheader_folder_thread_received", "folder_id", "thread_id", "received_at"),
+    )
+
+    id: int | None = Field(default=None, primary_key=True)
+    folder_id: int = Field(foreign_key="mailfolder.id")
+    uidvalidity: int
+    uid: int
+    subject: str = ""
+    sender: str = ""
+    date: str = ""  # Date header as sent
+    received_at: datetime  # INTERNALDATE, UTC
+    seen: bool = False
+    # Text added to the mailsearch full-text index, see mail_search
+    indexed: bool = False
+    # Message-ID and the ids it replies to (References, In-Reply-To), space separated.
+    # NULL for messages cached before these headers were fetched, "" when absent.
+    message_id: str | None = None
+    parent_ids: str | None = None
+    thread_id: int | None = None  # MailThread.id, see mail_threads
+
+
+class MailThread(SQLModel, table=True):
+    """A conversation of a cached folder, with what its listing shows, see mail_threads."""
+    __table_args__ = (Index("ix_mailthread_folder_latest", "folder_id", "latest_at"),)
+
+    id: int | None = Field(default=None, primary_key=True)
+    folder_id: int = Field(foreign_key="mailfolder.id")
+    subject: str = ""  # of the first message
+    message_count: int = 0
+    # The latest message, threads are listed by it
+    latest_at: datetime | None = None  # UTC
+    latest_uid: int | None = None
+    latest_sender: str = ""
+    latest_date: str = ""
+
+
+class MailThreadRef(SQLModel, table=True):
+    """Thread of each Message-ID seen in a folder, its messages' own and those they reply to.
+
+    Only the local threading fallback uses it, servers with THREAD=REFERENCES group messages themselves.
+    """
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    folder_id: int = Field(primary_key=True)
+    message_id: str = Field(primary_key=True, max_length=1000)
+    thread_id: int = Field(index=True)
+
+
+class OutboxMessage(SQLModel, table=True):
+    """An email waiting to be sent, or the outcome of sending it, see mail_outbox."""
+    __table_args__ = (
+        Index("ix_outboxmessage_status_next_attempt", "status", "next_attempt_at"),
+    )
+
+    id: int | None = Field(default=None, primary_key=True)
+    sender: str = Field(max_length=500)
+    to: str = Field(max_length=500)
+    subject: str = Field(max_length=500)
+    body: str
+    message_id: str = Field(max_length=300)  # Message-ID header, set when queued
+    # queued -> sending -> sent, or back to queued for a retry, or failed
+    status: str = Field(default="queued", max_length=20)
+    attempts: int = 0
+    last_error: str | None = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc).replace(tzinfo=None))  # UTC
+    next_attempt_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc).replace(tzinfo=None))  # UTC
+    sent_at: datetime | None = None  # UTC
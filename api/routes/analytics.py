@@ -1,73 +1,100 @@
 """Analytics and productivity statistics endpoints."""
 
-from datetime import datetime, timedelta, timezone
+from datetime import date, datetime, timedelta, timezone
 
-from fastapi import APIRouter
-from sqlalchemy import func
+from fastapi import APIRouter, Query
+from sqlalchemy import and_, case, delete, func, insert
 from sqlmodel import select
 
 from db import get_session
 from logger import setup_logger
-from models import Task
+from models import Task, TaskTag, local_date
 
 router = APIRouter(prefix="/analytics", tags=["analytics"])
 logger = setup_logger("analytics")
 
+# Day-bucket aggregates are cached until a completion lands on a day they cover.
+_heatmap_cache: dict[int, dict] = {}
+_streak_cache: dict[date, dict] = {}
+
+
+def invalidate_completion_day(day: date | None) -> None:
+    """Drop cached aggregates covering the local `day` a task was (un)completed on."""
+    if day is None:
+        return
+    _heatmap_cache.pop(day.year, None)
+    _streak_cache.clear()
+
+
+def sync_task_tags(session, task: Task) -> None:
+    """Rewrite the TaskTag rows of `task` after it was created or updated."""
+    session.exec(delete(TaskTag).where(TaskTag.task_id == task.id))
+    rows = TaskTag.rows_for(task)
+    if rows:
+        session.exec(insert(TaskTag), params=rows)
+
+
+def delete_task_tags(session, task_ids: list[int]) -> None:
+    """Drop the TaskTag rows of deleted tasks."""
+    session.exec(delete(TaskTag).where(TaskTag.task_id.in_(task_ids)))
+
+
+def _today() -> date:
+    return local_date(datetime.now(timezone.utc))
+
+
+def _completions_per_day(session, start: date | None = None, end: date | None = None) -> dict[date, int]:
+    """Count completed top-level tasks per local day, from an index range scan."""
+    day = Task.completed_local_date
+    statement = (
+        select(day, func.count(Task.id).label("count"))
+        .where(day.is_not(None))
+        .where(Task.parent_id.is_(None))
+    )
+    if start is not None:
+        statement = statement.where(day >= start)
+    if end is not None:
+        statement = statement.where(day < end)
+    statement = statement.group_by(day).order_by(day)
+
+    return {r.completed_local_date: r.count for r in session.exec(statement).all()}
+
 
 @router.get("/tasks/daily")
 def get_daily_task_stats(days: int = 30):
     """Get task completion stats for the last N days."""
-    with get_session() as session:
-        end_date = datetime.now(timezone.utc)
-        start_date = end_date - timedelta(days=days)
+    today = _today()
+    start_date = today - timedelta(days=days - 1)
 
-        # Get completed tasks grouped by day
-        statement = (
-            select(
-                func.date(Task.completed_at).label("date"),
-                func.count(Task.id).label("count"),
-            )
-            .where(Task.completed_at.is_not(None))
-            .where(Task.completed_at >= start_date)
-            .where(Task.parent_id.is_(None))
-            .group_by(func.date(Task.completed_at))
-            .order_by(func.date(Task.completed_at))
-        )
-
-        results = session.exec(statement).all()
-
-        # Fill in missing days with 0
-        date_counts = {str(r.date): r.count for r in results}
-        daily_stats = []
+    with get_session() as session:
+        date_counts = _completions_per_day(session, start_date)
 
-        for i in range(days):
-            date = (start_date + timedelta(days=i)).date()
-            daily_stats.append({
-                "date": str(date),
-                "completed": date_counts.get(str(date), 0),
-            })
+    # Fill in missing days with 0
+    daily_stats = []
+    for i in range(days):
+        day = start_date + timedelta(days=i)
+        daily_stats.append({
+            "date": str(day),
+            "completed": date_counts.get(day, 0),
+        })
 
-        return daily_stats
+    return daily_stats
 
 
 @router.get("/tasks/weekly")
 def get_weekly_task_stats(weeks: int = 12):
     """Get task completion stats for the last N weeks."""
     with get_session() as session:
-        end_date = datetime.now(timezone.utc)
-        start_date = end_date - timedelta(weeks=weeks)
+        start_date = _today() - timedelta(weeks=weeks)
+        week = func.strftime("%Y-%W", Task.completed_local_date)
 
         # Get completed tasks grouped by week
         statement = (
-            select(
-                func.strftime("%Y-%W", Task.completed_at).label("week"),
-                func.count(Task.id).label("count"),
-            )
-            .where(Task.completed_at.is_not(None))
-            .where(Task.completed_at >= start_date)
+            select(week.label("week"), func.count(Task.id).label("count"))
+            .where(Task.completed_local_date >= start_date)
             .where(Task.parent_id.is_(None))
-            .group_by(func.strftime("%Y-%W", Task.completed_at))
-            .order_by(func.strftime("%Y-%W", Task.completed_at))
+            .group_by(week)
+            .order_by(week)
         )
 
         results = session.exec(statement).all()
@@ -163,28 +190,28 @@ def get_productivity_summary():
     """Get a complete productivity summary."""
     with get_session() as session:
         now = datetime.now(timezone.utc)
-        today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        week_start = today_start - timedelta(days=now.weekday())
-        month_start = today_start.replace(day=1)
+        today = _today()
+        week_start = today - timedelta(days=today.weekday())
+        month_start = today.replace(day=1)
 
         # Tasks completed today
         today_completed = session.exec(
             select(func.count(Task.id))
-            .where(Task.completed_at >= today_start)
+            .where(Task.completed_local_date == today)
             .where(Task.parent_id.is_(None))
         ).one()
 
         # Tasks completed this week
         week_completed = session.exec(
             select(func.count(Task.id))
-            .where(Task.completed_at >= week_start)
+            .where(Task.completed_local_date >= week_start)
             .where(Task.parent_id.is_(None))
         ).one()
 
         # Tasks completed this month
         month_completed = session.exec(
             select(func.count(Task.id))
-            .where(Task.completed_at >= month_start)
+            .where(Task.completed_local_date >= month_start)
             .where(Task.parent_id.is_(None))
         ).one()
 
@@ -227,3 +254,102 @@ def get_productivity_summary():
             "overdue": overdue_tasks,
             "completion_rate": completion_rate,
         }
+
+
+@router.get("/tags")
+def get_tag_stats():
+    """Get total, done, overdue and completion time per tag in a single query."""
+    now = datetime.now(timezone.utc)
+
+    total = func.count()
+    statement = (
+        select(
+            TaskTag.tag,
+            total.label("total"),
+            func.sum(case((TaskTag.status == "done", 1), else_=0)).label("done"),
+            func.sum(
+                case((and_(TaskTag.status.in_(["todo", "doing"]), TaskTag.due_date < now), 1), else_=0)
+            ).label("overdue"),
+            func.avg(TaskTag.completion_hours).label("average_hours"),
+        )
+        .group_by(TaskTag.tag)
+        .order_by(total.desc(), TaskTag.tag)
+    )
+
+    with get_session() as session:
+        results = session.exec(statement).all()
+
+    return [
+        {
+            "tag": r.tag,
+            "total": r.total,
+            "done": r.done,
+            "overdue": r.overdue,
+            "completion_rate": round(r.done / r.total * 100, 1),
+            "average_completion_hours": round(r.average_hours or 0, 1),
+        }
+        for r in results
+    ]
+
+
+@router.get("/heatmap")
+def get_heatmap(year: int | None = Query(None, ge=2000, le=2100)):
+    """Get the number of completed tasks for every day of a year."""
+    year = year or _today().year
+
+    cached = _heatmap_cache.get(year)
+    if cached is not None:
+        return cached
+
+    with get_session() as session:
+        counts = _completions_per_day(session, date(year, 1, 1), date(year + 1, 1, 1))
+
+    first_day = date(year, 1, 1)
+    days = []
+    for i in range((date(year + 1, 1, 1) - first_day).days):
+        day = first_day + timedelta(days=i)
+        days.append({"date": day.isoformat(), "count": counts.get(day, 0)})
+
+    heatmap = {
+        "year": year,
+        "total": sum(counts.values()),
+        "active_days": len(counts),
+        "max": max(counts.values(), default=0),
+        "days": days,
+    }
+    _heatmap_cache[year] = heatmap
+    return heatmap
+
+
+@router.get("/streaks")
+def get_streaks():
+    """Get the current and longest streaks of consecutive days with a completed task."""
+    today = _today()
+
+    cached = _streak_cache.get(today)
+    if cached is not None:
+        return cached
+
+    with get_session() as session:
+        active_days = sorted(_completions_per_day(session))
+
+    longest = 0
+    run = 0
+    previous = None
+    for day in active_days:
+        run = run + 1 if previous and day - previous == timedelta(days=1) else 1
+        longest = max(longest, run)
+        previous = day
+
+    # The streak is still alive if the last active day is today or yesterday
+    current = run if previous and today - previous <= timedelta(days=1) else 0
+
+    streaks = {
+        "current_streak": current,
+        "longest_streak": longest,
+        "active_days": len(active_days),
+        "last_active_date": previous.isoformat() if previous else None,
+    }
+    _streak_cache.clear()
+    _streak_cache[today] = streaks
+    return streaks
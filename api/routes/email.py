@@ -1,14 +1,43 @@
+import asyncio
 import contextlib
-import email
+import functools
 import imaplib
+import json
 import os
-from email.header import decode_header
+import smtplib
+import time
+from datetime import datetime
+from typing import Literal
+from urllib.parse import quote
 
 from dotenv import load_dotenv
-from fastapi import APIRouter
+from fastapi import APIRouter, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
+import mail_search
+import mail_threads
+from config import MailAccountSettings, get_settings
+from imap_pool import ImapPool, MailUnavailable
+from imap_protocol import (
+    BodyPart,
+    decode_email_header,
+    decode_text,
+    decode_transfer,
+    fetch_headers,
+    fetch_sections,
+)
+from mail_accounts import MailAccount, recent_unread, unread_counts
+from mail_attachments import parse_range, part_layout, stream_part
+from mail_cache import MailCache
+from mail_outbox import OutboxWorker
+from mail_search import MailIndexer
+from mail_status import StatusCache
+from mail_watcher import MailWatcher
+from models import MailHeader
+
 load_dotenv()
+settings = get_settings()
 
 router = APIRouter(prefix="/email", tags=["Email"])
 
@@ -18,12 +47,19 @@ class EmailItem(BaseModel):
     subject: str
     sender: str
     date: str
+    unread: bool = False
 
 class EmailSummary(BaseModel):
     count_unread: int
     emails: list[EmailItem] = []
     error: str = ""
 
+class AttachmentInfo(BaseModel):
+    part: str  # MIME section, e.g. "2" or "1.3"
+    filename: str
+    content_type: str
+    size: int  # bytes, estimated from the encoded size
+
 class EmailDetail(BaseModel):
     id: str
     subject: str
@@ -31,123 +67,152 @@ class EmailDetail(BaseModel):
     date: str
     body: str
     html_body: str | None = None
+    # A text part was longer than MAIL_BODY_MAX_BYTES and was cut
+    truncated: bool = False
+    attachments: list[AttachmentInfo] = []
     error: str = ""
 
 
-def decode_email_header(header):
-    if not header:
-        return "(No subject)"
-    decoded_list = decode_header(header)
-    result = ""
-    for text, encoding in decoded_list:
-        if isinstance(text, bytes):
-            result += text.decode(encoding if encoding else "utf-8", errors="ignore")
-        else:
-            result += str(text)
-    return result
-
-
-def get_email_body(msg):
-    body = ""
-    html_body = None
-
-    if msg.is_multipart():
-        for part in msg.walk():
-            content_type = part.get_content_type()
-            content_disposition = str(part.get("Content-Disposition", ""))
-
-            if "attachment" in content_disposition:
-                continue
-
-            if content_type == "text/plain":
-                try:
-                    charset = part.get_content_charset() or "utf-8"
-                    body = part.get_payload(decode=True).decode(charset, errors="ignore")
-                except Exception:
-                    body = str(part.get_payload())
-            elif content_type == "text/html" and not html_body:
-                try:
-                    charset = part.get_content_charset() or "utf-8"
-                    html_body = part.get_payload(decode=True).decode(charset, errors="ignore")
-                except Exception:
-                    html_body = str(part.get_payload())
-    else:
-        content_type = msg.get_content_type()
-        try:
-            charset = msg.get_content_charset() or "utf-8"
-            payload = msg.get_payload(decode=True)
-            if payload:
-                body = payload.decode(charset, errors="ignore")
-        except Exception:
-            body = str(msg.get_payload())
-
-        if content_type == "text/html":
-            html_body = body
-            body = ""
-
-    return body, html_body
+def _proton_account() -> MailAccountSettings:
+    return MailAccountSettings(
+        name="proton",
+        host=os.getenv("PROTON_BRIDGE_HOST", "127.0.0.1"),
+        port=int(os.getenv("PROTON_BRIDGE_PORT", "1143")),
+        user=os.getenv("PROTON_BRIDGE_USER") or "",
+        password=os.getenv("PROTON_BRIDGE_PASS") or "",
+        ssl=False,
+    )
 
 
-def connect_to_mail():
-    host = os.getenv("PROTON_BRIDGE_HOST", "127.0.0.1")
-    port = int(os.getenv("PROTON_BRIDGE_PORT", "1143"))
-    user = os.getenv("PROTON_BRIDGE_USER")
-    password = os.getenv("PROTON_BRIDGE_PASS")
-
-    if not all([user, password]):
+def connect_to_mail(account: MailAccountSettings | None = None):
+    """Log in to `account`, the Proton Bridge by default. Returns (session, None) or (None, error)."""
+    account = account or _proton_account()
+    if not all([account.user, account.password]):
         return None, "Incomplete .env configuration"
 
     try:
-        mail = imaplib.IMAP4(host, port)
-        with contextlib.suppress(Exception):
-            mail.starttls()
-        mail.login(user, password)
+        if account.ssl:
+            mail = imaplib.IMAP4_SSL(account.host, account.port, timeout=settings.api_timeout)
+        else:
+            mail = imaplib.IMAP4(account.host, account.port, timeout=settings.api_timeout)
+            with contextlib.suppress(Exception):
+                mail.starttls()
+        mail.login(account.user, account.password)
+        # Lets SELECT report HIGHESTMODSEQ, so syncs only fetch flags that changed
+        if "CONDSTORE" in mail.capabilities and "ENABLE" in mail.capabilities:
+            mail.enable("CONDSTORE")
         return mail, None
     except ConnectionRefusedError:
-        return None, "Proton Bridge not running or wrong port"
+        if account.name == "proton":
+            return None, "Proton Bridge not running or wrong port"
+        return None, f"{account.name}: server not running or wrong port"
     except imaplib.IMAP4.error as e:
         return None, f"IMAP error: {str(e)}"
     except Exception as e:
         return None, f"Error: {str(e)}"
 
 
-@router.get("/proton/unread", response_model=EmailSummary)
-def get_proton_unread():
-    mail, error = connect_to_mail()
+def _login(account: MailAccountSettings | None = None) -> imaplib.IMAP4:
+    mail, error = connect_to_mail(account)
     if error:
-        return EmailSummary(count_unread=0, error=error)
+        raise MailUnavailable(error)
+    return mail
+
+
+# Logged-in Bridge sessions reused across requests, see imap_pool
+mail_pool = ImapPool(
+    _login,
+    size=settings.mail_pool_size,
+    idle_timeout=settings.mail_pool_idle_timeout,
+    wait_timeout=settings.api_timeout,
+)
+
+# Local listing of the Bridge inbox, see mail_cache
+mail_cache = MailCache("proton", mail_pool, sync_interval=settings.mail_sync_interval)
+
+def _smtp_login() -> smtplib.SMTP:
+    host = os.getenv("PROTON_BRIDGE_SMTP_HOST", "127.0.0.1")
+    port = int(os.getenv("PROTON_BRIDGE_SMTP_PORT", "1025"))
+    user = os.getenv("PROTON_BRIDGE_SMTP_USER")
+    password = os.getenv("PROTON_BRIDGE_SMTP_PASS")
+    if not all([user, password]):
+        raise MailUnavailable("Incomplete SMTP configuration")
 
-    try:
-        mail.select("inbox")
-        status, messages = mail.search(None, "(UNSEEN)")
+    server = smtplib.SMTP(host, port, timeout=settings.api_timeout)
+    with contextlib.suppress(Exception):
+        server.starttls()
+    server.login(user, password)
+    return server
 
-        email_ids = messages[0].split()
-        count = len(email_ids)
-        email_list = []
 
-        for e_id in reversed(email_ids[-5:]):
-            try:
-                _, msg_data = mail.fetch(e_id, "(RFC822.HEADER)")
+# Background sending over one SMTP session, see mail_outbox
+mail_outbox = OutboxWorker(_smtp_login, idle_timeout=settings.mail_pool_idle_timeout)
+
+# Folder counts from STATUS for badges, see mail_status
+mail_status = StatusCache(mail_pool, ttl=settings.mail_status_ttl)
+
+# One IDLE connection feeding every open /events stream, see mail_watcher
+mail_watcher = MailWatcher(_login, mail_cache, poll_interval=settings.mail_sync_interval)
+
+# Background filling of the full-text index, see mail_search
+mail_indexer = MailIndexer(
+    "proton",
+    mail_pool,
+    batch_size=settings.mail_index_batch_size,
+    rate=settings.mail_index_rate,
+    max_bytes=settings.mail_body_max_bytes,
+    idle_interval=settings.mail_sync_interval,
+)
+
 
-                for response_part in msg_data:
-                    if isinstance(response_part, tuple):
-                        msg = email.message_from_bytes(response_part[1])
+def _account(config: MailAccountSettings) -> MailAccount:
+    pool = ImapPool(
+        functools.partial(_login, config),
+        size=settings.mail_pool_size,
+        idle_timeout=settings.mail_pool_idle_timeout,
+        wait_timeout=settings.api_timeout,
+    )
+    return MailAccount(
+        name=config.name,
+        cache=MailCache(config.name, pool, sync_interval=settings.mail_sync_interval),
+        status=StatusCache(pool, ttl=settings.mail_status_ttl),
+        timeout=config.timeout or settings.mail_account_timeout,
+    )
 
-                        email_list.append(EmailItem(
-                            id=e_id.decode(),
-                            subject=decode_email_header(msg["Subject"]),
-                            sender=msg.get("From", "Unknown"),
-                            date=msg.get("Date", "")
-                        ))
-            except Exception as e:
-                print(f"Error reading email {e_id}: {e}")
-                continue
 
-        mail.close()
-        mail.logout()
+# MAIL_ACCOUNTS, read with the Bridge by the aggregated routes, see mail_accounts
+extra_accounts = [_account(config) for config in settings.mail_accounts]
 
-        return EmailSummary(count_unread=count, emails=email_list)
 
+def all_accounts() -> list[MailAccount]:
+    """The Bridge, then the accounts of MAIL_ACCOUNTS."""
+    proton = MailAccount("proton", mail_cache, mail_status, timeout=settings.mail_account_timeout)
+    return [proton, *extra_accounts]
+
+
+# Comment line sent on quiet event streams so proxies don't close them
+SSE_KEEPALIVE = 15.0
+
+
+def _email_item(row: MailHeader) -> EmailItem:
+    return EmailItem(
+        id=str(row.uid),
+        subject=row.subject,
+        sender=row.sender,
+        date=row.date,
+        unread=not row.seen,
+    )
+
+
+@router.get("/proton/unread", response_model=EmailSummary)
+def get_proton_unread():
+    try:
+        folder = mail_cache.sync("INBOX")
+        count, latest = mail_cache.unread(folder, limit=5)
+        return EmailSummary(count_unread=count, emails=[_email_item(row) for row in latest])
+
+    except MailUnavailable as e:
+        return EmailSummary(count_unread=0, error=str(e))
     except Exception as e:
         print(f"Unknown error: {e}")
         return EmailSummary(count_unread=0, error=f"Error: {str(e)}")
@@ -155,103 +220,275 @@ def get_proton_unread():
 
 @router.get("/proton/message/{email_id}", response_model=EmailDetail)
 def get_email_detail(email_id: str):
-    mail, error = connect_to_mail()
-    if error:
-        return EmailDetail(id=email_id, subject="", sender="", date="", body="", error=error)
+    # Ids are UIDs, stable across expunges unlike sequence numbers
+    if not email_id.isdigit():
+        return EmailDetail(id=email_id, subject="", sender="", date="", body="", error="Email not found")
 
+    max_bytes = settings.mail_body_max_bytes
     try:
-        mail.select("inbox")
-        _, msg_data = mail.fetch(email_id.encode(), "(RFC822)")
-
-        for response_part in msg_data:
-            if isinstance(response_part, tuple):
-                msg = email.message_from_bytes(response_part[1])
-
-                body, html_body = get_email_body(msg)
-
-                mail.close()
-                mail.logout()
-
-                return EmailDetail(
-                    id=email_id,
-                    subject=decode_email_header(msg["Subject"]),
-                    sender=msg.get("From", "Unknown"),
-                    date=msg.get("Date", ""),
-                    body=body,
-                    html_body=html_body
+        with mail_pool.session() as mail:
+            mail.select("inbox")
+            # The MIME tree first, so only the text parts are downloaded
+            found = fetch_headers(mail, email_id, uid=True, bodystructure=True)
+            if not found:
+                return EmailDetail(id=email_id, subject="", sender="", date="", body="", error="Email not found")
+            message = found[0]
+
+            plain = next((p for p in message.parts if p.is_text and p.content_type == "text/plain"), None)
+            html = next((p for p in message.parts if p.is_text and p.content_type == "text/html"), None)
+            texts = [p for p in (plain, html) if p is not None]
+            contents = fetch_sections(mail, email_id, [p.section for p in texts], max_bytes) if texts else {}
+
+            # BODY.PEEK leaves the flags alone, opening a message still marks it read
+            if not message.seen:
+                mail.uid("STORE", email_id, "+FLAGS.SILENT", "(\\Seen)")
+        mail_cache.mark_seen("INBOX", int(email_id))
+        mail_status.clear()
+
+        def text(part: BodyPart | None) -> str | None:
+            if part is None:
+                return None
+            return decode_text(decode_transfer(contents.get(part.section, b""), part.encoding), part.charset)
+
+        return EmailDetail(
+            id=email_id,
+            subject=decode_email_header(message.headers["Subject"]),
+            sender=message.headers.get("From", "Unknown"),
+            date=message.headers.get("Date", ""),
+            body=text(plain) or "",
+            html_body=text(html),
+            truncated=any(p.size > max_bytes for p in texts),
+            attachments=[
+                AttachmentInfo(
+                    part=p.section,
+                    filename=p.filename or f"part-{p.section}",
+                    content_type=p.content_type,
+                    size=p.decoded_size,
                 )
+                for p in message.parts if not p.is_text
+            ],
+        )
 
-        mail.close()
-        mail.logout()
-        return EmailDetail(id=email_id, subject="", sender="", date="", body="", error="Email not found")
-
+    except MailUnavailable as e:
+        return EmailDetail(id=email_id, subject="", sender="", date="", body="", error=str(e))
     except Exception as e:
         print(f"Error fetching email {email_id}: {e}")
         return EmailDetail(id=email_id, subject="", sender="", date="", body="", error=str(e))
 
 
-class EmailHistoryResponse(BaseModel):
-    total_count: int
-    emails: list[EmailItem] = []
-    has_more: bool = False
+@router.get("/proton/message/{email_id}/attachments/{part}")
+def download_attachment(email_id: str, part: str, range_header: str | None = Header(None, alias="Range")):
+    """Stream one MIME part, decoded, in partial fetches. Supports single byte ranges."""
+    if not email_id.isdigit() or not all(n.isdigit() for n in part.split(".")):
+        raise HTTPException(status_code=404, detail="Attachment not found")
+
+    try:
+        with mail_pool.session() as mail:
+            mail.select("inbox", readonly=True)
+            found = fetch_headers(mail, email_id, uid=True, bodystructure=True)
+            body_part = next((p for p in found[0].parts if p.section == part), None) if found else None
+            if body_part is None:
+                raise HTTPException(status_code=404, detail="Attachment not found")
+            layout = part_layout(mail, email_id, body_part)
+    except MailUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e)) from None
+
+    filename = body_part.filename or f"part-{part}"
+    headers = {
+        "Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}",
+        # QP, or base64 with uneven lines, can't be seeked into
+        "Accept-Ranges": "bytes" if layout.seekable else "none",
+        # Keeps GZipMiddleware off: it would drop Content-Length, and attachments are mostly compressed already
+        "Content-Encoding": "identity",
+    }
+    start, end, status_code = 0, None, 200
+    if layout.seekable:
+        headers["Content-Length"] = str(layout.size)
+        if range_header:
+            try:
+                requested = parse_range(range_header, layout.size)
+            except ValueError:
+                return Response(status_code=416, headers={"Content-Range": f"bytes */{layout.size}"})
+            if requested is not None:
+                start, end = requested
+                status_code = 206
+                headers["Content-Range"] = f"bytes {start}-{end}/{layout.size}"
+                headers["Content-Length"] = str(end - start + 1)
+
+    return StreamingResponse(
+        stream_part(mail_pool, "INBOX", email_id, body_part, layout, start, end),
+        status_code=status_code,
+        media_type=body_part.content_type,
+        headers=headers,
+    )
+
+
+class FolderCounts(BaseModel):
+    messages: int
+    unseen: int
+    uidnext: int | None = None
+
+class MailCountsResponse(BaseModel):
+    # Only the folders that exist
+    folders: dict[str, FolderCounts] = {}
     error: str = ""
 
-@router.get("/proton/history", response_model=EmailHistoryResponse)
-def get_proton_history(page: int = 1, per_page: int = 20):
-    mail, error = connect_to_mail()
-    if error:
-        return EmailHistoryResponse(total_count=0, error=error)
+@router.get("/proton/counts", response_model=MailCountsResponse)
+def get_proton_counts(folders: str = Query("INBOX", description="Comma-separated folder names")):
+    names = [name.strip() for name in folders.split(",") if name.strip()]
+    if not names:
+        raise HTTPException(status_code=400, detail="No folder given")
+    if len(names) > 20:
+        raise HTTPException(status_code=400, detail="At most 20 folders per request")
 
     try:
-        mail.select("inbox")
-        status, messages = mail.search(None, "ALL")
+        statuses = mail_status.get(names)
+        return MailCountsResponse(folders={
+            name: FolderCounts(messages=s.messages, unseen=s.unseen, uidnext=s.uidnext)
+            for name, s in statuses.items()
+        })
+
+    except MailUnavailable as e:
+        return MailCountsResponse(error=str(e))
+    except Exception as e:
+        print(f"Error fetching folder counts: {e}")
+        return MailCountsResponse(error=str(e))
 
-        if status != "OK":
-            return EmailHistoryResponse(total_count=0, error="Email search error")
 
-        email_ids = messages[0].split()
-        total_count = len(email_ids)
+class SearchHit(EmailItem):
+    # Matching text, HTML-escaped, with the matched words in <mark>
+    snippet: str
 
-        start_idx = (page - 1) * per_page
-        end_idx = start_idx + per_page
-        page_ids = email_ids[start_idx:end_idx]
+class EmailSearchResponse(BaseModel):
+    query: str
+    hits: list[SearchHit] = []
+    took_ms: float = 0.0
+    error: str = ""
 
-        email_list = []
+@router.get("/proton/search", response_model=EmailSearchResponse)
+def search_proton(q: str = Query(..., min_length=1, max_length=200), limit: int = Query(20, ge=1, le=100)):
+    """Search the cached inbox by subject, sender and text, best matches first."""
+    started = time.perf_counter()
+    try:
+        hits = mail_search.search("proton", q, folder="INBOX", limit=limit)
+    except Exception as e:
+        print(f"Error searching emails: {e}")
+        return EmailSearchResponse(query=q, error=str(e))
+    return EmailSearchResponse(
+        query=q,
+        hits=[SearchHit(**_email_item(row).model_dump(), snippet=snippet) for row, snippet in hits],
+        took_ms=round((time.perf_counter() - started) * 1000, 2),
+    )
 
-        for e_id in page_ids:
-            try:
-                _, msg_data = mail.fetch(e_id, "(RFC822.HEADER)")
 
-                for response_part in msg_data:
-                    if isinstance(response_part, tuple):
-                        msg = email.message_from_bytes(response_part[1])
+class SearchIndexStatus(BaseModel):
+    total: int
+    indexed: int
+    pending: int
+    progress: float  # 0 to 1
+    running: bool
+    rate: float | None = None  # messages per second in the last batch
 
-                        email_list.append(EmailItem(
-                            id=e_id.decode(),
-                            subject=decode_email_header(msg["Subject"]),
-                            sender=msg.get("From", "Unknown"),
-                            date=msg.get("Date", "")
-                        ))
-            except Exception as e:
-                print(f"Error reading email {e_id}: {e}")
-                continue
+@router.get("/proton/search/status", response_model=SearchIndexStatus)
+def get_search_index_status():
+    return SearchIndexStatus(**mail_indexer.status())
 
-        mail.close()
-        mail.logout()
 
-        has_more = end_idx < total_count
+class EmailHistoryResponse(BaseModel):
+    total_count: int
+    emails: list[EmailItem] = []
+    has_more: bool = False
+    error: str = ""
+
+@router.get("/proton/history", response_model=EmailHistoryResponse)
+def get_proton_history(
+    page: int = Query(1, ge=1),
+    per_page: int = Query(20, ge=1, le=100),
+    sort: Literal["newest", "oldest"] = "newest",
+):
+    try:
+        folder = mail_cache.sync("INBOX")
+        total_count, rows = mail_cache.page(
+            folder, offset=(page - 1) * per_page, limit=per_page, newest_first=sort == "newest"
+        )
+        has_more = page * per_page < total_count
 
         return EmailHistoryResponse(
             total_count=total_count,
-            emails=email_list,
+            emails=[_email_item(row) for row in rows],
             has_more=has_more
         )
 
+    except MailUnavailable as e:
+        return EmailHistoryResponse(total_count=0, error=str(e))
     except Exception as e:
         print(f"History error: {e}")
         return EmailHistoryResponse(total_count=0, error=f"Error: {str(e)}")
 
 
+class ThreadItem(BaseModel):
+    id: int
+    subject: str  # of the first message
+    # Latest message
+    latest_id: str
+    sender: str
+    date: str
+    message_count: int
+    unread_count: int = 0
+
+class EmailThreadsResponse(BaseModel):
+    total_count: int
+    threads: list[ThreadItem] = []
+    has_more: bool = False
+    error: str = ""
+
+@router.get("/proton/threads", response_model=EmailThreadsResponse)
+def get_proton_threads(page: int = Query(1, ge=1), per_page: int = Query(20, ge=1, le=100)):
+    """Inbox conversations, the one with the latest message first."""
+    try:
+        folder = mail_cache.sync("INBOX")
+        total_count, threads = mail_threads.page_threads(folder, offset=(page - 1) * per_page, limit=per_page)
+        return EmailThreadsResponse(
+            total_count=total_count,
+            threads=[
+                ThreadItem(
+                    id=thread.id,
+                    subject=thread.subject,
+                    latest_id=str(thread.latest_uid),
+                    sender=thread.latest_sender,
+                    date=thread.latest_date,
+                    message_count=thread.message_count,
+                    unread_count=unread,
+                )
+                for thread, unread in threads
+            ],
+            has_more=page * per_page < total_count,
+        )
+
+    except MailUnavailable as e:
+        return EmailThreadsResponse(total_count=0, error=str(e))
+    except Exception as e:
+        print(f"Threads error: {e}")
+        return EmailThreadsResponse(total_count=0, error=f"Error: {str(e)}")
+
+
+class EmailThreadResponse(BaseModel):
+    id: int
+    emails: list[EmailItem] = []  # oldest first
+    error: str = ""
+
+@router.get("/proton/threads/{thread_id}", response_model=EmailThreadResponse)
+def get_proton_thread(thread_id: int):
+    try:
+        folder = mail_cache.sync("INBOX")
+    except MailUnavailable as e:
+        return EmailThreadResponse(id=thread_id, error=str(e))
+    rows = mail_threads.thread_messages(folder, thread_id)
+    if not rows:
+        raise HTTPException(status_code=404, detail="Thread not found")
+    return EmailThreadResponse(id=thread_id, emails=[_email_item(row) for row in rows])
+
+
 class SendEmailRequest(BaseModel):
     to: str
     subject: str
@@ -259,45 +496,125 @@ class SendEmailRequest(BaseModel):
 
 @router.post("/proton/send")
 def send_proton_email(email_data: SendEmailRequest):
-    import smtplib
-    from email.mime.multipart import MIMEMultipart
-    from email.mime.text import MIMEText
-
-    smtp_host = os.getenv("PROTON_BRIDGE_SMTP_HOST", "127.0.0.1")
-    smtp_port = int(os.getenv("PROTON_BRIDGE_SMTP_PORT", "1025"))
+    # Only queued here, mail_outbox sends it in the background
     smtp_user = os.getenv("PROTON_BRIDGE_SMTP_USER")
-    smtp_pass = os.getenv("PROTON_BRIDGE_SMTP_PASS")
-
-    if not all([smtp_user, smtp_pass]):
+    if not all([smtp_user, os.getenv("PROTON_BRIDGE_SMTP_PASS")]):
         return {"success": False, "error": "Incomplete SMTP configuration"}
 
     try:
-        msg = MIMEMultipart()
-        msg['From'] = smtp_user
-        msg['To'] = email_data.to
-        msg['Subject'] = email_data.subject
-        msg.attach(MIMEText(email_data.body, 'plain'))
+        queued = mail_outbox.enqueue(smtp_user, email_data.to, email_data.subject, email_data.body)
+        return {"success": True, "message": "Email queued for sending", "id": queued.id, "status": queued.status}
 
-        server = smtplib.SMTP(smtp_host, smtp_port)
-        with contextlib.suppress(Exception):
-            server.starttls()
-        server.login(smtp_user, smtp_pass)
+    except Exception as e:
+        print(f"Email queue error: {e}")
+        return {"success": False, "error": str(e)}
 
-        server.send_message(msg)
-        server.quit()
 
-        return {"success": True, "message": "Email sent successfully"}
+class OutboxStatus(BaseModel):
+    id: int
+    to: str
+    subject: str
+    status: str  # queued, sending, sent or failed
+    attempts: int
+    last_error: str | None = None
+    created_at: datetime
+    next_attempt_at: datetime | None = None  # while queued
+    sent_at: datetime | None = None
+
+@router.get("/proton/outbox/{message_id}", response_model=OutboxStatus)
+def get_outbox_status(message_id: int):
+    row = mail_outbox.get(message_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Queued email not found")
+    return OutboxStatus(
+        id=row.id,
+        to=row.to,
+        subject=row.subject,
+        status=row.status,
+        attempts=row.attempts,
+        last_error=row.last_error,
+        created_at=row.created_at,
+        next_attempt_at=row.next_attempt_at if row.status == "queued" else None,
+        sent_at=row.sent_at,
+    )
+
+
+def _sse(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+@router.get("/events")
+async def email_events(request: Request):
+    """Server-Sent Events: `unread` with the inbox unread count, `message` for each new email."""
+    watcher = mail_watcher
+    queue = watcher.subscribe()
+
+    async def stream():
+        try:
+            if watcher.unread is not None:
+                yield _sse("unread", json.dumps({"count": watcher.unread}))
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE)
+                except TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    break
+                name, payload = event
+                if name == "unread":
+                    yield _sse("unread", json.dumps({"count": payload}))
+                else:
+                    yield _sse("message", _email_item(payload).model_dump_json())
+        finally:
+            watcher.unsubscribe(queue)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/proton/pool")
+def get_pool_stats():
+    """Checkouts, wait times and connection churn of the IMAP session pool."""
+    return mail_pool.stats()
+
+
+class FeedItem(EmailItem):
+    account: str
+
+class AccountState(BaseModel):
+    count_unread: int | None = None  # None until the account answered once
+    error: str = ""  # the account's cached values are shown when set
+
+class EmailFeedResponse(BaseModel):
+    count_unread: int
+    emails: list[FeedItem] = []
+    accounts: dict[str, AccountState] = {}
 
-    except Exception as e:
-        print(f"Email send error: {e}")
-        return {"success": False, "error": str(e)}
+@router.get("/unread", response_model=EmailFeedResponse)
+def get_all_unread(limit: int = Query(10, ge=1, le=50)):
+    """Latest unread inbox messages of every account, newest first."""
+    total, feed, counts, errors = recent_unread(all_accounts(), limit)
+    return EmailFeedResponse(
+        count_unread=total,
+        emails=[FeedItem(**_email_item(row).model_dump(), account=name) for name, row in feed],
+        accounts={name: AccountState(count_unread=count, error=errors.get(name, "")) for name, count in counts.items()},
+    )
 
 
 @router.get("/summary")
 def get_summary():
-    proton_data = get_proton_unread()
+    # Counts only: a cached STATUS per account, no SELECT or header fetch
+    counts, errors = unread_counts(all_accounts())
+    for name, error in errors.items():
+        print(f"Error fetching unread count of {name}: {error}")
+    summary = {name: count or 0 for name, count in counts.items()}
     return {
-        "outlook": 0,
-        "proton": proton_data.count_unread,
-        "total": proton_data.count_unread
+        **summary,
+        "total": sum(summary.values()),
+        # Accounts whose count is the last one known, or 0 when none is
+        "stale": sorted(errors),
     }
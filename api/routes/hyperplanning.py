@@ -1,16 +1,23 @@
-from datetime import datetime, timedelta
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+from typing import Literal
 from urllib.parse import urlparse
 
 import pytz
-import requests
-from fastapi import APIRouter, HTTPException
-from icalendar import Calendar
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import delete
 from sqlmodel import select
+from starlette.background import BackgroundTask
 
+from calendar_cache import calendar_cache
 from config import get_settings
+from course_index import CourseEvent, CourseIndex
 from db import get_session
+from grade_import import GRADE_CHUNK_SIZE, insert_grades, read_chunks, spool, stream_import
+from grade_stats import grade_summary, invalidate_grade_summary
 from logger import setup_logger
-from models import Grade, GradeImportPayload, GradeOut
+from models import Course, CourseChange, Grade, GradeImportPayload, GradeOut
 
 settings = get_settings()
 logger = setup_logger("hyperplanning")
@@ -51,109 +58,94 @@ def validate_calendar_url(url: str) -> bool:
         logger.error(f"Error validating URL: {e}")
         return False
 
-def parse_event(component):
-    summary = str(component.get('summary'))
-    location = str(component.get('location', ''))
-    description = str(component.get('description', ''))
-    dtstart = component.get('dtstart').dt
-    dtend = component.get('dtend').dt
+def load_calendars() -> tuple[CourseIndex, list[dict]]:
+    """Courses merged from every authorized calendar, with an error entry per unavailable one.
 
-    paris_tz = pytz.timezone("Europe/Paris")
+    Raise inside the routes' try blocks: no calendar answering is a server error.
+    """
+    urls = [url for url in settings.calendar_urls if validate_calendar_url(url)]
+    courses, failed = calendar_cache.get_many(urls, timeout=settings.api_timeout)
+
+    errors = [
+        {"feed": i, "host": urlparse(url).hostname, "error": "Calendar URL is not authorized"}
+        for i, url in enumerate(settings.calendar_urls) if url not in urls
+    ]
+    errors += [
+        {"feed": settings.calendar_urls.index(url), "host": urlparse(url).hostname, "error": error}
+        for url, error in failed.items()
+    ]
+    return courses, errors
 
-    if not isinstance(dtstart, datetime):
-        start_str = "Toute la journée"
-        end_str = ""
-        dtstart = datetime.combine(dtstart, datetime.min.time()).replace(tzinfo=paris_tz)
-        dtend = datetime.combine(dtend, datetime.min.time()).replace(tzinfo=paris_tz)
-    else:
-        if dtstart.tzinfo is None:
-            dtstart = pytz.UTC.localize(dtstart)
-        if dtend.tzinfo is None:
-            dtend = pytz.UTC.localize(dtend)
 
-        dtstart = dtstart.astimezone(paris_tz)
-        dtend = dtend.astimezone(paris_tz)
+def any_calendar_authorized() -> bool:
+    return any(validate_calendar_url(url) for url in settings.calendar_urls)
 
-        start_str = dtstart.strftime("%H:%M")
-        end_str = dtend.strftime("%H:%M")
 
-    teacher = "Inconnu"
-    type_cours = "Cours"
+def get_course_range(start: date, end: date, subject: str | None = None) -> dict:
+    """Courses stored for local dates start..end (inclusive), from an index range scan."""
+    if end < start:
+        raise HTTPException(status_code=400, detail="'to' must not be before 'from'")
+    if (end - start).days > 366:
+        raise HTTPException(status_code=400, detail="Date range is limited to one year")
 
-    if "Enseignant :" in description:
-        parts = description.split("Enseignant :")
-        if len(parts) > 1:
-            teacher = parts[1].split("\n")[0].strip()
+    tz = pytz.timezone(settings.user_timezone)
 
-    if "Type :" in description:
-        parts = description.split("Type :")
-        if len(parts) > 1:
-            type_cours = parts[1].split("\n")[0].strip()
+    def utc_midnight(day: date) -> datetime:
+        return tz.localize(datetime.combine(day, datetime.min.time())).astimezone(pytz.UTC).replace(tzinfo=None)
 
-    logger.debug(f"Parsed event: {summary} on {dtstart.date()}")
+    statement = select(Course).where(
+        Course.start >= utc_midnight(start),
+        Course.start < utc_midnight(end + timedelta(days=1)),
+    )
+    if subject:
+        statement = statement.where(Course.subject == subject)
+
+    with get_session() as session:
+        rows = session.exec(statement.order_by(Course.start)).all()
 
     return {
-        "id": str(component.get('uid')),
-        "subject": summary,
-        "start": start_str,
-        "end": end_str,
-        "room": location,
-        "teacher": teacher,
-        "type": type_cours,
-        "raw_start": dtstart.isoformat(),
-        "raw_end": dtend.isoformat()
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "courses": [CourseEvent.from_row(row, tz).to_dict() for row in rows],
     }
 
+
 @router.get("/courses")
-def get_courses():
-    if not settings.hyperplanning_url:
+def get_courses(
+    from_: date | None = Query(None, alias="from", description="First day of a stored date range"),
+    to: date | None = Query(None, description="Last day of the range (defaults to 'from')"),
+    subject: str | None = Query(None, max_length=500, description="Only courses of this subject"),
+):
+    if from_ is not None:
+        return get_course_range(from_, to or from_, subject)
+
+    if not settings.calendar_urls:
         return {
             "date": datetime.now().date().isoformat(),
             "display_date": "Non configuré",
             "courses": []
         }
 
-    # SECURITY: Validate URL before making request (SSRF protection)
-    if not validate_calendar_url(settings.hyperplanning_url):
-        logger.error(f"Invalid or unauthorized calendar URL: {settings.hyperplanning_url}")
+    # SECURITY: Validate URLs before making requests (SSRF protection)
+    if not any_calendar_authorized():
+        logger.error(f"Invalid or unauthorized calendar URLs: {settings.calendar_urls}")
         raise HTTPException(
             status_code=400,
             detail="Calendar URL is not authorized. Check allowed_calendar_domains in config."
         )
 
     try:
-        response = requests.get(settings.hyperplanning_url, timeout=settings.api_timeout)
-        response.raise_for_status()
+        courses, errors = load_calendars()
 
-        cal = Calendar.from_ical(response.content)
-
-        paris_tz = pytz.timezone("Europe/Paris")
-        now = datetime.now(paris_tz).date()
+        now = datetime.now(pytz.timezone(settings.user_timezone)).date()
         target_date = now
         found_courses = []
 
-        for i in range(8):
-            check_date = now + timedelta(days=i)
-            daily_courses = []
-
-            for component in cal.walk():
-                if component.name == "VEVENT":
-                    parsed = parse_event(component)
-                    if not parsed:
-                        continue
-
-                    start_dt = datetime.fromisoformat(parsed['raw_start'])
-
-                    if start_dt.date() == check_date:
-                        daily_courses.append(parsed)
-
-            if daily_courses:
-                found_courses = daily_courses
-                target_date = check_date
-                logger.info(f"Found {len(daily_courses)} courses for {target_date}")
-                break
-
-        found_courses.sort(key=lambda x: x['start'])
+        first_day = courses.first_day_with_courses(now, days=8)
+        if first_day:
+            target_date = first_day
+            found_courses = [c.to_dict() for c in courses.courses_on(first_day)]
+            logger.info(f"Found {len(found_courses)} courses for {target_date}")
 
         days = ["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi", "Samedi", "Dimanche"]
         months = ["Jan", "Fév", "Mars", "Avr", "Mai", "Juin", "Juil", "Août", "Sept", "Oct", "Nov", "Déc"]
@@ -167,7 +159,8 @@ def get_courses():
         return {
             "date": target_date.isoformat(),
             "display_date": display_date,
-            "courses": found_courses
+            "courses": found_courses,
+            "errors": errors
         }
 
     except Exception as e:
@@ -176,110 +169,91 @@ def get_courses():
 
 @router.get("/next-courses")
 def get_next_courses():
-    if not settings.hyperplanning_url:
+    if not settings.calendar_urls:
         return []
 
-    # SECURITY: Validate URL before making request (SSRF protection)
-    if not validate_calendar_url(settings.hyperplanning_url):
+    # SECURITY: Validate URLs before making requests (SSRF protection)
+    if not any_calendar_authorized():
         raise HTTPException(status_code=400, detail="Calendar URL is not authorized")
 
     try:
-        response = requests.get(settings.hyperplanning_url, timeout=settings.api_timeout)
-        response.raise_for_status()
-
-        cal = Calendar.from_ical(response.content)
+        courses, _ = load_calendars()
 
         now = datetime.now(pytz.UTC)
-        upcoming_courses = []
-
-        for component in cal.walk():
-            if component.name == "VEVENT":
-                dtstart = component.get('dtstart').dt
-
-                if isinstance(dtstart, datetime):
-                    if dtstart.tzinfo is None:
-                        dtstart = pytz.UTC.localize(dtstart)
-                else:
-                    dtstart = datetime.combine(dtstart, datetime.min.time()).replace(tzinfo=pytz.UTC)
-
-                if dtstart > now:
-                    parsed = parse_event(component)
-                    if parsed:
-                        parsed['_dt'] = dtstart
-                        upcoming_courses.append(parsed)
-
-        upcoming_courses.sort(key=lambda x: x['_dt'])
-        next_5 = upcoming_courses[:5]
-
-        for c in next_5:
-            del c['_dt']
-
-        return next_5
+        return [c.to_dict() for c in courses.upcoming(now, limit=5)]
 
     except Exception as e:
         logger.error(f"Error fetching next courses: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch next courses") from None
 
 @router.get("/stats")
-def get_stats():
-    if not settings.hyperplanning_url:
+def get_stats(
+    by: Literal["subject", "type", "teacher"] = Query("subject", description="Group hours by subject, course type or teacher"),
+):
+    if not settings.calendar_urls:
         return []
 
-    # SECURITY: Validate URL before making request (SSRF protection)
-    if not validate_calendar_url(settings.hyperplanning_url):
+    # SECURITY: Validate URLs before making requests (SSRF protection)
+    if not any_calendar_authorized():
         raise HTTPException(status_code=400, detail="Calendar URL is not authorized")
 
     try:
-        response = requests.get(settings.hyperplanning_url, timeout=settings.api_timeout)
-        response.raise_for_status()
-
-        cal = Calendar.from_ical(response.content)
-
-        subjects = {}
-        now = datetime.now(pytz.UTC)
-
-        for component in cal.walk():
-            if component.name == "VEVENT":
-                summary = str(component.get('summary'))
-                dtstart = component.get('dtstart').dt
-                dtend = component.get('dtend').dt
+        courses, _ = load_calendars()
+        return courses.hours.breakdown(by, now=datetime.now(pytz.UTC))
 
-                if isinstance(dtstart, datetime):
-                    if dtstart.tzinfo is None:
-                        dtstart = pytz.UTC.localize(dtstart)
-                    if dtend.tzinfo is None:
-                        dtend = pytz.UTC.localize(dtend)
-                else:
-                    continue
-
-                duration = (dtend - dtstart).total_seconds() / 3600
-
-                if summary not in subjects:
-                    subjects[summary] = {"done": 0, "planned": 0, "total": 0}
-
-                subjects[summary]["total"] += duration
-
-                if dtend < now:
-                    subjects[summary]["done"] += duration
-                else:
-                    subjects[summary]["planned"] += duration
+    except Exception as e:
+        logger.error(f"Error fetching Hyperplanning stats: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch Hyperplanning statistics") from None
 
-        stats = []
-        for name, data in subjects.items():
-            stats.append({
-                "subject": name,
-                "done": round(data["done"], 1),
-                "planned": round(data["planned"], 1),
-                "total": round(data["total"], 1)
-            })
 
-        stats.sort(key=lambda x: x['total'], reverse=True)
+@router.get("/changes")
+def get_course_changes(
+    since: datetime | None = Query(None, description="Only changes detected after this moment (default: last 7 days)"),
+    limit: int = Query(100, ge=1, le=500),
+):
+    """Courses added, moved or cancelled by the school, oldest first."""
+    if since is None:
+        since = datetime.now(pytz.UTC) - timedelta(days=7)
+    elif since.tzinfo is None:
+        since = pytz.UTC.localize(since)
+    since = since.astimezone(pytz.UTC).replace(tzinfo=None)
+
+    tz = pytz.timezone(settings.user_timezone)
+    with get_session() as session:
+        rows = session.exec(
+            select(CourseChange)
+            .where(CourseChange.detected_at > since)
+            .order_by(CourseChange.detected_at, CourseChange.id)
+            .limit(limit)
+        ).all()
+
+    return [
+        {
+            "id": row.id,
+            "uid": row.uid,
+            "kind": row.kind,
+            "subject": row.subject,
+            "start": pytz.UTC.localize(row.start).astimezone(tz).isoformat(),
+            "changes": row.changes,
+            "detected_at": pytz.UTC.localize(row.detected_at).isoformat(),
+        }
+        for row in rows
+    ]
 
-        return stats
 
-    except Exception as e:
-        logger.error(f"Error fetching Hyperplanning stats: {e}")
-        raise HTTPException(status_code=500, detail="Failed to fetch Hyperplanning statistics") from None
+@router.get("/status")
+def get_calendar_status():
+    """Report the age and parse time of each cached calendar, the first one at the top level."""
+    feeds = [
+        {"feed": i, "host": urlparse(url).hostname, **calendar_cache.status(url)}
+        for i, url in enumerate(settings.calendar_urls)
+    ]
+    return {
+        "configured": bool(feeds),
+        "ttl_seconds": calendar_cache.ttl,
+        **(calendar_cache.status(settings.calendar_urls[0]) if feeds else {"cached": False}),
+        "feeds": feeds,
+    }
 
 
 @router.get("/grades", response_model=list[GradeOut])
@@ -294,57 +268,105 @@ def get_grades():
         raise HTTPException(status_code=500, detail=str(e)) from None
 
 
+@router.get("/grades/summary")
+def get_grades_summary(window: int = Query(5, ge=2, le=50, description="Grades per rolling average")):
+    """Per-subject mean/min/max/count, overall averages and a rolling trend."""
+    try:
+        return grade_summary(window)
+    except Exception as e:
+        logger.error(f"Error computing grade summary: {e}")
+        raise HTTPException(status_code=500, detail=str(e)) from None
+
+
+def _sync_grades(session, rows: list[dict]) -> dict[str, int]:
+    """Diff `rows` against the stored grades on (subject, date, value), touching only the differences.
+
+    Keys are counted, so a grade obtained twice on the same day is kept twice.
+    """
+    stored: dict[tuple, list[int]] = defaultdict(list)
+    for grade_id, subject, day, value in session.exec(select(Grade.id, Grade.subject, Grade.date, Grade.value)):
+        stored[(subject, day, value)].append(grade_id)
+
+    wanted = Counter((row["subject"], row["date"], row["value"]) for row in rows)
+    stale_ids = [grade_id for key, ids in stored.items() for grade_id in ids[wanted[key]:]]
+    new_rows = [
+        {"subject": subject, "date": day, "value": value}
+        for (subject, day, value), count in wanted.items()
+        for _ in range(count - len(stored.get((subject, day, value), ())))
+    ]
+
+    deleted = 0
+    for i in range(0, len(stale_ids), GRADE_CHUNK_SIZE):
+        deleted += session.exec(delete(Grade).where(Grade.id.in_(stale_ids[i:i + GRADE_CHUNK_SIZE]))).rowcount
+    inserted = insert_grades(session, new_rows)
+    return {"inserted": inserted, "deleted": deleted, "unchanged": len(rows) - inserted}
+
+
 @router.post("/grades/import")
-def import_grades(payload: GradeImportPayload):
+def import_grades(
+    payload: GradeImportPayload,
+    mode: Literal["replace", "sync"] = Query(
+        "replace", description="replace: drop every grade first; sync: only add and remove the differences"
+    ),
+):
+    rows = [grade.model_dump() for grade in payload.grades]
     try:
         with get_session() as session:
-            statement = select(Grade)
-            old_grades = list(session.exec(statement))
-            for grade in old_grades:
-                session.delete(grade)
-
-            new_grades = []
-            for grade_data in payload.grades:
-                grade = Grade(
-                    subject=grade_data.subject,
-                    date=grade_data.date,
-                    value=grade_data.value
-                )
-                session.add(grade)
-                new_grades.append(grade)
-
-            session.commit()
-
-            for grade in new_grades:
-                session.refresh(grade)
-
-            return {
-                "message": f"{len(new_grades)} grade(s) imported successfully",
-                "count": len(new_grades)
-            }
+            if mode == "sync":
+                counts = _sync_grades(session, rows)
+                result = {
+                    "message": f"{counts['inserted']} grade(s) added, {counts['deleted']} removed",
+                    "count": len(rows),
+                    **counts,
+                }
+            else:
+                deleted = session.exec(delete(Grade)).rowcount
+                inserted = insert_grades(session, rows)
+                result = {
+                    "message": f"{inserted} grade(s) imported successfully",
+                    "count": inserted,
+                    "deleted": deleted,
+                }
+
+        invalidate_grade_summary()
+        return result
 
     except Exception as e:
         logger.error(f"Error importing grades: {e}")
         raise HTTPException(status_code=500, detail=str(e)) from None
 
 
+@router.post("/grades/import/stream")
+async def import_grades_stream(
+    request: Request,
+    format: Literal["ndjson", "csv"] | None = Query(None, description="Defaults from the Content-Type header"),
+    mode: Literal["replace", "append"] = Query("replace", description="replace: drop the stored grades first"),
+):
+    """Import a grade history of any size from an NDJSON or CSV body.
+
+    The response is NDJSON: a progress line after each committed chunk, with
+    the rows rejected so far, then a final "done" or "failed" line.
+    """
+    fmt = format or ("csv" if "csv" in request.headers.get("content-type", "") else "ndjson")
+    body = await spool(request.stream())
+    return StreamingResponse(
+        stream_import(read_chunks(body), fmt, replace=mode == "replace"),
+        media_type="application/x-ndjson",
+        background=BackgroundTask(body.close),
+    )
+
+
 @router.delete("/grades/clear")
 def clear_grades():
     try:
         with get_session() as session:
-            statement = select(Grade)
-            grades = list(session.exec(statement))
-            count = len(grades)
-
-            for grade in grades:
-                session.delete(grade)
+            count = session.exec(delete(Grade)).rowcount
 
-            session.commit()
-
-            return {
-                "message": f"{count} grade(s) deleted",
-                "count": count
-            }
+        invalidate_grade_summary()
+        return {
+            "message": f"{count} grade(s) deleted",
+            "count": count
+        }
 
     except Exception as e:
         logger.error(f"Error clearing grades: {e}")
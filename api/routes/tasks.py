@@ -16,7 +16,9 @@ from models import (
     TaskCreate,
     TaskOut,
     TaskUpdate,
+    local_date,
 )
+from routes.analytics import delete_task_tags, invalidate_completion_day, sync_task_tags
 
 router = APIRouter(prefix="/tasks", tags=["tasks"])
 logger = setup_logger("tasks")
@@ -132,6 +134,8 @@ def create_task(payload: TaskCreate):
         )
 
         session.add(task)
+        session.flush()
+        sync_task_tags(session, task)
         session.commit()
         session.refresh(task)
         logger.info(f"Created task #{task.id}: {task.title}" + (f" (subtask of #{payload.parent_id})" if payload.parent_id else ""))
@@ -170,8 +174,12 @@ def update_task(task_id: int, payload: TaskUpdate):
 
             if payload.status == "done" and old_status != "done":
                 task.completed_at = datetime.now(timezone.utc)
+                task.completed_local_date = local_date(task.completed_at)
+                invalidate_completion_day(task.completed_local_date)
             elif payload.status != "done" and old_status == "done":
+                invalidate_completion_day(task.completed_local_date)
                 task.completed_at = None
+                task.completed_local_date = None
         if payload.due_date is not None:
             task.due_date = payload.due_date
         if payload.tags is not None:
@@ -181,6 +189,7 @@ def update_task(task_id: int, payload: TaskUpdate):
 
         task.updated_at = datetime.now(timezone.utc)
         session.add(task)
+        sync_task_tags(session, task)
         session.commit()
         session.refresh(task)
 
@@ -203,6 +212,8 @@ def delete_task(task_id: int):
         for st in subtasks:
             session.delete(st)
 
+        invalidate_completion_day(task.completed_local_date)
+        delete_task_tags(session, [task_id])
         session.delete(task)
         session.commit()
         logger.info(f"Deleted task #{task_id} and {len(subtasks)} subtasks")
@@ -220,8 +231,10 @@ def bulk_delete_tasks(payload: BulkDeletePayload):
             subtasks = list(session.exec(subtasks_stmt))
             for st in subtasks:
                 session.delete(st)
+            invalidate_completion_day(task.completed_local_date)
             session.delete(task)
 
+        delete_task_tags(session, payload.ids)
         session.commit()
         logger.info(f"Bulk deleted {count} tasks")
 
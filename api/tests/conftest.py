@@ -10,6 +10,8 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 # Set test environment BEFORE any imports
 os.environ["DATABASE_URL"] = "sqlite:///./test_data.db"
 os.environ["DEBUG"] = "false"
+os.environ["HYPERPLANNING_BACKGROUND_REFRESH"] = "false"
+os.environ["MAIL_SEARCH_INDEXING"] = "false"
 
 import pytest  # noqa: E402
 from fastapi.testclient import TestClient  # noqa: E402
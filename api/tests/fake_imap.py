@@ -0,0 +1,498 @@
+"""A small in-process IMAP server standing in for Proton Bridge in the email tests."""
+
+import contextlib
+import email
+import re
+import socket
+import socketserver
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import format_datetime
+
+
+class FakeMessage:
+    def __init__(self, uid: int, raw: bytes, flags: set[str], internaldate: datetime, modseq: int):
+        self.uid = uid
+        self.raw = raw
+        self.flags = flags
+        self.internaldate = internaldate
+        self.modseq = modseq
+
+    @property
+    def header(self) -> bytes:
+        end = self.raw.find(b"\r\n\r\n")
+        return self.raw if end < 0 else self.raw[:end + 4]
+
+    @property
+    def text(self) -> bytes:
+        end = self.raw.find(b"\r\n\r\n")
+        return b"" if end < 0 else self.raw[end + 4:]
+
+    def part(self, section: str) -> email.message.Message:
+        """The MIME part at a numeric section such as "2.1"."""
+        part = email.message_from_bytes(self.raw)
+        for number in section.split("."):
+            if part.is_multipart():
+                part = part.get_payload()[int(number) - 1]
+            elif number != "1":
+                raise ValueError(f"No section {section}")
+        return part
+
+    def section(self, section: str) -> bytes:
+        """BODY[section] content: the part's body as stored, still transfer-encoded."""
+        return self.part(section).get_payload().encode("utf-8", "surrogateescape")
+
+    def header_fields(self, names: list[str]) -> bytes:
+        wanted = {name.lower() for name in names}
+        lines, keep = [], False
+        for line in self.header.split(b"\r\n"):
+            if line[:1] not in (b" ", b"\t"):
+                keep = line.split(b":", 1)[0].decode().strip().lower() in wanted
+            if keep and line:
+                lines.append(line + b"\r\n")
+        return b"".join(lines) + b"\r\n"
+
+
+class FakeMailbox:
+    def __init__(self, uidvalidity: int = 1):
+        self.uidvalidity = uidvalidity
+        self.uidnext = 1
+        self.highestmodseq = 1
+        self.messages: list[FakeMessage] = []
+
+    def bump_modseq(self) -> int:
+        self.highestmodseq += 1
+        return self.highestmodseq
+
+
+class FakeImapServer(socketserver.ThreadingTCPServer):
+    """Serves the mailboxes over real sockets so the code under test uses imaplib unchanged.
+
+    Every command is recorded in `commands` as (command, arguments), UID commands
+    as "UID FETCH", "UID SEARCH"... so tests can count round trips. `delay`
+    seconds pass before each command is answered, to play a slow server.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, user: str = "kiwi", password: str = "secret"):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.user = user
+        self.password = password
+        self.capabilities = ["IMAP4rev1"]
+        self.mailboxes = {"INBOX": FakeMailbox()}
+        self.commands: list[tuple[str, str]] = []
+        self.logins = 0
+        self.delay = 0.0
+        self.lock = threading.Lock()
+        self._connections: list[socketserver.BaseRequestHandler] = []
+        self._idling: list[_Handler] = []
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self) -> "FakeImapServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.drop_connections()
+        self.shutdown()
+        self.server_close()
+
+    def add(
+        self, subject: str, sender: str = "alice@example.com", body: str = "Hello",
+        seen: bool = False, folder: str = "INBOX", raw: bytes | None = None,
+        date: datetime | None = None, message_id: str | None = None, in_reply_to: str | None = None,
+        references: str | None = None,
+    ) -> int:
+        """Append a message and return its UID."""
+        date = date or datetime.now(timezone.utc)
+        if raw is None:
+            message_id = message_id or f"<{subject.replace(' ', '.')}@example.com>"
+            replies = f"In-Reply-To: {in_reply_to}\r\n" if in_reply_to else ""
+            if references:
+                replies += f"References: {references}\r\n"
+            raw = (
+                f"From: {sender}\r\nTo: kiwi@example.com\r\nSubject: {subject}\r\n"
+                f"Date: {format_datetime(date)}\r\nMessage-ID: {message_id}\r\n{replies}"
+                f"Content-Type: text/plain; charset=utf-8\r\n\r\n{body}\r\n"
+            ).encode()
+        with self.lock:
+            mailbox = self.mailboxes.setdefault(folder, FakeMailbox())
+            uid = mailbox.uidnext
+            mailbox.uidnext += 1
+            flags = {"\\Seen"} if seen else set()
+            mailbox.messages.append(FakeMessage(uid, raw, flags, date, mailbox.bump_modseq()))
+            self._notify(mailbox, f"* {len(mailbox.messages)} EXISTS\r\n")
+        return uid
+
+    def set_seen(self, uid: int, seen: bool = True, folder: str = "INBOX") -> None:
+        """Change a message's \\Seen flag, as another mail client would."""
+        with self.lock:
+            mailbox = self.mailboxes[folder]
+            message = next(m for m in mailbox.messages if m.uid == uid)
+            if seen:
+                message.flags.add("\\Seen")
+            else:
+                message.flags.discard("\\Seen")
+            message.modseq = mailbox.bump_modseq()
+            seq = mailbox.messages.index(message) + 1
+            self._notify(mailbox, f"* {seq} FETCH (FLAGS ({' '.join(sorted(message.flags))}))\r\n")
+
+    def reset_uids(self, folder: str = "INBOX") -> None:
+        """Renumber the messages under a new UIDVALIDITY, as after a server-side rebuild."""
+        with self.lock:
+            mailbox = self.mailboxes[folder]
+            mailbox.uidvalidity += 1
+            for uid, message in enumerate(mailbox.messages, 1):
+                message.uid = uid
+            mailbox.uidnext = len(mailbox.messages) + 1
+
+    def expunge(self, uid: int, folder: str = "INBOX") -> None:
+        with self.lock:
+            mailbox = self.mailboxes[folder]
+            seq = next(i for i, m in enumerate(mailbox.messages, 1) if m.uid == uid)
+            mailbox.messages = [m for m in mailbox.messages if m.uid != uid]
+            mailbox.bump_modseq()
+            self._notify(mailbox, f"* {seq} EXPUNGE\r\n")
+
+    @property
+    def idling(self) -> int:
+        """Number of connections currently in IDLE."""
+        with self.lock:
+            return len(self._idling)
+
+    def _notify(self, mailbox: FakeMailbox, line: str) -> None:
+        """Tell connections idling on `mailbox` about a change. Called with the lock held."""
+        for handler in self._idling:
+            if handler.mailbox is mailbox:
+                with contextlib.suppress(OSError):
+                    handler.send(line)
+
+    def count(self, command: str) -> int:
+        return sum(1 for name, _ in self.commands if name == command)
+
+    def drop_connections(self) -> None:
+        """Close every client connection, like a restarting Bridge."""
+        for handler in list(self._connections):
+            handler.close_connection()
+
+
+def _quote(value: str) -> str:
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _param_list(pairs) -> str:
+    if not pairs:
+        return "NIL"
+    return "(" + " ".join(f"{_quote(k.upper())} {_quote(v)}" for k, v in pairs) + ")"
+
+
+def bodystructure(part: email.message.Message) -> str:
+    """BODYSTRUCTURE of a parsed message, with extension data up to the disposition."""
+    if part.is_multipart():
+        children = "".join(bodystructure(child) for child in part.get_payload())
+        return f"({children} {_quote(part.get_content_subtype().upper())})"
+
+    body = part.get_payload().encode("utf-8", "surrogateescape")
+    encoding = part.get("Content-Transfer-Encoding", "7bit").upper()
+    fields = (
+        f"{_quote(part.get_content_maintype().upper())} {_quote(part.get_content_subtype().upper())} "
+        f"{_param_list((part.get_params() or [])[1:])} NIL NIL {_quote(encoding)} {len(body)}"
+    )
+    if part.get_content_maintype() == "text":
+        fields += f" {len(body.splitlines())}"
+    disposition = "NIL"
+    if part.get_content_disposition():
+        params = part.get_params(header="Content-Disposition")[1:]
+        disposition = f"({_quote(part.get_content_disposition().upper())} {_param_list(params)})"
+    return f"({fields} NIL {disposition})"
+
+
+def _sequence_set(spec: str, numbers: list[int]) -> list[int]:
+    """Members of `numbers` (sorted) matched by an IMAP sequence set such as "1:4,7,9:*"."""
+    largest = numbers[-1] if numbers else 0
+    wanted = set()
+    for item in spec.split(","):
+        lo, _, hi = item.partition(":")
+        lo = largest if lo == "*" else int(lo)
+        hi = lo if not hi else largest if hi == "*" else int(hi)
+        lo, hi = min(lo, hi), max(lo, hi)
+        wanted.update(n for n in numbers if lo <= n <= hi)
+    return sorted(wanted)
+
+
+_FETCH_ITEM = re.compile(r"BODY(?:\.PEEK)?\[[^\]]*\](?:<\d+\.\d+>)?|[A-Z0-9.]+", re.I)
+_BODY_ITEM = re.compile(r"BODY(?:\.PEEK)?\[([^\]]*)\](?:<(\d+)\.(\d+)>)?", re.I)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: FakeImapServer
+
+    def setup(self):
+        super().setup()
+        self.mailbox: FakeMailbox | None = None
+        self.closed = False
+        self.condstore = False
+        self.readonly = False
+        self.server._connections.append(self)
+
+    def finish(self):
+        self.server._connections.remove(self)
+        with contextlib.suppress(OSError):
+            super().finish()
+
+    def close_connection(self):
+        self.closed = True
+        with contextlib.suppress(OSError):
+            self.request.shutdown(socket.SHUT_RDWR)
+
+    def send(self, data: bytes | str):
+        self.wfile.write(data.encode() if isinstance(data, str) else data)
+
+    def handle(self):
+        self.send("* OK Fake Bridge ready\r\n")
+        while not self.closed:
+            line = self.rfile.readline()
+            if not line:
+                return
+            tag, _, rest = line.decode().rstrip("\r\n").partition(" ")
+            command, _, args = rest.partition(" ")
+            command = command.upper()
+            if command == "UID":
+                sub, _, args = args.partition(" ")
+                command = f"UID {sub.upper()}"
+            with self.server.lock:
+                self.server.commands.append((command, args))
+            if self.server.delay:
+                time.sleep(self.server.delay)
+            handler = getattr(self, "do_" + command.replace(" ", "_"), None)
+            if handler is None:
+                self.send(f"{tag} BAD Unknown command\r\n")
+                continue
+            try:
+                handler(tag, args)
+            except OSError:
+                return
+
+    def do_CAPABILITY(self, tag, _args):
+        self.send(f"* CAPABILITY {' '.join(self.server.capabilities)}\r\n{tag} OK CAPABILITY done\r\n")
+
+    def do_LOGIN(self, tag, args):
+        user, password = (value.strip('"') for value in args.split(" ", 1))
+        if (user, password) != (self.server.user, self.server.password):
+            self.send(f"{tag} NO Invalid credentials\r\n")
+            return
+        with self.server.lock:
+            self.server.logins += 1
+        self.send(f"{tag} OK Logged in\r\n")
+
+    def do_ENABLE(self, tag, args):
+        enabled = [name for name in args.upper().split() if name in self.server.capabilities]
+        self.condstore = self.condstore or "CONDSTORE" in enabled
+        self.send(f"* ENABLED {' '.join(enabled)}\r\n{tag} OK ENABLE done\r\n")
+
+    def do_NOOP(self, tag, _args):
+        self.send(f"{tag} OK NOOP done\r\n")
+
+    def do_IDLE(self, tag, _args):
+        self.send("+ idling\r\n")
+        with self.server.lock:
+            self.server._idling.append(self)
+        try:
+            while (line := self.rfile.readline()) and line.strip().upper() != b"DONE":
+                pass
+        finally:
+            with self.server.lock:
+                self.server._idling.remove(self)
+        if line:
+            self.send(f"{tag} OK IDLE terminated\r\n")
+
+    def do_LOGOUT(self, tag, _args):
+        self.send(f"* BYE Logging out\r\n{tag} OK LOGOUT done\r\n")
+        self.closed = True
+
+    def do_CLOSE(self, tag, _args):
+        self.mailbox = None
+        self.send(f"{tag} OK CLOSE done\r\n")
+
+    def do_SELECT(self, tag, args, readonly=False):
+        name = args.strip('"')
+        mailbox = self.server.mailboxes.get("INBOX" if name.upper() == "INBOX" else name)
+        if mailbox is None:
+            self.send(f"{tag} NO No such mailbox\r\n")
+            return
+        self.mailbox = mailbox
+        self.readonly = readonly
+        modseq = f"* OK [HIGHESTMODSEQ {mailbox.highestmodseq}] Highest\r\n" if self.condstore else ""
+        self.send(
+            f"* {len(mailbox.messages)} EXISTS\r\n* 0 RECENT\r\n"
+            f"* OK [UIDVALIDITY {mailbox.uidvalidity}] UIDs valid\r\n"
+            f"* OK [UIDNEXT {mailbox.uidnext}] Predicted next UID\r\n"
+            f"{modseq}{tag} OK [{'READ-ONLY' if readonly else 'READ-WRITE'}] SELECT done\r\n"
+        )
+
+    def do_EXAMINE(self, tag, args):
+        self.do_SELECT(tag, args, readonly=True)
+
+    def _status(self, name: str, mailbox: FakeMailbox) -> str:
+        unseen = sum(1 for m in mailbox.messages if "\\Seen" not in m.flags)
+        return (
+            f"* STATUS {_quote(name)} (MESSAGES {len(mailbox.messages)} UNSEEN {unseen} "
+            f"UIDNEXT {mailbox.uidnext})\r\n"
+        )
+
+    def do_STATUS(self, tag, args):
+        match = re.match(r'"((?:[^"\\]|\\.)*)"|(\S+)', args)
+        name = match.group(1) if match.group(1) is not None else match.group(2)
+        mailbox = self.server.mailboxes.get("INBOX" if name.upper() == "INBOX" else name)
+        if mailbox is None:
+            self.send(f"{tag} NO No such mailbox\r\n")
+            return
+        with self.server.lock:
+            self.send(f"{self._status(name, mailbox)}{tag} OK STATUS done\r\n")
+
+    def do_LIST(self, tag, args):
+        # Every mailbox, whatever the pattern; RETURN (STATUS ...) as in LIST-STATUS
+        with self.server.lock:
+            lines = []
+            for name, mailbox in self.server.mailboxes.items():
+                lines.append(f'* LIST () "/" {_quote(name)}\r\n')
+                if "RETURN (STATUS" in args.upper() and "LIST-STATUS" in self.server.capabilities:
+                    lines.append(self._status(name, mailbox))
+            self.send("".join(lines) + f"{tag} OK LIST done\r\n")
+
+    def _search(self, args: str) -> list[FakeMessage]:
+        criteria = args.upper()
+        messages = self.mailbox.messages
+        if "UNSEEN" in criteria:
+            messages = [m for m in messages if "\\Seen" not in m.flags]
+        return messages
+
+    def do_SEARCH(self, tag, args):
+        numbers = [str(i) for i, m in enumerate(self.mailbox.messages, 1) if m in self._search(args)]
+        self.send(f"* SEARCH {' '.join(numbers)}\r\n{tag} OK SEARCH done\r\n".replace("SEARCH \r\n", "SEARCH\r\n"))
+
+    def do_UID_SEARCH(self, tag, args):
+        uids = [str(m.uid) for m in self._search(args)]
+        self.send(f"* SEARCH {' '.join(uids)}\r\n{tag} OK SEARCH done\r\n".replace("SEARCH \r\n", "SEARCH\r\n"))
+
+    def do_FETCH(self, tag, args, by_uid=False):
+        spec, _, items = args.partition(" ")
+        changedsince = None
+        modifier = re.search(r" \(CHANGEDSINCE (\d+)\)$", items)
+        if modifier:
+            changedsince = int(modifier.group(1))
+            items = items[:modifier.start()]
+        messages = self.mailbox.messages
+        if by_uid:
+            uids = _sequence_set(spec, [m.uid for m in messages])
+            selected = [(i, m) for i, m in enumerate(messages, 1) if m.uid in uids]
+        else:
+            numbers = _sequence_set(spec, list(range(1, len(messages) + 1)))
+            selected = [(n, messages[n - 1]) for n in numbers]
+
+        names = _FETCH_ITEM.findall(items.strip("()"))
+        if by_uid and not any(name.upper() == "UID" for name in names):
+            names.insert(0, "UID")
+        if changedsince is not None:
+            selected = [(n, m) for n, m in selected if m.modseq > changedsince]
+            names.append("MODSEQ")
+        for number, message in selected:
+            parts = [f"* {number} FETCH (".encode()]
+            for i, name in enumerate(names):
+                if i:
+                    parts.append(b" ")
+                parts.append(self._fetch_item(message, name))
+            parts.append(b")\r\n")
+            self.send(b"".join(parts))
+        self.send(f"{tag} OK FETCH done\r\n")
+
+    def do_UID_THREAD(self, tag, _args):
+        """THREAD=REFERENCES reduced to its grouping: messages sharing a Message-ID, each thread as a flat chain."""
+        parent: dict = {}
+
+        def root(node):
+            while parent.setdefault(node, node) != node:
+                node = parent[node]
+            return node
+
+        for message in self.mailbox.messages:
+            headers = email.message_from_bytes(message.header)
+            for linked in re.findall(r"<[^<>\s]+>", " ".join(
+                str(headers.get(name, "")) for name in ("Message-ID", "In-Reply-To", "References")
+            )):
+                parent[root(linked)] = root(message.uid)
+        threads: dict = {}
+        for message in self.mailbox.messages:
+            threads.setdefault(root(message.uid), []).append(message.uid)
+        line = "".join(f"({' '.join(map(str, group))})" for group in threads.values())
+        self.send(f"* THREAD {line}\r\n{tag} OK THREAD done\r\n".replace("THREAD \r\n", "THREAD\r\n"))
+
+    def do_UID_STORE(self, tag, args):
+        uid, mode, flags = args.split(" ", 2)
+        flags = set(flags.strip("()").split())
+        for message in self.mailbox.messages:
+            if message.uid == int(uid):
+                if mode.upper().startswith("+"):
+                    message.flags |= flags
+                else:
+                    message.flags -= flags
+                message.modseq = self.mailbox.bump_modseq()
+        self.send(f"{tag} OK STORE done\r\n")
+
+    def do_UID_FETCH(self, tag, args):
+        self.do_FETCH(tag, args, by_uid=True)
+
+    def _mark_seen(self, message: FakeMessage) -> None:
+        if not self.readonly and "\\Seen" not in message.flags:
+            message.flags.add("\\Seen")
+            message.modseq = self.mailbox.bump_modseq()
+
+    def _fetch_item(self, message: FakeMessage, name: str) -> bytes:
+        upper = name.upper()
+        if upper == "UID":
+            return f"UID {message.uid}".encode()
+        if upper == "FLAGS":
+            return f"FLAGS ({' '.join(sorted(message.flags))})".encode()
+        if upper == "INTERNALDATE":
+            return f'INTERNALDATE "{message.internaldate.strftime("%d-%b-%Y %H:%M:%S %z")}"'.encode()
+        if upper == "MODSEQ":
+            return f"MODSEQ ({message.modseq})".encode()
+        if upper == "BODYSTRUCTURE":
+            return f"BODYSTRUCTURE {bodystructure(email.message_from_bytes(message.raw))}".encode()
+        if upper == "RFC822.SIZE":
+            return f"RFC822.SIZE {len(message.raw)}".encode()
+        if upper in ("RFC822", "RFC822.HEADER"):
+            data = message.raw if upper == "RFC822" else message.header
+            if upper == "RFC822":
+                self._mark_seen(message)
+            return f"{upper} {{{len(data)}}}\r\n".encode() + data
+
+        match = _BODY_ITEM.fullmatch(name)
+        if match is None:
+            raise ValueError(f"Unsupported FETCH item {name}")
+        section, origin, length = match.groups()
+        section_upper = section.upper()
+        if section_upper.startswith("HEADER.FIELDS"):
+            data = message.header_fields(section[section.index("(") + 1:section.rindex(")")].split())
+        elif section_upper == "HEADER":
+            data = message.header
+        elif section_upper == "TEXT":
+            data = message.text
+        elif section:
+            data = message.section(section)
+        else:
+            data = message.raw
+        label = f"BODY[{section}]"
+        if origin is not None:
+            data = data[int(origin):int(origin) + int(length)]
+            label += f"<{origin}>"
+        if "PEEK" not in upper:
+            self._mark_seen(message)
+        return f"{label} {{{len(data)}}}\r\n".encode() + data
@@ -0,0 +1,117 @@
+"""In-process SMTP server standing in for the Proton Bridge in tests."""
+
+import base64
+import contextlib
+import email
+import email.policy
+import socket
+import socketserver
+import threading
+
+
+class FakeSmtpServer(socketserver.ThreadingTCPServer):
+    """Accepts mail over real sockets so the code under test uses smtplib unchanged.
+
+    `messages` holds the delivered emails, `logins` the successful AUTH commands.
+    Recipients containing "reject" are refused with 550, and `fail_data` makes
+    that many DATA commands fail with 451 before accepting again.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, user: str = "kiwi@proton.me", password: str = "secret"):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.user = user
+        self.password = password
+        self.messages: list[email.message.EmailMessage] = []
+        self.logins = 0
+        self.quits = 0
+        self.fail_data = 0
+        self.lock = threading.Lock()
+        self._connections: list[socketserver.BaseRequestHandler] = []
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self) -> "FakeSmtpServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        for handler in list(self._connections):
+            with contextlib.suppress(OSError):
+                handler.request.shutdown(socket.SHUT_RDWR)
+        self.shutdown()
+        self.server_close()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: FakeSmtpServer
+
+    def setup(self):
+        super().setup()
+        self.server._connections.append(self)
+
+    def finish(self):
+        self.server._connections.remove(self)
+        with contextlib.suppress(OSError):
+            super().finish()
+
+    def reply(self, line: str):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        self.reply("220 fake Bridge ESMTP")
+        authenticated = False
+        recipients: list[str] = []
+        while line := self.rfile.readline():
+            command, _, args = line.decode().rstrip("\r\n").partition(" ")
+            command = command.upper()
+            if command == "EHLO":
+                self.wfile.write(b"250-fake Bridge\r\n250 AUTH PLAIN\r\n")
+            elif command == "HELO":
+                self.reply("250 fake Bridge")
+            elif command == "AUTH":
+                _, _, credentials = args.partition(" ")
+                _, user, password = base64.b64decode(credentials).decode().split("\0")
+                authenticated = (user, password) == (self.server.user, self.server.password)
+                if authenticated:
+                    with self.server.lock:
+                        self.server.logins += 1
+                self.reply("235 Authenticated" if authenticated else "535 Invalid credentials")
+            elif command == "MAIL":
+                recipients = []
+                self.reply("250 OK" if authenticated else "530 Authentication required")
+            elif command == "RCPT":
+                address = args.partition(":")[2].strip("<> ")
+                if "reject" in address:
+                    self.reply("550 No such user")
+                else:
+                    recipients.append(address)
+                    self.reply("250 OK")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                while (data := self.rfile.readline()) not in (b".\r\n", b""):
+                    lines.append(data[1:] if data.startswith(b"..") else data)
+                with self.server.lock:
+                    if self.server.fail_data:
+                        self.server.fail_data -= 1
+                        self.reply("451 Try again later")
+                        continue
+                    self.server.messages.append(
+                        email.message_from_bytes(b"".join(lines), policy=email.policy.default)
+                    )
+                self.reply("250 Queued")
+            elif command == "RSET" or command == "NOOP":
+                self.reply("250 OK")
+            elif command == "QUIT":
+                with self.server.lock:
+                    self.server.quits += 1
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
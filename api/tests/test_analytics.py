@@ -0,0 +1,204 @@
+"""Unit tests for Analytics API endpoints."""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import status
+
+from db import get_session
+from models import Task, local_date
+from routes import analytics
+
+
+@pytest.fixture(autouse=True)
+def clear_analytics_cache():
+    """Analytics caches outlive the per-test database, reset them."""
+    analytics._heatmap_cache.clear()
+    analytics._streak_cache.clear()
+    yield
+
+
+def add_completed_task(completed_at: datetime, **kwargs) -> None:
+    with get_session() as session:
+        session.add(Task(
+            title="Done task", status="done", completed_at=completed_at,
+            completed_local_date=local_date(completed_at), **kwargs,
+        ))
+
+
+class TestHeatmap:
+    """Tests for the yearly productivity heatmap."""
+
+    def test_heatmap_empty_year(self, client):
+        """Test the heatmap has one zeroed entry per day of the year."""
+        response = client.get("/analytics/heatmap?year=2024")
+
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert data["year"] == 2024
+        assert len(data["days"]) == 366
+        assert data["total"] == 0
+        assert data["max"] == 0
+        assert data["days"][0] == {"date": "2024-01-01", "count": 0}
+
+    def test_heatmap_counts_completions(self, client):
+        """Test completions are bucketed by day and other years are ignored."""
+        add_completed_task(datetime(2024, 3, 5, 9, tzinfo=timezone.utc))
+        add_completed_task(datetime(2024, 3, 5, 18, tzinfo=timezone.utc))
+        add_completed_task(datetime(2024, 7, 1, 12, tzinfo=timezone.utc))
+        add_completed_task(datetime(2023, 3, 5, 12, tzinfo=timezone.utc))
+
+        data = client.get("/analytics/heatmap?year=2024").json()
+
+        counts = {d["date"]: d["count"] for d in data["days"]}
+        assert counts["2024-03-05"] == 2
+        assert counts["2024-07-01"] == 1
+        assert data["total"] == 3
+        assert data["active_days"] == 2
+        assert data["max"] == 2
+
+    def test_heatmap_uses_local_day(self, client):
+        """Test a late-evening UTC completion lands on the next Paris day."""
+        add_completed_task(datetime(2024, 6, 10, 22, 30, tzinfo=timezone.utc))
+
+        data = client.get("/analytics/heatmap?year=2024").json()
+
+        counts = {d["date"]: d["count"] for d in data["days"]}
+        assert counts["2024-06-11"] == 1
+        assert counts["2024-06-10"] == 0
+
+    def test_heatmap_invalidated_on_completion(self, client, sample_task):
+        """Test completing a task refreshes the cached heatmap."""
+        year = datetime.now(timezone.utc).year
+        assert client.get(f"/analytics/heatmap?year={year}").json()["total"] == 0
+
+        task_id = client.post("/tasks", json=sample_task).json()["id"]
+        client.put(f"/tasks/{task_id}", json={"status": "done"})
+
+        assert client.get(f"/analytics/heatmap?year={year}").json()["total"] == 1
+
+    def test_heatmap_invalid_year(self, client):
+        """Test an out of range year is rejected."""
+        response = client.get("/analytics/heatmap?year=1800")
+
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+class TestDailyStats:
+    """Tests for the daily completion chart."""
+
+    def test_daily_stats_include_today(self, client, sample_task):
+        """Test a task completed now is counted on today's local date."""
+        task_id = client.post("/tasks", json=sample_task).json()["id"]
+        task = client.put(f"/tasks/{task_id}", json={"status": "done"}).json()
+
+        data = client.get("/analytics/tasks/daily?days=7").json()
+
+        assert len(data) == 7
+        today = local_date(datetime.fromisoformat(task["completed_at"]))
+        assert data[-1] == {"date": str(today), "completed": 1}
+
+    def test_reopening_clears_local_date(self, client, sample_task):
+        """Test reopening a task removes it from the day buckets."""
+        task_id = client.post("/tasks", json=sample_task).json()["id"]
+        client.put(f"/tasks/{task_id}", json={"status": "done"})
+        client.put(f"/tasks/{task_id}", json={"status": "todo"})
+
+        data = client.get("/analytics/tasks/daily?days=2").json()
+
+        assert sum(d["completed"] for d in data) == 0
+
+
+class TestStreaks:
+    """Tests for completion streaks."""
+
+    def test_streaks_empty(self, client):
+        """Test streaks when nothing was completed."""
+        response = client.get("/analytics/streaks")
+
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert data["current_streak"] == 0
+        assert data["longest_streak"] == 0
+        assert data["last_active_date"] is None
+
+    def test_streaks_current_and_longest(self, client):
+        """Test current and longest streaks over consecutive days."""
+        now = datetime.now(timezone.utc)
+        for days_ago in (0, 1, 2, 10, 11, 12, 13):
+            add_completed_task(now - timedelta(days=days_ago))
+
+        data = client.get("/analytics/streaks").json()
+
+        assert data["current_streak"] == 3
+        assert data["longest_streak"] == 4
+        assert data["active_days"] == 7
+
+    def test_streak_broken(self, client):
+        """Test the current streak resets after a day without completions."""
+        add_completed_task(datetime.now(timezone.utc) - timedelta(days=3))
+
+        data = client.get("/analytics/streaks").json()
+
+        assert data["current_streak"] == 0
+        assert data["longest_streak"] == 1
+
+    def test_streaks_ignore_subtasks(self, client, sample_task):
+        """Test subtasks do not count towards streaks."""
+        parent_id = client.post("/tasks", json=sample_task).json()["id"]
+        add_completed_task(datetime.now(timezone.utc), parent_id=parent_id)
+
+        assert client.get("/analytics/streaks").json()["active_days"] == 0
+
+
+class TestTagStats:
+    """Tests for the per-tag breakdown."""
+
+    def test_tag_stats_empty(self, client):
+        """Test the breakdown is empty without tagged tasks."""
+        client.post("/tasks", json={"title": "Untagged"})
+
+        response = client.get("/analytics/tags")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json() == []
+
+    def test_tag_stats(self, client):
+        """Test totals, done, overdue and completion time per tag."""
+        now = datetime.now(timezone.utc)
+        with get_session() as session:
+            task = Task(
+                title="Done", tags="work, urgent", status="done",
+                created_at=now - timedelta(hours=10), completed_at=now,
+            )
+            session.add(task)
+            session.flush()
+            analytics.sync_task_tags(session, task)
+        client.post("/tasks", json={
+            "title": "Late", "tags": "work", "due_date": (now - timedelta(days=1)).isoformat(),
+        })
+        client.post("/tasks", json={
+            "title": "Later", "tags": " urgent ,work,work", "due_date": (now + timedelta(days=1)).isoformat(),
+        })
+
+        data = {t["tag"]: t for t in client.get("/analytics/tags").json()}
+
+        assert set(data) == {"work", "urgent"}
+        assert data["work"]["total"] == 3
+        assert data["work"]["done"] == 1
+        assert data["work"]["overdue"] == 1
+        assert data["work"]["completion_rate"] == 33.3
+        assert data["work"]["average_completion_hours"] == 10.0
+        assert data["urgent"]["total"] == 2
+        assert data["urgent"]["overdue"] == 0
+
+    def test_tag_stats_follow_updates(self, client):
+        """Test tag rows follow task updates and deletions."""
+        task_id = client.post("/tasks", json={"title": "Task", "tags": "old"}).json()["id"]
+        client.put(f"/tasks/{task_id}", json={"tags": "new", "status": "done"})
+
+        data = client.get("/analytics/tags").json()
+        assert [(t["tag"], t["done"]) for t in data] == [("new", 1)]
+
+        client.delete(f"/tasks/{task_id}")
+        assert client.get("/analytics/tags").json() == []
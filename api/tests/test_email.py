@@ -0,0 +1,1383 @@
+"""Unit tests for the email endpoints and the IMAP session pool."""
+
+import asyncio
+import base64
+import imaplib
+import json
+import quopri
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+from email.policy import SMTP
+
+import pytest
+from fastapi import status
+from sqlalchemy import delete, text, update
+from sqlmodel import select
+
+import mail_attachments
+import mail_search
+import mail_threads
+import mail_watcher
+from config import MailAccountSettings, Settings, get_settings
+from db import get_session
+from imap_pool import ImapPool, MailUnavailable
+from imap_protocol import (
+    decode_transfer,
+    fetch_threads,
+    iter_fetch,
+    parse_bodystructure,
+    parse_internaldate,
+    parse_status,
+)
+from mail_cache import MailCache
+from mail_outbox import OutboxWorker
+from mail_status import StatusCache
+from models import MailHeader, MailThread, MailThreadRef, OutboxMessage
+from routes import email as email_routes
+from tests.fake_imap import FakeImapServer
+from tests.fake_smtp import FakeSmtpServer
+
+
+@pytest.fixture
+def bridge(monkeypatch):
+    """Point the email routes at a fake Bridge with a fresh session pool."""
+    server = FakeImapServer().start()
+    monkeypatch.setenv("PROTON_BRIDGE_HOST", "127.0.0.1")
+    monkeypatch.setenv("PROTON_BRIDGE_PORT", str(server.port))
+    monkeypatch.setenv("PROTON_BRIDGE_USER", server.user)
+    monkeypatch.setenv("PROTON_BRIDGE_PASS", server.password)
+    pool = ImapPool(email_routes._login, size=2)
+    monkeypatch.setattr(email_routes, "mail_pool", pool)
+    monkeypatch.setattr(email_routes, "mail_cache", MailCache("proton", pool, sync_interval=0))
+    monkeypatch.setattr(email_routes, "mail_status", StatusCache(pool, ttl=60))
+    yield server
+    pool.close_all()
+    server.stop()
+
+
+def make_message(subject: str, text: str, html: str | None = None, attachment: bytes | None = None) -> bytes:
+    """A MIME message with alternative text/HTML bodies and an optional PDF attachment."""
+    message = EmailMessage()
+    message["From"] = "alice@example.com"
+    message["To"] = "kiwi@example.com"
+    message["Subject"] = subject
+    message["Date"] = "Fri, 07 Mar 2025 09:15:00 +0100"
+    message.set_content(text)
+    if html is not None:
+        message.add_alternative(html, subtype="html")
+    if attachment is not None:
+        message.add_attachment(attachment, maintype="application", subtype="pdf", filename="notes.pdf")
+    return message.as_bytes(policy=SMTP)
+
+
+@pytest.fixture
+def cache(bridge):
+    """The routes' header cache, synced from the fake Bridge."""
+    return email_routes.mail_cache
+
+
+class FakeSession:
+    """Stands in for a logged-in imaplib.IMAP4."""
+
+    def __init__(self):
+        self.alive = True
+        self.noops = 0
+        self.logged_out = False
+
+    def noop(self):
+        self.noops += 1
+        if not self.alive:
+            raise imaplib.IMAP4.abort("socket error: EOF")
+        return "OK", [b"NOOP done"]
+
+    def logout(self):
+        self.logged_out = True
+
+
+class FakeConnector:
+    def __init__(self):
+        self.sessions: list[FakeSession] = []
+
+    def __call__(self) -> FakeSession:
+        self.sessions.append(FakeSession())
+        return self.sessions[-1]
+
+
+class TestImapPool:
+    """Tests for session checkout, health checks and churn metrics."""
+
+    def test_session_reused(self):
+        """Test consecutive checkouts share one login."""
+        connect = FakeConnector()
+        pool = ImapPool(connect)
+
+        with pool.session() as first:
+            pass
+        with pool.session() as second:
+            pass
+
+        assert first is second
+        assert len(connect.sessions) == 1
+        assert pool.stats()["checkouts"] == 2
+        assert pool.stats()["opened"] == 1
+
+    def test_concurrent_checkouts_get_own_sessions(self):
+        """Test a checked-out session is never handed to another request."""
+        connect = FakeConnector()
+        pool = ImapPool(connect, size=2)
+
+        with pool.session() as first, pool.session() as second:
+            assert first is not second
+            assert pool.stats()["in_use"] == 2
+        assert pool.stats()["idle"] == 2
+
+    def test_noop_after_idle_replaces_dead_session(self):
+        """Test a session that fails its NOOP is dropped and a new one logs in."""
+        connect = FakeConnector()
+        pool = ImapPool(connect, check_after=0)
+        with pool.session() as dead:
+            pass
+        dead.alive = False
+
+        with pool.session() as session:
+            pass
+
+        assert session is not dead
+        assert dead.noops == 1
+        assert dead.logged_out
+        stats = pool.stats()
+        assert stats["failed_checks"] == 1
+        assert stats["opened"] == 2
+        assert stats["closed"] == 1
+
+    def test_no_noop_when_recently_used(self):
+        """Test sessions used within check_after skip the health check."""
+        connect = FakeConnector()
+        pool = ImapPool(connect, check_after=60)
+        with pool.session():
+            pass
+        with pool.session() as session:
+            pass
+
+        assert session.noops == 0
+
+    def test_idle_timeout(self):
+        """Test sessions idle past the timeout are logged out instead of reused."""
+        connect = FakeConnector()
+        pool = ImapPool(connect, idle_timeout=0)
+        with pool.session() as first:
+            pass
+        with pool.session() as second:
+            pass
+
+        assert first is not second
+        assert first.logged_out
+        assert pool.stats()["expired"] == 1
+
+    def test_connection_error_drops_session(self):
+        """Test a session whose connection broke is not returned to the pool."""
+        connect = FakeConnector()
+        pool = ImapPool(connect)
+
+        with pytest.raises(imaplib.IMAP4.abort), pool.session() as broken:
+            raise imaplib.IMAP4.abort("socket error: EOF")
+        with pool.session() as session:
+            pass
+
+        assert session is not broken
+        assert pool.stats()["broken"] == 1
+
+    def test_command_error_keeps_session(self):
+        """Test a NO reply leaves the session in the pool."""
+        connect = FakeConnector()
+        pool = ImapPool(connect)
+
+        with pytest.raises(imaplib.IMAP4.error), pool.session() as first:
+            raise imaplib.IMAP4.error("NO mailbox does not exist")
+        with pool.session() as second:
+            pass
+
+        assert first is second
+
+    def test_bounded(self):
+        """Test checkouts beyond the pool size wait, then give up."""
+        pool = ImapPool(FakeConnector(), size=1, wait_timeout=0.05)
+
+        with pool.session(), pytest.raises(MailUnavailable), pool.session():
+            pass
+
+        stats = pool.stats()
+        assert stats["timeouts"] == 1
+        assert stats["max_wait_seconds"] >= 0.05
+        assert stats["in_use"] == 0
+
+
+class TestFetchParsing:
+    """Tests for reassembling and parsing imaplib FETCH data."""
+
+    def test_messages_split_around_literals(self):
+        """Test literals, continuation lines and following messages are told apart."""
+        data = [
+            (b'3 (UID 12 FLAGS (\\Seen) BODY[HEADER.FIELDS (SUBJECT)] {15}', b"Subject: Hi\r\n\r\n"),
+            (b" BODY[TEXT] {5}", b"Hello"),
+            b' INTERNALDATE " 7-Mar-2025 09:15:00 +0100")',
+            b"4 (UID 13 FLAGS ())",
+        ]
+
+        (seq, first), (next_seq, second) = iter_fetch(data)
+
+        assert seq == 3
+        assert first["UID"] == "12"
+        assert first["FLAGS"] == ["\\Seen"]
+        assert first["BODY[HEADER.FIELDS (SUBJECT)]"] == b"Subject: Hi\r\n\r\n"
+        assert first["BODY[TEXT]"] == b"Hello"
+        assert parse_internaldate(first["INTERNALDATE"]).isoformat() == "2025-03-07T09:15:00+01:00"
+        assert (next_seq, second) == (4, {"UID": "13", "FLAGS": []})
+
+    def test_status_responses(self):
+        """Test STATUS data, with a mailbox name sent as a literal."""
+        data = [
+            b'"inbox" (MESSAGES 3 UNSEEN 1 UIDNEXT 12)',
+            (b"{10}", b"Cours/Math"),
+            b" (MESSAGES 0 UNSEEN 0 UIDNEXT 1)",
+        ]
+
+        assert parse_status(data) == {
+            "INBOX": {"MESSAGES": 3, "UNSEEN": 1, "UIDNEXT": 12},
+            "Cours/Math": {"MESSAGES": 0, "UNSEEN": 0, "UIDNEXT": 1},
+        }
+
+    def test_thread_response(self):
+        """Test nested THREAD replies are flattened into one UID list per conversation."""
+        class Mail:
+            @staticmethod
+            def uid(*args):
+                assert args == ("THREAD", "REFERENCES", "UTF-8", "ALL")
+                return "OK", [b"(1 2 (3)(4 5))((6)(7))(8)"]
+
+        assert fetch_threads(Mail()) == [[1, 2, 3, 4, 5], [6, 7], [8]]
+
+    def test_quoted_strings(self):
+        """Test parentheses and escapes inside quoted strings are plain text."""
+        ((_, items),) = iter_fetch([b'1 (X-LABEL "a (b) \\"c\\"" Y NIL)'])
+
+        assert items == {"X-LABEL": 'a (b) "c"', "Y": None}
+
+
+class TestBodyStructure:
+    """Tests for BODYSTRUCTURE parsing and transfer decoding."""
+
+    def test_nested_multipart(self):
+        """Test leaf parts get their section numbers and attachment metadata."""
+        ((_, items),) = iter_fetch([
+            b'1 (BODYSTRUCTURE ((("TEXT" "PLAIN" ("CHARSET" "iso-8859-1") NIL NIL "QUOTED-PRINTABLE" 120 4 NIL NIL)'
+            b'("TEXT" "HTML" ("CHARSET" "utf-8") NIL NIL "BASE64" 400 6 NIL ("INLINE" NIL)) "ALTERNATIVE")'
+            b'("APPLICATION" "PDF" ("NAME" "x.pdf") NIL NIL "BASE64" 4000 NIL'
+            b' ("ATTACHMENT" ("FILENAME*" "utf-8\'\'%C3%A9t%C3%A9.pdf"))) "MIXED"))'
+        ])
+
+        plain, html, pdf = parse_bodystructure(items["BODYSTRUCTURE"])
+
+        assert (plain.section, plain.content_type, plain.charset, plain.encoding) == (
+            "1.1", "text/plain", "iso-8859-1", "quoted-printable"
+        )
+        assert (html.section, html.is_text) == ("1.2", True)
+        assert (pdf.section, pdf.is_text, pdf.filename, pdf.decoded_size) == ("2", False, "été.pdf", 2923)
+
+    def test_single_part(self):
+        """Test a message without multipart is section 1."""
+        ((_, items),) = iter_fetch([b'1 (BODYSTRUCTURE ("TEXT" "PLAIN" NIL NIL NIL "7BIT" 12 1))'])
+
+        (part,) = parse_bodystructure(items["BODYSTRUCTURE"])
+
+        assert (part.section, part.charset, part.is_text) == ("1", "utf-8", True)
+
+    def test_decode_cut_content(self):
+        """Test content cut by a partial fetch decodes up to the cut."""
+        assert decode_transfer(b"SGVsbG8g\r\nd29y", "base64") == b"Hello wor"
+        assert decode_transfer(b"caf=C3=A9 =C", "quoted-printable") == "café ".encode()
+
+
+class TestProtonRoutes:
+    """Tests for the Proton Bridge endpoints against a fake Bridge."""
+
+    def test_not_configured(self, client, monkeypatch):
+        """Test a missing Bridge login is reported as an error."""
+        monkeypatch.delenv("PROTON_BRIDGE_USER", raising=False)
+        pool = ImapPool(email_routes._login)
+        monkeypatch.setattr(email_routes, "mail_pool", pool)
+        monkeypatch.setattr(email_routes, "mail_cache", MailCache("proton", pool, sync_interval=0))
+
+        response = client.get("/email/proton/unread")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["error"] == "Incomplete .env configuration"
+
+    def test_unread(self, client, bridge):
+        """Test unread messages are counted and listed newest first."""
+        bridge.add("Old news", seen=True)
+        bridge.add("Exam schedule")
+        bridge.add("Lunch?")
+
+        data = client.get("/email/proton/unread").json()
+
+        assert data["error"] == ""
+        assert data["count_unread"] == 2
+        assert [e["subject"] for e in data["emails"]] == ["Lunch?", "Exam schedule"]
+
+    def test_requests_share_one_login(self, client, bridge):
+        """Test several requests reuse the pooled session."""
+        bridge.add("Exam schedule")
+
+        client.get("/email/proton/unread")
+        client.get("/email/proton/history")
+        client.get("/email/proton/unread")
+
+        assert bridge.logins == 1
+        assert bridge.count("LOGOUT") == 0
+        assert client.get("/email/proton/pool").json()["checkouts"] == 3
+
+    def test_reconnects_after_bridge_restart(self, client, bridge):
+        """Test a session dropped by the server is replaced on the next checkout."""
+        bridge.add("Exam schedule")
+        client.get("/email/proton/unread")
+        email_routes.mail_pool.check_after = 0
+
+        bridge.drop_connections()
+        data = client.get("/email/proton/unread").json()
+
+        assert data["count_unread"] == 1
+        assert bridge.logins == 2
+        assert client.get("/email/proton/pool").json()["failed_checks"] == 1
+
+    def test_unread_headers_in_one_fetch(self, client, bridge):
+        """Test new messages are fetched with a single command, without the full header."""
+        for i in range(8):
+            bridge.add(f"Message {i}")
+
+        data = client.get("/email/proton/unread").json()
+
+        assert data["count_unread"] == 8
+        assert [e["subject"] for e in data["emails"]] == [f"Message {i}" for i in (7, 6, 5, 4, 3)]
+        assert all(e["unread"] for e in data["emails"])
+        assert bridge.count("UID FETCH") == 1
+        (_, items), = [c for c in bridge.commands if c[0] == "UID FETCH"]
+        assert "HEADER.FIELDS (SUBJECT FROM DATE MESSAGE-ID IN-REPLY-TO REFERENCES)" in items
+
+    def test_history_page(self, client, bridge):
+        """Test history pages are newest first and identified by UID."""
+        for i in range(5):
+            bridge.add(f"Message {i}", seen=i < 2)
+
+        data = client.get("/email/proton/history", params={"page": 2, "per_page": 2}).json()
+
+        assert data["total_count"] == 5
+        assert data["has_more"] is True
+        assert [(e["id"], e["subject"], e["unread"]) for e in data["emails"]] == [
+            ("3", "Message 2", True), ("2", "Message 1", False),
+        ]
+
+    def test_history_oldest_first(self, client, bridge):
+        """Test the history can be sorted from the oldest message."""
+        for i in range(3):
+            bridge.add(f"Message {i}")
+
+        data = client.get("/email/proton/history", params={"sort": "oldest", "per_page": 2}).json()
+
+        assert [e["subject"] for e in data["emails"]] == ["Message 0", "Message 1"]
+
+    def test_history_past_last_page(self, client, bridge):
+        """Test a page after the last message is empty."""
+        bridge.add("Only one")
+
+        data = client.get("/email/proton/history", params={"page": 3}).json()
+
+        assert data["emails"] == []
+        assert data["has_more"] is False
+
+    def test_detail_by_uid(self, client, bridge):
+        """Test ids still point to the same message after an earlier one is expunged."""
+        gone = bridge.add("Expunged")
+        uid = bridge.add("Exam schedule", body="Room B204")
+        bridge.expunge(gone)
+
+        data = client.get(f"/email/proton/message/{uid}").json()
+
+        assert data["subject"] == "Exam schedule"
+        assert "Room B204" in data["body"]
+
+    def test_detail_fetches_text_parts_only(self, client, bridge):
+        """Test the attachment is listed from BODYSTRUCTURE without being downloaded."""
+        uid = bridge.add("Notes", raw=make_message(
+            "Notes", "Voir la pièce jointe", html="<p>Voir la pièce jointe</p>", attachment=b"%PDF" * 50_000,
+        ))
+
+        data = client.get(f"/email/proton/message/{uid}").json()
+
+        assert data["error"] == ""
+        assert data["body"].strip() == "Voir la pièce jointe"
+        assert data["html_body"].strip() == "<p>Voir la pièce jointe</p>"
+        assert data["truncated"] is False
+        (attachment,) = data["attachments"]
+        assert attachment["part"] == "2"
+        assert attachment["filename"] == "notes.pdf"
+        assert attachment["content_type"] == "application/pdf"
+        assert abs(attachment["size"] - 200_000) < 100
+        fetches = [args for name, args in bridge.commands if name == "UID FETCH"]
+        assert "BODYSTRUCTURE" in fetches[0]
+        assert "BODY.PEEK[1.1]<0." in fetches[1]
+        assert "BODY.PEEK[1.2]<0." in fetches[1]
+        assert "[2]" not in fetches[1]
+        assert "RFC822" not in " ".join(fetches)
+
+    def test_detail_truncated(self, client, bridge, monkeypatch):
+        """Test text parts are cut at the size cap."""
+        monkeypatch.setattr(get_settings(), "mail_body_max_bytes", 100)
+        uid = bridge.add("Long", body="x" * 500)
+
+        data = client.get(f"/email/proton/message/{uid}").json()
+
+        assert data["truncated"] is True
+        assert data["body"] == "x" * 100
+
+    def test_detail_marks_read_once(self, client, bridge):
+        """Test opening an unread message sets \\Seen, opening it again doesn't."""
+        uid = bridge.add("Exam schedule")
+
+        client.get(f"/email/proton/message/{uid}")
+        client.get(f"/email/proton/message/{uid}")
+
+        assert bridge.count("UID STORE") == 1
+        assert "\\Seen" in bridge.mailboxes["INBOX"].messages[0].flags
+
+    def test_detail_marks_cached_message_read(self, client, bridge):
+        """Test opening a message updates the cached unread count without a sync."""
+        uid = bridge.add("Exam schedule")
+        client.get("/email/proton/unread")
+        email_routes.mail_cache.sync_interval = 60
+
+        client.get(f"/email/proton/message/{uid}")
+
+        assert client.get("/email/proton/unread").json()["count_unread"] == 0
+
+
+class TestMailStatus:
+    """Tests for folder counts from STATUS."""
+
+    def test_summary_without_select(self, client, bridge):
+        """Test the summary count costs a single STATUS and no SELECT or FETCH."""
+        bridge.add("Exam schedule")
+        bridge.add("Room change")
+        bridge.add("Old", seen=True)
+
+        data = client.get("/email/summary").json()
+
+        assert data["proton"] == 2
+        assert data["total"] == 2
+        assert bridge.count("STATUS") == 1
+        assert not {"SELECT", "EXAMINE", "SEARCH", "UID SEARCH", "FETCH", "UID FETCH"} & {c for c, _ in bridge.commands}
+
+    def test_counts_cached(self, client, bridge):
+        """Test counts are reused within the TTL and asked again after it."""
+        bridge.add("Exam schedule")
+        client.get("/email/summary")
+        bridge.add("Room change")
+
+        assert client.get("/email/summary").json()["proton"] == 1
+        assert bridge.count("STATUS") == 1
+        email_routes.mail_status.ttl = 0
+        assert client.get("/email/summary").json()["proton"] == 2
+
+    def test_concurrent_callers_share_one_status(self, bridge):
+        """Test callers arriving together wait for one STATUS instead of sending their own."""
+        bridge.add("Exam schedule")
+
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(lambda _: email_routes.mail_status.get(["INBOX"]), range(8)))
+
+        assert {r["INBOX"].unseen for r in results} == {1}
+        assert bridge.count("STATUS") == 1
+
+    def test_several_folders(self, client, bridge):
+        """Test counts of several folders, unknown ones left out."""
+        bridge.add("Exam schedule")
+        bridge.add("Old", folder="Archive", seen=True)
+
+        data = client.get("/email/proton/counts?folders=inbox,Archive,Missing").json()
+
+        assert data["error"] == ""
+        assert data["folders"] == {
+            "INBOX": {"messages": 1, "unseen": 1, "uidnext": 2},
+            "Archive": {"messages": 1, "unseen": 0, "uidnext": 2},
+        }
+
+    def test_list_status(self, client, bridge):
+        """Test servers with LIST-STATUS answer for every folder in one command."""
+        bridge.capabilities.append("LIST-STATUS")
+        bridge.add("Exam schedule")
+        bridge.add("Old", folder="Archive")
+
+        data = client.get("/email/proton/counts?folders=INBOX,Archive").json()
+
+        assert set(data["folders"]) == {"INBOX", "Archive"}
+        assert bridge.count("LIST") == 1
+        assert bridge.count("STATUS") == 0
+
+    def test_stale_counts_when_bridge_down(self, client, bridge):
+        """Test the last counts are served when the Bridge can't be reached."""
+        bridge.add("Exam schedule")
+        client.get("/email/summary")
+        email_routes.mail_status.ttl = 0
+        email_routes.mail_pool.check_after = 0
+        bridge.password = "changed"
+        bridge.drop_connections()
+
+        assert client.get("/email/summary").json()["proton"] == 1
+
+    def test_opening_message_refreshes_count(self, client, bridge):
+        """Test the cached count drops as soon as a message is read here."""
+        uid = bridge.add("Exam schedule")
+        client.get("/email/summary")
+
+        client.get(f"/email/proton/message/{uid}")
+
+        assert client.get("/email/summary").json()["proton"] == 0
+
+
+@pytest.fixture
+def outlook(bridge, monkeypatch):
+    """A second IMAP account, read with the fake Bridge by the aggregated routes."""
+    server = FakeImapServer(user="kiwi@outlook.com").start()
+    config = MailAccountSettings(
+        name="outlook", host="127.0.0.1", port=server.port, user=server.user, password=server.password,
+        ssl=False, timeout=2.0,
+    )
+    account = email_routes._account(config)
+    monkeypatch.setattr(email_routes, "extra_accounts", [account])
+    yield server
+    account.cache.pool.close_all()
+    server.stop()
+
+
+def outlook_account():
+    return email_routes.extra_accounts[0]
+
+
+class TestMailAccounts:
+    """Tests for the unread counts and feed merged from every account."""
+
+    def test_summary_counts_every_account(self, client, bridge, outlook):
+        """Test the summary has a count per configured account and their total."""
+        bridge.add("Exam schedule")
+        bridge.add("Room change")
+        outlook.add("Newsletter")
+
+        data = client.get("/email/summary").json()
+
+        assert data == {"proton": 2, "outlook": 1, "total": 3, "stale": []}
+
+    def test_feed_merged_by_date(self, client, bridge, outlook):
+        """Test unread messages of all accounts come as one feed, newest first."""
+        start = datetime(2025, 3, 7, 9, 0, tzinfo=timezone.utc)
+        bridge.add("Exam schedule", date=start)
+        outlook.add("Newsletter", date=start + timedelta(hours=1))
+        bridge.add("Room change", date=start + timedelta(hours=2))
+        outlook.add("Old", seen=True, date=start + timedelta(hours=3))
+
+        data = client.get("/email/unread", params={"limit": 2}).json()
+
+        assert data["count_unread"] == 3
+        assert [(e["account"], e["subject"]) for e in data["emails"]] == [
+            ("proton", "Room change"), ("outlook", "Newsletter"),
+        ]
+        assert data["accounts"] == {
+            "proton": {"count_unread": 2, "error": ""},
+            "outlook": {"count_unread": 1, "error": ""},
+        }
+
+    def test_slow_account_served_from_cache(self, client, bridge, outlook):
+        """Test an account past its timeout gives its cached count without delaying the others."""
+        outlook.add("Newsletter")
+        client.get("/email/summary")
+        account = outlook_account()
+        email_routes.mail_status.ttl = account.status.ttl = 0
+        account.timeout = 0.1
+        outlook.delay = 0.5
+        outlook.add("Second newsletter")
+        bridge.add("Exam schedule")
+
+        started = time.monotonic()
+        first = client.get("/email/summary").json()
+        second = client.get("/email/summary").json()
+
+        assert time.monotonic() - started < 0.8
+        assert first == second == {"proton": 1, "outlook": 1, "total": 2, "stale": ["outlook"]}
+        # The refresh left running is shared, then its result served
+        wait_until(lambda: account.status.cached("INBOX").unseen == 2)
+        assert outlook.count("STATUS") == 2
+        outlook.delay = 0
+        assert client.get("/email/summary").json()["outlook"] == 2
+
+    def test_unreachable_account(self, client, bridge, outlook):
+        """Test an account that never answered is reported without failing the others."""
+        bridge.add("Exam schedule")
+        outlook.password = "changed"
+
+        summary = client.get("/email/summary").json()
+        feed = client.get("/email/unread").json()
+
+        assert summary == {"proton": 1, "outlook": 0, "total": 1, "stale": ["outlook"]}
+        assert feed["count_unread"] == 1
+        assert feed["accounts"]["outlook"]["count_unread"] is None
+        assert "IMAP error" in feed["accounts"]["outlook"]["error"]
+
+    def test_account_names_checked(self):
+        """Test accounts can't take the Bridge's name or a summary key."""
+        account = {"host": "imap.example.com", "user": "kiwi", "password": "secret"}
+
+        with pytest.raises(ValueError):
+            MailAccountSettings(name="total", **account)
+        with pytest.raises(ValueError):
+            Settings(mail_accounts=[{"name": "proton", **account}])
+        with pytest.raises(ValueError):
+            Settings(mail_accounts=[{"name": "outlook", **account}, {"name": "outlook", **account}])
+
+
+@pytest.fixture
+def indexer(bridge, monkeypatch):
+    """The routes' search indexer, without a rate cap worth waiting for."""
+    mail_search.create_search_table()
+    indexer = mail_search.MailIndexer("proton", email_routes.mail_pool, rate=10_000)
+    monkeypatch.setattr(email_routes, "mail_indexer", indexer)
+    return indexer
+
+
+class TestMailSearch:
+    """Tests for the full-text index of cached mail."""
+
+    def test_search_subject_sender_and_body(self, client, bridge, cache, indexer):
+        """Test hits come from subjects, senders and bodies, with a marked snippet."""
+        bridge.add("Exam schedule", body="Room B204 on Monday")
+        bridge.add("Lunch", sender="Marie Curie <marie@example.com>", body="Tomorrow?")
+        cache.sync()
+        assert indexer.index_batch() == 2
+
+        data = client.get("/email/proton/search?q=b204").json()
+        (hit,) = data["hits"]
+        assert hit["subject"] == "Exam schedule"
+        assert "<mark>B204</mark>" in hit["snippet"]
+        assert data["took_ms"] >= 0
+        assert [h["subject"] for h in client.get("/email/proton/search?q=curie").json()["hits"]] == ["Lunch"]
+        # The last word is a prefix, for search as you type
+        assert [h["subject"] for h in client.get("/email/proton/search?q=exam sched").json()["hits"]] == ["Exam schedule"]
+
+    def test_accents_and_html_bodies(self, client, bridge, cache, indexer):
+        """Test accents are ignored and HTML-only bodies are indexed without markup."""
+        message = EmailMessage()
+        message["Subject"] = "Conseil de classe"
+        message.set_content("<p>La <b>réunion</b> aura lieu en salle A1</p>", subtype="html")
+        bridge.add("Conseil de classe", raw=message.as_bytes(policy=SMTP))
+        cache.sync()
+        indexer.index_batch()
+
+        (hit,) = client.get("/email/proton/search?q=reunion").json()["hits"]
+
+        assert hit["snippet"].startswith("La <mark>réunion</mark> aura lieu")
+
+    def test_subject_ranked_first(self, client, bridge, cache, indexer):
+        """Test a match in the subject outranks one in the body."""
+        bridge.add("Notes", body="Les notes du partiel sont en ligne")
+        bridge.add("Partiel", body="Convocation")
+        cache.sync()
+        indexer.index_batch()
+
+        hits = client.get("/email/proton/search?q=partiel").json()["hits"]
+
+        assert [h["subject"] for h in hits] == ["Partiel", "Notes"]
+
+    def test_snippet_escaped(self, client, bridge, cache, indexer):
+        """Test message text can't inject markup through the snippet."""
+        bridge.add("Alert", body="<script>alert(1)</script> partiel")
+        cache.sync()
+        indexer.index_batch()
+
+        (hit,) = client.get("/email/proton/search?q=partiel").json()["hits"]
+
+        assert "<script>" not in hit["snippet"]
+        assert "&lt;script&gt;" in hit["snippet"]
+
+    def test_query_syntax_is_literal(self, client, bridge, cache, indexer):
+        """Test FTS operators and punctuation in the query are plain words."""
+        bridge.add("Exam schedule")
+        cache.sync()
+        indexer.index_batch()
+
+        for q in ['exam" OR (', "NEAR(exam", "!!!"]:
+            data = client.get("/email/proton/search", params={"q": q}).json()
+            assert data["error"] == ""
+        assert client.get("/email/proton/search?q=!!!").json()["hits"] == []
+
+    def test_batches_and_status(self, client, bridge, cache, indexer):
+        """Test messages are indexed batch by batch, each batch in few commands."""
+        for i in range(5):
+            bridge.add(f"Message {i}")
+        cache.sync()
+        indexer.batch_size = 2
+        fetches = bridge.count("UID FETCH")
+
+        assert indexer.index_batch() == 2
+        assert bridge.count("UID FETCH") - fetches == 3
+        status_data = client.get("/email/proton/search/status").json()
+        assert (status_data["total"], status_data["indexed"], status_data["pending"]) == (5, 2, 3)
+        assert status_data["progress"] == 0.4
+
+        while indexer.index_batch():
+            pass
+        assert client.get("/email/proton/search/status").json()["progress"] == 1.0
+
+    def test_rate_cap(self, bridge, cache, indexer):
+        """Test a batch takes at least as long as the rate cap allows."""
+        for i in range(3):
+            bridge.add(f"Message {i}")
+        cache.sync()
+        indexer.rate = 20
+
+        started = time.monotonic()
+        indexer.index_batch()
+
+        assert time.monotonic() - started >= 3 / 20
+
+    def test_deleted_messages_leave_index(self, client, bridge, cache, indexer):
+        """Test messages expunged on the server stop matching after a sync."""
+        uid = bridge.add("Exam schedule")
+        cache.sync()
+        indexer.index_batch()
+        bridge.expunge(uid)
+
+        cache.sync()
+
+        assert client.get("/email/proton/search?q=exam").json()["hits"] == []
+        with get_session() as session:
+            assert session.connection().execute(text("SELECT count(*) FROM mailsearch")).scalar() == 0
+
+    def test_expunged_before_indexing(self, bridge, cache, indexer):
+        """Test a message gone from the server is skipped without failing the batch."""
+        gone = bridge.add("Gone")
+        bridge.add("Kept")
+        cache.sync()
+        bridge.expunge(gone)
+
+        assert indexer.index_batch() == 2
+        assert indexer.status()["pending"] == 0
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    """A fake Bridge SMTP server behind a fresh outbox worker that retries quickly."""
+    server = FakeSmtpServer().start()
+    monkeypatch.setenv("PROTON_BRIDGE_SMTP_HOST", "127.0.0.1")
+    monkeypatch.setenv("PROTON_BRIDGE_SMTP_PORT", str(server.port))
+    monkeypatch.setenv("PROTON_BRIDGE_SMTP_USER", server.user)
+    monkeypatch.setenv("PROTON_BRIDGE_SMTP_PASS", server.password)
+    worker = OutboxWorker(email_routes._smtp_login, retry_base=0.05)
+    monkeypatch.setattr(email_routes, "mail_outbox", worker)
+    yield server
+    worker.stop()
+    server.stop()
+
+
+def send(client, to: str = "alice@example.com", subject: str = "Hello") -> dict:
+    return client.post("/email/proton/send", json={"to": to, "subject": subject, "body": "Bonjour"}).json()
+
+
+def outbox_status(client, message_id: int) -> dict:
+    return client.get(f"/email/proton/outbox/{message_id}").json()
+
+
+class TestOutbox:
+    """Tests for queued sending over one SMTP session."""
+
+    def test_send_returns_queued_id(self, client, smtp):
+        """Test sending answers before the mail is delivered, and delivery can be followed."""
+        data = send(client)
+
+        assert data["success"] is True
+        assert data["status"] == "queued"
+        wait_until(lambda: outbox_status(client, data["id"])["status"] == "sent")
+        status_data = outbox_status(client, data["id"])
+        assert status_data["attempts"] == 1
+        assert status_data["sent_at"] is not None
+        (message,) = smtp.messages
+        assert message["To"] == "alice@example.com"
+        assert message["From"] == smtp.user
+        assert message["Message-ID"].endswith("@proton.me>")
+        assert message.get_body().get_content().strip() == "Bonjour"
+
+    def test_burst_shares_one_login(self, client, smtp):
+        """Test a burst of emails goes out over a single SMTP session."""
+        ids = [send(client, subject=f"Message {i}")["id"] for i in range(5)]
+
+        wait_until(lambda: all(outbox_status(client, i)["status"] == "sent" for i in ids))
+
+        assert smtp.logins == 1
+        assert sorted(m["Subject"] for m in smtp.messages) == [f"Message {i}" for i in range(5)]
+
+    def test_temporary_failure_retried(self, client, smtp):
+        """Test a 4xx reply is retried after a backoff."""
+        smtp.fail_data = 2
+
+        message_id = send(client)["id"]
+
+        wait_until(lambda: outbox_status(client, message_id)["status"] == "sent")
+        status_data = outbox_status(client, message_id)
+        assert status_data["attempts"] == 3
+        assert status_data["last_error"] is None
+        assert len(smtp.messages) == 1
+
+    def test_rejected_recipient_fails(self, client, smtp):
+        """Test a 5xx rejection fails the email without retrying."""
+        message_id = send(client, to="reject@example.com")["id"]
+
+        wait_until(lambda: outbox_status(client, message_id)["status"] == "failed")
+        status_data = outbox_status(client, message_id)
+        assert status_data["attempts"] == 1
+        assert "No such user" in status_data["last_error"]
+        assert status_data["next_attempt_at"] is None
+        assert smtp.messages == []
+
+    def test_gives_up_after_max_attempts(self, client, smtp):
+        """Test an email failing every time is marked failed after max_attempts."""
+        email_routes.mail_outbox.max_attempts = 3
+        smtp.fail_data = 100
+
+        message_id = send(client)["id"]
+
+        wait_until(lambda: outbox_status(client, message_id)["status"] == "failed")
+        assert outbox_status(client, message_id)["attempts"] == 3
+
+    def test_login_failure_holds_the_queue(self, smtp):
+        """Test a refused login costs the batch one attempt, the rest waits for the retry."""
+        with get_session() as session:
+            for i in range(3):
+                session.add(OutboxMessage(
+                    sender=smtp.user, to="alice@example.com", subject=f"Message {i}", body="Bonjour",
+                    message_id=f"<{i}@proton.me>",
+                ))
+        worker = email_routes.mail_outbox
+        smtp.password = "changed"
+
+        assert worker.drain() == 0
+        rows = [worker.get(i) for i in (1, 2, 3)]
+        assert [(row.status, row.attempts) for row in rows] == [("queued", 1), ("queued", 0), ("queued", 0)]
+        assert rows[0].last_error is not None
+
+        smtp.password = "secret"
+        time.sleep(0.1)
+
+        assert worker.drain() == 3
+        assert smtp.logins == 1
+
+    def test_idle_session_logged_out(self, client, smtp):
+        """Test the SMTP session is closed once the outbox has been idle for idle_timeout."""
+        email_routes.mail_outbox.idle_timeout = 0.1
+
+        send(client)
+
+        wait_until(lambda: smtp.quits == 1)
+        assert len(smtp.messages) == 1
+
+    def test_resume_after_restart(self, smtp):
+        """Test emails a previous run stopped while sending are sent on startup."""
+        with get_session() as session:
+            session.add(OutboxMessage(
+                sender=smtp.user, to="alice@example.com", subject="Hello", body="Bonjour",
+                message_id="<1@proton.me>", status="sending",
+            ))
+
+        email_routes.mail_outbox.resume()
+
+        wait_until(lambda: len(smtp.messages) == 1)
+
+    def test_unknown_id(self, client):
+        """Test looking up an id that was never queued is a 404."""
+        assert client.get("/email/proton/outbox/999").status_code == 404
+
+    def test_not_configured(self, client, monkeypatch):
+        """Test sending without SMTP credentials is refused up front."""
+        monkeypatch.delenv("PROTON_BRIDGE_SMTP_USER", raising=False)
+
+        assert send(client) == {"success": False, "error": "Incomplete SMTP configuration"}
+
+
+def wait_until(condition, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def watcher(bridge, monkeypatch):
+    """The routes' IDLE watcher, on a fake Bridge that supports IDLE."""
+    bridge.capabilities.append("IDLE")
+    monkeypatch.setattr(mail_watcher, "READ_POLL", 0.05)
+    monkeypatch.setattr(mail_watcher, "RETRY_DELAY", 0.05)
+    watcher = mail_watcher.MailWatcher(email_routes._login, email_routes.mail_cache, poll_interval=0.05)
+    monkeypatch.setattr(email_routes, "mail_watcher", watcher)
+    yield watcher
+    watcher.stop()
+
+
+async def next_event(queue):
+    return await asyncio.wait_for(queue.get(), 5)
+
+
+class TestMailWatcher:
+    """Tests for pushing mailbox changes from a single IDLE connection."""
+
+    def test_new_message_pushed_to_every_subscriber(self, bridge, watcher):
+        """Test a message arriving during IDLE reaches all subscribers over one connection."""
+        bridge.add("Old", seen=True)
+
+        async def scenario():
+            queues = [watcher.subscribe(), watcher.subscribe()]
+            for queue in queues:
+                assert await next_event(queue) == ("unread", 0)
+            await asyncio.to_thread(wait_until, lambda: bridge.idling)
+
+            await asyncio.to_thread(bridge.add, "Exam schedule")
+
+            for queue in queues:
+                name, row = await next_event(queue)
+                assert (name, row.subject) == ("message", "Exam schedule")
+                assert await next_event(queue) == ("unread", 1)
+
+        asyncio.run(scenario())
+        # The watcher goes back to IDLE after publishing
+        wait_until(lambda: bridge.count("IDLE") == 2)
+
+    def test_flag_change_pushed(self, bridge, watcher):
+        """Test a message read in another client updates the unread count."""
+        uid = bridge.add("Exam schedule")
+
+        async def scenario():
+            queue = watcher.subscribe()
+            assert await next_event(queue) == ("unread", 1)
+            await asyncio.to_thread(wait_until, lambda: bridge.idling)
+
+            await asyncio.to_thread(bridge.set_seen, uid)
+
+            assert await next_event(queue) == ("unread", 0)
+
+        asyncio.run(scenario())
+
+    def test_expunge_pushed(self, bridge, watcher):
+        """Test deleting an unread message updates the unread count."""
+        uid = bridge.add("Exam schedule")
+
+        async def scenario():
+            queue = watcher.subscribe()
+            assert await next_event(queue) == ("unread", 1)
+            await asyncio.to_thread(wait_until, lambda: bridge.idling)
+
+            await asyncio.to_thread(bridge.expunge, uid)
+
+            assert await next_event(queue) == ("unread", 0)
+
+        asyncio.run(scenario())
+
+    def test_polls_without_idle(self, bridge, watcher):
+        """Test servers without IDLE are polled instead."""
+        bridge.capabilities.remove("IDLE")
+
+        async def scenario():
+            queue = watcher.subscribe()
+            assert await next_event(queue) == ("unread", 0)
+
+            await asyncio.to_thread(bridge.add, "Exam schedule")
+
+            assert (await next_event(queue))[0] == "message"
+            assert await next_event(queue) == ("unread", 1)
+
+        asyncio.run(scenario())
+        assert bridge.count("IDLE") == 0
+
+    def test_reconnects_after_bridge_restart(self, bridge, watcher):
+        """Test the watcher logs in again when its connection drops."""
+        async def scenario():
+            queue = watcher.subscribe()
+            assert await next_event(queue) == ("unread", 0)
+            await asyncio.to_thread(wait_until, lambda: bridge.idling)
+
+            bridge.drop_connections()
+            await asyncio.to_thread(wait_until, lambda: bridge.idling)
+            await asyncio.to_thread(bridge.add, "Exam schedule")
+
+            assert (await next_event(queue))[0] == "message"
+
+        asyncio.run(scenario())
+
+    def test_stop_ends_streams(self, watcher):
+        """Test subscribers get None once the watcher stops."""
+        async def scenario():
+            queue = watcher.subscribe()
+            await next_event(queue)
+            await asyncio.to_thread(watcher.stop)
+            assert await next_event(queue) is None
+
+        asyncio.run(scenario())
+        assert not watcher.running
+
+    def test_event_stream(self, client, bridge, watcher):
+        """Test /email/events sends the unread count and new messages as SSE."""
+        def mail_arrives():
+            wait_until(lambda: bridge.idling)
+            bridge.add("Exam schedule", sender="prof@example.com")
+            wait_until(lambda: watcher.unread == 1)
+            watcher.stop()
+
+        thread = threading.Thread(target=mail_arrives)
+        thread.start()
+        response = client.get("/email/events")
+        thread.join()
+
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = [block.split("\n") for block in response.text.strip().split("\n\n")]
+        assert events[0] == ["event: unread", 'data: {"count": 0}']
+        assert events[1][0] == "event: message"
+        message = json.loads(events[1][1].removeprefix("data: "))
+        assert (message["subject"], message["sender"], message["unread"]) == ("Exam schedule", "prof@example.com", True)
+        assert events[2] == ["event: unread", 'data: {"count": 1}']
+
+
+PAYLOAD = random.Random(0).randbytes(300_000)
+
+
+@pytest.fixture
+def attachment_uid(bridge, monkeypatch):
+    """A message with a base64 PDF attachment, read in small partial fetches."""
+    monkeypatch.setattr(mail_attachments, "CHUNK_SIZE", 64 * 1024)
+    return bridge.add("Notes", raw=make_message("Notes", "Voir la pièce jointe", attachment=PAYLOAD))
+
+
+class TestAttachmentDownload:
+    """Tests for streaming a single MIME part."""
+
+    def test_full_download(self, client, bridge, attachment_uid):
+        """Test the decoded part is streamed in bounded partial fetches."""
+        response = client.get(f"/email/proton/message/{attachment_uid}/attachments/2")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.content == PAYLOAD
+        assert response.headers["content-type"] == "application/pdf"
+        assert response.headers["content-length"] == str(len(PAYLOAD))
+        assert response.headers["content-disposition"] == "attachment; filename*=UTF-8''notes.pdf"
+        assert response.headers["accept-ranges"] == "bytes"
+        fetches = [args for name, args in bridge.commands if name == "UID FETCH"]
+        assert "RFC822" not in " ".join(fetches)
+        assert sum(f".{64 * 1024}>" in args for args in fetches) > 5
+
+    @pytest.mark.parametrize("header,start,end", [
+        ("bytes=1000-1999", 1000, 1999),
+        ("bytes=123457-", 123457, len(PAYLOAD) - 1),
+        ("bytes=-10", len(PAYLOAD) - 10, len(PAYLOAD) - 1),
+        ("bytes=299990-400000", 299990, len(PAYLOAD) - 1),
+    ])
+    def test_range(self, client, attachment_uid, header, start, end):
+        """Test a byte range of the decoded part is served from the matching encoded lines."""
+        response = client.get(
+            f"/email/proton/message/{attachment_uid}/attachments/2", headers={"Range": header},
+        )
+
+        assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+        assert response.content == PAYLOAD[start:end + 1]
+        assert response.headers["content-range"] == f"bytes {start}-{end}/{len(PAYLOAD)}"
+        assert response.headers["content-length"] == str(end - start + 1)
+
+    def test_range_skips_earlier_lines(self, client, bridge, attachment_uid):
+        """Test a range near the end doesn't download the start of the part."""
+        client.get(f"/email/proton/message/{attachment_uid}/attachments/2", headers={"Range": "bytes=290000-"})
+
+        offsets = [int(args.split("<")[1].split(".")[0]) for name, args in bridge.commands
+                   if name == "UID FETCH" and "BODY.PEEK[2]<" in args]
+        assert min(offsets[2:]) > 380_000
+
+    def test_unsatisfiable_range(self, client, attachment_uid):
+        """Test a range past the end is refused with the part size."""
+        response = client.get(
+            f"/email/proton/message/{attachment_uid}/attachments/2", headers={"Range": "bytes=400000-"},
+        )
+
+        assert response.status_code == status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+        assert response.headers["content-range"] == f"bytes */{len(PAYLOAD)}"
+
+    def test_quoted_printable_not_seekable(self, client, bridge):
+        """Test a quoted-printable part ignores Range and is streamed whole."""
+        message = EmailMessage()
+        message["Subject"] = "Compte rendu"
+        message.set_content("Voir la pièce jointe")
+        text = "Compte rendu de la réunion, à relire.\n" * 5000
+        message.add_attachment(text, filename="cr.txt", cte="quoted-printable")
+        uid = bridge.add("Compte rendu", raw=message.as_bytes(policy=SMTP))
+
+        response = client.get(f"/email/proton/message/{uid}/attachments/2", headers={"Range": "bytes=0-9"})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["accept-ranges"] == "none"
+        assert response.content.decode().replace("\r\n", "\n") == text
+
+    def test_unknown_part(self, client, attachment_uid):
+        """Test a missing part or message is a 404."""
+        assert client.get(f"/email/proton/message/{attachment_uid}/attachments/7").status_code == 404
+        assert client.get("/email/proton/message/999/attachments/2").status_code == 404
+        assert client.get(f"/email/proton/message/{attachment_uid}/attachments/x").status_code == 404
+
+
+class TestStreamingDecoders:
+    """Tests for the incremental transfer decoders."""
+
+    def test_base64_in_uneven_pieces(self):
+        """Test base64 split anywhere, even inside a line break, decodes whole."""
+        encoded = base64.encodebytes(PAYLOAD[:5000]).replace(b"\n", b"\r\n")
+        decoder = mail_attachments.Base64Decoder()
+
+        decoded = b"".join(decoder.feed(encoded[i:i + 7]) for i in range(0, len(encoded), 7)) + decoder.flush()
+
+        assert decoded == PAYLOAD[:5000]
+
+    def test_quoted_printable_in_uneven_pieces(self):
+        """Test soft line breaks and escapes cut between pieces decode whole."""
+        text = ("é" * 200 + "\n") * 20
+        encoded = quopri.encodestring(text.encode())
+        decoder = mail_attachments.QuotedPrintableDecoder()
+
+        decoded = b"".join(decoder.feed(encoded[i:i + 5]) for i in range(0, len(encoded), 5)) + decoder.flush()
+
+        assert decoded.decode() == text
+
+    def test_parse_range(self):
+        """Test single ranges are clamped, others ignored or refused."""
+        assert mail_attachments.parse_range("bytes=0-", 10) == (0, 9)
+        assert mail_attachments.parse_range("bytes=5-50", 10) == (5, 9)
+        assert mail_attachments.parse_range("bytes=-50", 10) == (0, 9)
+        assert mail_attachments.parse_range("bytes=0-1,4-5", 10) is None
+        assert mail_attachments.parse_range("bytes=5-1", 10) is None
+        with pytest.raises(ValueError):
+            mail_attachments.parse_range("bytes=10-", 10)
+
+
+class TestMailCache:
+    """Tests for the incremental sync of the local header cache."""
+
+    @staticmethod
+    def fetches(bridge):
+        return [args for name, args in bridge.commands if name == "UID FETCH"]
+
+    def test_only_new_uids_fetched(self, bridge, cache):
+        """Test a sync asks for the headers above the last cached UID only."""
+        bridge.add("First")
+        bridge.add("Second")
+        cache.sync()
+        bridge.add("Third")
+
+        cache.sync()
+
+        assert self.fetches(bridge)[-2].startswith("3:* ")
+        assert cache.page(cache.folder(), 0, 10)[0] == 3
+
+    def test_nothing_new(self, bridge, cache):
+        """Test no headers are fetched when UIDNEXT shows no new message."""
+        bridge.add("First")
+        cache.sync()
+        bridge.commands.clear()
+
+        cache.sync()
+
+        assert not any("HEADER.FIELDS" in args for args in self.fetches(bridge))
+
+    def test_first_sync_in_batches(self, bridge, cache, monkeypatch):
+        """Test a large mailbox is fetched in UID ranges."""
+        monkeypatch.setattr("mail_cache.SYNC_BATCH", 2)
+        for i in range(5):
+            bridge.add(f"Message {i}")
+
+        cache.sync()
+
+        assert [args.split()[0] for args in self.fetches(bridge)] == ["1:2", "3:4", "5:*"]
+        assert cache.page(cache.folder(), 0, 10)[0] == 5
+
+    def test_flags_and_expunges_without_condstore(self, bridge, cache):
+        """Test read flags and expunges are picked up from a FLAGS fetch."""
+        first = bridge.add("First")
+        second = bridge.add("Second")
+        bridge.add("Third")
+        cache.sync()
+        bridge.set_seen(first)
+        bridge.expunge(second)
+
+        folder = cache.sync()
+
+        count, latest = cache.unread(folder, limit=5)
+        assert count == 1
+        assert [row.subject for row in latest] == ["Third"]
+        assert cache.page(folder, 0, 10)[0] == 2
+
+    def test_condstore(self, bridge, cache):
+        """Test only flags changed since HIGHESTMODSEQ are fetched when the server supports it."""
+        bridge.capabilities += ["ENABLE", "CONDSTORE"]
+        uids = [bridge.add(f"Message {i}") for i in range(3)]
+        cache.sync()
+        bridge.commands.clear()
+
+        cache.sync()
+        assert self.fetches(bridge) == []
+
+        bridge.set_seen(uids[1])
+        bridge.expunge(uids[2])
+        folder = cache.sync()
+
+        assert self.fetches(bridge) == ["1:3 (UID FLAGS) (CHANGEDSINCE 4)"]
+        assert bridge.count("UID SEARCH") == 1
+        count, latest = cache.unread(folder, limit=5)
+        assert [row.subject for row in latest] == ["Message 0"]
+        assert folder.highestmodseq == 6
+
+    def test_uidvalidity_change(self, bridge, cache):
+        """Test cached rows are dropped when the server renumbers the mailbox."""
+        bridge.add("First")
+        gone = bridge.add("Second")
+        cache.sync()
+        bridge.expunge(gone)
+        bridge.reset_uids()
+        bridge.add("Third")
+
+        folder = cache.sync()
+
+        assert folder.uidvalidity == 2
+        _, rows = cache.page(folder, 0, 10)
+        assert [(row.uid, row.subject) for row in rows] == [(2, "Third"), (1, "First")]
+
+    def test_sync_interval(self, bridge, cache):
+        """Test listings are served from the cache between syncs."""
+        bridge.add("First")
+        cache.sync_interval = 60
+        cache.sync()
+        commands = len(bridge.commands)
+
+        cache.sync()
+
+        assert len(bridge.commands) == commands
+
+    def test_stale_listing_when_bridge_down(self, bridge, cache):
+        """Test the last synced listing is served when the Bridge can't be reached."""
+        bridge.add("First")
+        cache.sync()
+        cache.pool.check_after = 0
+        bridge.password = "changed"
+        bridge.drop_connections()
+
+        folder = cache.sync()
+
+        assert cache.unread(folder, limit=5)[0] == 1
+
+
+class TestMailThreads:
+    """Tests for the conversation index built during syncs."""
+
+    @staticmethod
+    def conversation(bridge):
+        """A question, an unrelated message and the reply, an hour apart."""
+        start = datetime(2025, 3, 7, 9, 0, tzinfo=timezone.utc)
+        bridge.add("Question", message_id="<q@example.com>", seen=True, date=start)
+        bridge.add("Unrelated", message_id="<u@example.com>", date=start + timedelta(hours=1))
+        bridge.add("Re: Question", message_id="<r@example.com>", in_reply_to="<q@example.com>",
+                   references="<q@example.com>", date=start + timedelta(hours=2))
+
+    def test_replies_grouped_locally(self, client, bridge):
+        """Test replies join their parent's thread and threads are listed by latest message."""
+        self.conversation(bridge)
+
+        data = client.get("/email/proton/threads").json()
+
+        assert data["total_count"] == 2
+        first, second = data["threads"]
+        assert (first["subject"], first["message_count"], first["unread_count"]) == ("Question", 2, 1)
+        assert (first["latest_id"], second["subject"]) == ("3", "Unrelated")
+        assert bridge.count("UID THREAD") == 0
+
+    def test_thread_messages(self, client, bridge):
+        """Test a thread lists its messages oldest first."""
+        self.conversation(bridge)
+        thread_id = client.get("/email/proton/threads").json()["threads"][0]["id"]
+
+        data = client.get(f"/email/proton/threads/{thread_id}").json()
+
+        assert [e["id"] for e in data["emails"]] == ["1", "3"]
+        assert client.get("/email/proton/threads/999").status_code == status.HTTP_404_NOT_FOUND
+
+    def test_reply_before_parent_merges_threads(self, bridge, cache):
+        """Test threads started by replies are merged once a message links them."""
+        bridge.add("Re: Plan", message_id="<b@example.com>", references="<a@example.com>")
+        bridge.add("Re: Plan (2)", message_id="<c@example.com>", in_reply_to="<x@example.com>")
+        folder = cache.sync()
+        assert mail_threads.page_threads(folder, 0, 10)[0] == 2
+
+        bridge.add("Re: Re: Plan", message_id="<d@example.com>", references="<a@example.com> <x@example.com>")
+        folder = cache.sync()
+
+        total, threads = mail_threads.page_threads(folder, 0, 10)
+        assert total == 1
+        assert threads[0][0].message_count == 3
+        with get_session() as session:
+            refs = session.exec(select(MailThreadRef.thread_id).where(MailThreadRef.folder_id == folder.id)).all()
+        assert set(refs) == {threads[0][0].id}
+
+    def test_server_threading(self, bridge, cache):
+        """Test THREAD=REFERENCES groups messages on the server when supported."""
+        bridge.capabilities += ["THREAD=REFERENCES"]
+        self.conversation(bridge)
+
+        folder = cache.sync()
+
+        assert bridge.count("UID THREAD") == 1
+        _, threads = mail_threads.page_threads(folder, 0, 10)
+        assert [(t.subject, t.message_count) for t, _ in threads] == [("Question", 2), ("Unrelated", 1)]
+        with get_session() as session:
+            assert session.exec(select(MailThreadRef)).first() is None
+
+        bridge.commands.clear()
+        cache.sync()
+        assert bridge.count("UID THREAD") == 0
+
+    def test_expunge_updates_thread(self, bridge, cache):
+        """Test a thread loses expunged messages and is dropped once empty."""
+        self.conversation(bridge)
+        cache.sync()
+        bridge.expunge(3)
+        bridge.expunge(2)
+
+        folder = cache.sync()
+
+        _, threads = mail_threads.page_threads(folder, 0, 10)
+        assert [(t.subject, t.message_count, t.latest_uid) for t, _ in threads] == [("Question", 1, 1)]
+
+    def test_backfill(self, bridge, cache):
+        """Test messages cached before threading get their headers fetched and are threaded."""
+        self.conversation(bridge)
+        folder = cache.sync()
+        with get_session() as session:
+            session.exec(update(MailHeader).values(message_id=None, parent_ids=None, thread_id=None))
+            session.exec(delete(MailThreadRef))
+            session.exec(delete(MailThread))
+        bridge.commands.clear()
+
+        cache.sync()
+
+        headers = [args.split()[0] for name, args in bridge.commands if name == "UID FETCH" and "HEADER.FIELDS" in args]
+        assert headers == ["1,2,3"]
+        total, threads = mail_threads.page_threads(folder, 0, 10)
+        assert (total, threads[0][0].message_count) == (2, 2)
@@ -0,0 +1,97 @@
+"""Unit tests for the streaming grade import."""
+
+import asyncio
+import json
+
+import pytest
+from fastapi import status
+
+import grade_import
+from grade_import import iter_lines
+
+STREAM_URL = "/hyperplanning/grades/import/stream"
+
+
+def events(response) -> list[dict]:
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def ndjson(*rows: dict) -> str:
+    return "".join(json.dumps(row) + "\n" for row in rows)
+
+
+class TestStreamImport:
+    """Tests for the NDJSON/CSV import endpoint."""
+
+    def test_ndjson_with_rejected_row(self, client):
+        """Test valid rows are imported and invalid ones reported with their line."""
+        body = ndjson(
+            {"subject": "Anglais", "date": "13 déc.", "value": 15.5},
+            {"subject": "Réseaux", "date": "18 déc.", "value": 25},
+        ) + "not json\n" + ndjson({"subject": "Maths", "date": "20 déc.", "value": 12})
+
+        response = client.post(STREAM_URL, content=body, headers={"Content-Type": "application/x-ndjson"})
+
+        assert response.status_code == status.HTTP_200_OK
+        progress, done = events(response)
+        assert [e["line"] for e in progress["errors"]] == [2, 3]
+        assert (done["event"], done["rows"], done["imported"], done["rejected"]) == ("done", 4, 2, 2)
+        assert len(client.get("/hyperplanning/grades").json()) == 2
+
+    def test_csv_semicolons_and_decimal_commas(self, client):
+        """Test French spreadsheet exports are accepted."""
+        body = "Subject;Date;Value\r\nAnglais;13 déc.;15,5\r\n\"Admin; réseau\";18 déc.;18\r\n"
+
+        response = client.post(STREAM_URL, content=body.encode(), headers={"Content-Type": "text/csv"})
+
+        assert events(response)[-1]["imported"] == 2
+        grades = {g["subject"]: g["value"] for g in client.get("/hyperplanning/grades").json()}
+        assert grades == {"Anglais": 15.5, "Admin; réseau": 18.0}
+
+    def test_chunked_replace(self, client, monkeypatch):
+        """Test grades are committed per chunk and replaced only once."""
+        client.post("/hyperplanning/grades/import", json={"grades": [{"subject": "Old", "date": "1", "value": 1}]})
+        monkeypatch.setattr(grade_import, "GRADE_CHUNK_SIZE", 2)
+
+        body = ndjson(*({"subject": f"S{i}", "date": "1", "value": i} for i in range(5)))
+        data = events(client.post(f"{STREAM_URL}?format=ndjson", content=body))
+
+        assert [e["imported"] for e in data] == [2, 4, 5]
+        assert data[-1]["deleted"] == 1
+        assert sorted(g["subject"] for g in client.get("/hyperplanning/grades").json()) == [f"S{i}" for i in range(5)]
+
+    def test_append_mode(self, client):
+        """Test append mode keeps the stored grades."""
+        client.post("/hyperplanning/grades/import", json={"grades": [{"subject": "Old", "date": "1", "value": 1}]})
+
+        client.post(f"{STREAM_URL}?mode=append", content=ndjson({"subject": "New", "date": "2", "value": 2}))
+
+        assert len(client.get("/hyperplanning/grades").json()) == 2
+
+    def test_bad_csv_header(self, client):
+        """Test a CSV without the expected columns fails without touching the stored grades."""
+        client.post("/hyperplanning/grades/import", json={"grades": [{"subject": "Old", "date": "1", "value": 1}]})
+
+        data = events(client.post(f"{STREAM_URL}?format=csv", content="matiere,note\nAnglais,12\n"))
+
+        assert data == [{"event": "failed", "rows": 0, "imported": 0, "rejected": 0,
+                         "error": "Missing CSV column(s): date, subject, value"}]
+        assert len(client.get("/hyperplanning/grades").json()) == 1
+
+
+class TestIterLines:
+    """Tests for splitting the request stream into lines."""
+
+    @pytest.mark.parametrize("size", [1, 3, 64])
+    def test_chunk_boundaries(self, size):
+        """Test lines and UTF-8 characters split across chunks are rebuilt."""
+        body = "﻿subject,date\r\nRéseaux,18 déc.\nlast".encode()
+
+        async def chunks():
+            for i in range(0, len(body), size):
+                yield body[i:i + size]
+
+        async def collect():
+            return [line async for line in iter_lines(chunks())]
+
+        assert asyncio.run(collect()) == ["subject,date", "Réseaux,18 déc.", "last"]
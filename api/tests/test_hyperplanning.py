@@ -0,0 +1,641 @@
+"""Unit tests for Hyperplanning API endpoints."""
+
+import asyncio
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+import requests
+from fastapi import status
+
+import calendar_cache as calendar_cache_module
+from calendar_cache import calendar_cache, refresh_periodically
+from config import get_settings
+from course_index import CourseIndex, sync_courses
+from grade_stats import grade_day, invalidate_grade_summary
+
+CALENDAR_URL = "https://school.hyperplanning.fr/calendar.ics"
+PARIS = pytz.timezone("Europe/Paris")
+
+
+def make_event(
+    uid: str, summary: str, start: datetime, hours: float = 2, room: str = "B204",
+    sequence: int = 0, last_modified: str = "20250101T080000Z",
+) -> str:
+    end = start + timedelta(hours=hours)
+    fmt = "%Y%m%dT%H%M%SZ"
+    return (
+        "BEGIN:VEVENT\r\n"
+        f"UID:{uid}\r\n"
+        f"SEQUENCE:{sequence}\r\n"
+        f"LAST-MODIFIED:{last_modified}\r\n"
+        f"SUMMARY:{summary}\r\n"
+        f"LOCATION:{room}\r\n"
+        "DESCRIPTION:Enseignant : M. Dupont\\nType : TD\r\n"
+        f"DTSTART:{start.astimezone(pytz.UTC).strftime(fmt)}\r\n"
+        f"DTEND:{end.astimezone(pytz.UTC).strftime(fmt)}\r\n"
+        "END:VEVENT\r\n"
+    )
+
+
+def make_calendar(*events: str) -> bytes:
+    body = "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//test//EN\r\n" + "".join(events) + "END:VCALENDAR\r\n"
+    return body.encode()
+
+
+def tomorrow_at(hour: int) -> datetime:
+    day = datetime.now(PARIS).date() + timedelta(days=1)
+    return PARIS.localize(datetime(day.year, day.month, day.day, hour))
+
+
+class FakeResponse:
+    def __init__(self, content: bytes = b"", status_code: int = 200, headers: dict | None = None):
+        self.content = content
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        return False
+
+    def iter_lines(self):
+        return iter(self.content.splitlines())
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error")
+
+
+class FakeUpstream:
+    """Stands in for the school's calendar server."""
+
+    def __init__(self, content: bytes):
+        self.content = content
+        self.etag = '"v1"'
+        self.down = False
+        self.requests: list[dict] = []
+
+    def get(self, _url, headers=None, **_kwargs):
+        self.requests.append(headers or {})
+        if self.down:
+            raise requests.ConnectionError("upstream down")
+        if (headers or {}).get("If-None-Match") == self.etag:
+            return FakeResponse(status_code=304)
+        return FakeResponse(self.content, headers={"ETag": self.etag})
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Serve a two-course calendar for tomorrow from a fake upstream."""
+    fake = FakeUpstream(make_calendar(
+        make_event("evt-2", "Anglais", tomorrow_at(14)),
+        make_event("evt-1", "Réseaux", tomorrow_at(9)),
+    ))
+    monkeypatch.setattr(calendar_cache_module.SESSION, "get", fake.get)
+    monkeypatch.setattr(get_settings(), "hyperplanning_url", CALENDAR_URL)
+    calendar_cache.clear()
+    yield fake
+    calendar_cache.clear()
+
+
+class TestCourses:
+    """Tests for the course endpoints."""
+
+    def test_courses_not_configured(self, client):
+        """Test the courses endpoint without a calendar URL."""
+        response = client.get("/hyperplanning/courses")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["courses"] == []
+
+    @pytest.mark.usefixtures("upstream")
+    def test_courses_first_day_with_courses(self, client):
+        """Test the next day with courses is returned, sorted by start."""
+        response = client.get("/hyperplanning/courses")
+
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert data["date"] == tomorrow_at(9).date().isoformat()
+        assert [c["subject"] for c in data["courses"]] == ["Réseaux", "Anglais"]
+        assert data["courses"][0]["teacher"] == "M. Dupont"
+        assert data["courses"][0]["type"] == "TD"
+
+    @pytest.mark.usefixtures("upstream")
+    def test_next_courses(self, client):
+        """Test upcoming courses are sorted by start time."""
+        data = client.get("/hyperplanning/next-courses").json()
+
+        assert [c["id"] for c in data] == ["evt-1", "evt-2"]
+
+    @pytest.mark.usefixtures("upstream")
+    def test_stats(self, client):
+        """Test planned hours are summed per subject."""
+        data = client.get("/hyperplanning/stats").json()
+
+        assert {s["subject"]: s["planned"] for s in data} == {"Réseaux": 2.0, "Anglais": 2.0}
+
+    @pytest.mark.usefixtures("upstream")
+    def test_stats_by_teacher_and_type(self, client):
+        """Test hours can be grouped by teacher or by course type."""
+        by_teacher = client.get("/hyperplanning/stats?by=teacher").json()
+        by_type = client.get("/hyperplanning/stats?by=type").json()
+
+        assert by_teacher == [{"teacher": "M. Dupont", "done": 0.0, "planned": 4.0, "total": 4.0}]
+        assert by_type == [{"type": "TD", "done": 0.0, "planned": 4.0, "total": 4.0}]
+        assert client.get("/hyperplanning/stats?by=room").status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+class TestStoredCourses:
+    """Tests for the Course table and date-range queries."""
+
+    def test_range_empty_before_fetch(self, client):
+        """Test range queries read the database only."""
+        response = client.get("/hyperplanning/courses?from=2025-01-01&to=2025-01-07")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json() == {"from": "2025-01-01", "to": "2025-01-07", "courses": []}
+
+    def test_range_after_fetch(self, client, upstream):
+        """Test downloaded courses are stored and returned by local date range."""
+        client.get("/hyperplanning/courses")
+        day = tomorrow_at(9).date()
+
+        data = client.get(f"/hyperplanning/courses?from={day}").json()
+
+        assert [c["id"] for c in data["courses"]] == ["evt-1", "evt-2"]
+        assert data["courses"][0]["raw_start"] == tomorrow_at(9).isoformat()
+        assert len(upstream.requests) == 1
+
+    @pytest.mark.usefixtures("upstream")
+    def test_range_subject_filter(self, client):
+        """Test the per-subject history filter."""
+        client.get("/hyperplanning/courses")
+        day = tomorrow_at(9).date()
+
+        data = client.get(f"/hyperplanning/courses?from={day - timedelta(days=30)}&to={day}&subject=Anglais").json()
+
+        assert [c["subject"] for c in data["courses"]] == ["Anglais"]
+
+    def test_removed_events_deleted(self, client, upstream, monkeypatch):
+        """Test events dropped from the feed are removed from the table."""
+        monkeypatch.setattr(calendar_cache, "ttl", 0)
+        client.get("/hyperplanning/courses")
+        upstream.content = make_calendar(make_event("evt-1", "Réseaux", tomorrow_at(10), sequence=1))
+        upstream.etag = '"v2"'
+        client.get("/hyperplanning/courses")
+
+        day = tomorrow_at(9).date()
+        data = client.get(f"/hyperplanning/courses?from={day}").json()
+
+        assert [(c["id"], c["start"]) for c in data["courses"]] == [("evt-1", "10:00")]
+
+    def test_range_validation(self, client):
+        """Test inverted and oversized ranges are rejected."""
+        assert client.get("/hyperplanning/courses?from=2025-02-01&to=2025-01-01").status_code == 400
+        assert client.get("/hyperplanning/courses?from=2024-01-01&to=2025-06-01").status_code == 400
+
+
+class TestCourseChanges:
+    """Tests for incremental calendar diffing and the change feed."""
+
+    def sync(self, *events: str) -> dict:
+        return sync_courses(CourseIndex.from_ical(make_calendar(*events)), feed=CALENDAR_URL)
+
+    def test_initial_import_not_logged(self, client):
+        """Test the first download fills the table without flooding the feed."""
+        assert self.sync(make_event("a", "Maths", tomorrow_at(9))) == {"added": 1, "updated": 0, "cancelled": 0}
+
+        assert client.get("/hyperplanning/changes").json() == []
+
+    def test_unchanged_events_skipped(self):
+        """Test events with the same SEQUENCE and LAST-MODIFIED are not rewritten."""
+        event = make_event("a", "Maths", tomorrow_at(9))
+        self.sync(event)
+
+        assert self.sync(event) == {"added": 0, "updated": 0, "cancelled": 0}
+
+    def test_room_change(self, client):
+        """Test a moved course is updated and reported with its changed fields."""
+        self.sync(make_event("a", "Maths", tomorrow_at(9)), make_event("b", "Anglais", tomorrow_at(14)))
+
+        counts = self.sync(
+            make_event("a", "Maths", tomorrow_at(9), room="C101", sequence=1, last_modified="20250102T080000Z"),
+            make_event("b", "Anglais", tomorrow_at(14)),
+        )
+
+        assert counts == {"added": 0, "updated": 1, "cancelled": 0}
+        changes = client.get("/hyperplanning/changes").json()
+        assert len(changes) == 1
+        assert changes[0]["kind"] == "updated"
+        assert changes[0]["changes"] == {"room": ["B204", "C101"]}
+        assert changes[0]["start"] == tomorrow_at(9).isoformat()
+
+    def test_added_and_cancelled(self, client):
+        """Test new and removed events are logged."""
+        self.sync(make_event("a", "Maths", tomorrow_at(9)))
+
+        self.sync(make_event("b", "Anglais", tomorrow_at(14)))
+
+        changes = client.get("/hyperplanning/changes").json()
+        assert [(c["uid"], c["kind"]) for c in changes] == [("b", "added"), ("a", "cancelled")]
+
+    def test_past_courses_kept(self, client):
+        """Test past courses that dropped out of the feed are not cancelled."""
+        past = datetime.now(PARIS) - timedelta(days=10)
+        self.sync(make_event("old", "Maths", past), make_event("a", "Maths", tomorrow_at(9)))
+
+        counts = self.sync(make_event("a", "Maths", tomorrow_at(9)))
+
+        assert counts["cancelled"] == 0
+        assert client.get("/hyperplanning/changes").json() == []
+        day = past.date()
+        assert [c["id"] for c in client.get(f"/hyperplanning/courses?from={day}").json()["courses"]] == ["old"]
+
+    def test_changes_since(self, client):
+        """Test the feed only returns changes detected after `since`."""
+        self.sync(make_event("a", "Maths", tomorrow_at(9)))
+        self.sync()
+
+        future = (datetime.now(PARIS) + timedelta(minutes=1)).isoformat()
+        response = client.get("/hyperplanning/changes", params={"since": future})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json() == []
+
+
+class TestCalendarCache:
+    """Tests for the shared calendar cache."""
+
+    def test_calendar_downloaded_once(self, client, upstream):
+        """Test several endpoints share one download."""
+        client.get("/hyperplanning/courses")
+        client.get("/hyperplanning/next-courses")
+        client.get("/hyperplanning/stats")
+
+        assert len(upstream.requests) == 1
+
+    def test_revalidates_with_etag(self, client, upstream, monkeypatch):
+        """Test an expired entry is revalidated with If-None-Match."""
+        monkeypatch.setattr(calendar_cache, "ttl", 0)
+
+        client.get("/hyperplanning/courses")
+        response = client.get("/hyperplanning/courses")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.json()["courses"]) == 2
+        assert upstream.requests[1]["If-None-Match"] == '"v1"'
+
+    def test_serves_stale_when_upstream_down(self, client, upstream, monkeypatch):
+        """Test the last good copy is served when the upstream fails."""
+        monkeypatch.setattr(calendar_cache, "ttl", 0)
+        client.get("/hyperplanning/courses")
+        upstream.down = True
+
+        response = client.get("/hyperplanning/courses")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.json()["courses"]) == 2
+        assert client.get("/hyperplanning/status").json()["last_error"] == "upstream down"
+
+    def test_non_calendar_body_keeps_last_copy(self, client, upstream, monkeypatch):
+        """Test a 200 that isn't a calendar is an upstream error, not an empty calendar."""
+        monkeypatch.setattr(calendar_cache, "ttl", 0)
+        client.get("/hyperplanning/courses")
+        upstream.content = b"<html><body>Maintenance en cours</body></html>"
+        upstream.etag = '"maintenance"'
+
+        response = client.get("/hyperplanning/courses")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.json()["courses"]) == 2
+        assert "BEGIN:VCALENDAR" in client.get("/hyperplanning/status").json()["last_error"]
+        assert client.get("/hyperplanning/changes").json() == []
+        day = tomorrow_at(9).date()
+        stored = client.get(f"/hyperplanning/courses?from={day}&to={day}").json()["courses"]
+        assert [c["id"] for c in stored] == ["evt-1", "evt-2"]
+
+    def test_upstream_down_without_copy(self, client, upstream):
+        """Test a failure without any cached copy is reported."""
+        upstream.down = True
+
+        response = client.get("/hyperplanning/courses")
+
+        assert response.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR
+
+    def test_stale_while_revalidate(self, client, upstream, monkeypatch):
+        """Test expired entries are served without fetching while the refresher runs."""
+        monkeypatch.setattr(calendar_cache, "ttl", 0)
+        client.get("/hyperplanning/courses")
+        monkeypatch.setattr(calendar_cache, "background_refresh", True)
+
+        response = client.get("/hyperplanning/courses")
+
+        assert len(response.json()["courses"]) == 2
+        assert len(upstream.requests) == 1
+
+    def test_background_refresher(self, upstream, monkeypatch):
+        """Test the refresher warms the cache and backs off after a failure."""
+        delays = []
+
+        async def fake_sleep(delay):
+            delays.append(delay)
+            upstream.down = True
+            if len(delays) == 2:
+                raise asyncio.CancelledError
+
+        monkeypatch.setattr(calendar_cache_module.asyncio, "sleep", fake_sleep)
+
+        with pytest.raises(asyncio.CancelledError):
+            asyncio.run(refresh_periodically([CALENDAR_URL]))
+
+        assert calendar_cache.status(CALENDAR_URL)["cached"] is True
+        assert calendar_cache.status(CALENDAR_URL)["last_error"] == "upstream down"
+        assert delays[0] >= calendar_cache.ttl * 0.9
+        assert delays[1] <= calendar_cache_module.REFRESH_BACKOFF_BASE
+        assert calendar_cache.background_refresh is False
+
+    @pytest.mark.usefixtures("upstream")
+    def test_status(self, client):
+        """Test the status endpoint reports the cached calendar."""
+        assert client.get("/hyperplanning/status").json()["cached"] is False
+
+        client.get("/hyperplanning/courses")
+        data = client.get("/hyperplanning/status").json()
+
+        assert data["configured"] is True
+        assert data["cached"] is True
+        assert data["etag"] == '"v1"'
+        assert data["parse_time_ms"] >= 0
+
+
+class TestMultipleCalendars:
+    """Tests for merging several calendar feeds."""
+
+    GROUP_URL = "https://school.hyperplanning.fr/group.ics"
+
+    @pytest.fixture
+    def feeds(self, upstream, monkeypatch):
+        group = FakeUpstream(make_calendar(
+            make_event("evt-1", "Réseaux", tomorrow_at(9)),  # also in the personal feed
+            make_event("grp-1", "Projet", tomorrow_at(11)),
+        ))
+        feeds = {CALENDAR_URL: upstream, self.GROUP_URL: group}
+        monkeypatch.setattr(calendar_cache_module.SESSION, "get", lambda url, **kw: feeds[url].get(url, **kw))
+        monkeypatch.setattr(get_settings(), "hyperplanning_urls", [self.GROUP_URL])
+        return feeds
+
+    def test_courses_merged(self, client, feeds):
+        """Test courses from every feed are merged by start, once per uid."""
+        data = client.get("/hyperplanning/courses").json()
+
+        assert [c["id"] for c in data["courses"]] == ["evt-1", "grp-1", "evt-2"]
+        assert data["errors"] == []
+        assert all(len(feed.requests) == 1 for feed in feeds.values())
+
+    def test_partial_results(self, client, feeds):
+        """Test a failing feed is reported while the others are served."""
+        feeds[self.GROUP_URL].down = True
+
+        response = client.get("/hyperplanning/courses")
+
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert [c["id"] for c in data["courses"]] == ["evt-1", "evt-2"]
+        assert data["errors"] == [{"feed": 1, "host": "school.hyperplanning.fr", "error": "upstream down"}]
+
+    def test_slow_feed_times_out(self, client, feeds, monkeypatch):
+        """Test a feed that does not answer in time does not hold the others."""
+        release = threading.Event()
+        group = feeds[self.GROUP_URL]
+
+        def hang(url, **kwargs):
+            release.wait(5)
+            group.down = True
+            return FakeUpstream.get(group, url, **kwargs)
+
+        monkeypatch.setattr(group, "get", hang)
+        monkeypatch.setattr(get_settings(), "api_timeout", 0.2)
+        try:
+            data = client.get("/hyperplanning/next-courses").json()
+        finally:
+            release.set()
+
+        assert [c["id"] for c in data] == ["evt-1", "evt-2"]
+
+    @pytest.mark.usefixtures("feeds")
+    def test_unauthorized_feed_reported(self, client, monkeypatch):
+        """Test an URL outside the allowed domains is skipped and reported."""
+        monkeypatch.setattr(get_settings(), "hyperplanning_urls", ["https://evil.example.com/cal.ics"])
+
+        data = client.get("/hyperplanning/courses").json()
+
+        assert len(data["courses"]) == 2
+        assert data["errors"][0]["error"] == "Calendar URL is not authorized"
+
+    def test_recurrences_kept_when_merged(self):
+        """Test events sharing a uid within one feed all survive the merge, copies from another feed don't."""
+        day_after = tomorrow_at(9) + timedelta(days=1)
+        personal = CourseIndex.from_ical(make_calendar(
+            make_event("maths", "Maths", tomorrow_at(9)),
+            make_event("maths", "Maths", day_after),  # next occurrence, same uid
+        ))
+        group = CourseIndex.from_ical(make_calendar(
+            make_event("maths", "Maths", tomorrow_at(9)),  # also in the personal feed
+            make_event("projet", "Projet", tomorrow_at(11)),
+            make_event("projet", "Projet", day_after + timedelta(hours=2)),
+        ))
+
+        merged = CourseIndex.merge([personal, group])
+
+        assert [(e.uid, e.start) for e in merged.events] == [
+            ("maths", tomorrow_at(9)),
+            ("projet", tomorrow_at(11)),
+            ("maths", day_after),
+            ("projet", day_after + timedelta(hours=2)),
+        ]
+
+    def test_feeds_stored_separately(self):
+        """Test syncing one feed does not cancel the courses of another."""
+        sync_courses(CourseIndex.from_ical(make_calendar(make_event("a", "Maths", tomorrow_at(9)))), feed=CALENDAR_URL)
+
+        counts = sync_courses(
+            CourseIndex.from_ical(make_calendar(
+                make_event("a", "Maths", tomorrow_at(9)),
+                make_event("b", "Projet", tomorrow_at(11)),
+            )),
+            feed=self.GROUP_URL,
+        )
+
+        assert counts == {"added": 1, "updated": 0, "cancelled": 0}
+        assert sync_courses(CourseIndex.from_ical(make_calendar()), feed=self.GROUP_URL)["cancelled"] == 1
+
+
+class TestCourseIndex:
+    """Tests for the pre-parsed course index."""
+
+    def make_index(self) -> CourseIndex:
+        day = PARIS.localize(datetime(2025, 3, 10, 8))
+        return CourseIndex.from_ical(make_calendar(
+            make_event("c", "Maths", day + timedelta(days=2, hours=1)),
+            make_event("a", "Maths", day),
+            make_event("b", "Anglais", day + timedelta(hours=3)),
+            # 23:30 UTC on the 11th is already the 12th in Paris
+            make_event("late", "Veille", pytz.UTC.localize(datetime(2025, 3, 11, 23, 30)), hours=1),
+        ))
+
+    def test_events_sorted_by_start(self):
+        """Test events are sorted by start time once at build."""
+        assert [e.uid for e in self.make_index().events] == ["a", "b", "late", "c"]
+
+    def test_courses_on_local_date(self):
+        """Test courses are grouped by their local date."""
+        index = self.make_index()
+
+        assert [e.uid for e in index.courses_on(datetime(2025, 3, 10).date())] == ["a", "b"]
+        assert [e.uid for e in index.courses_on(datetime(2025, 3, 12).date())] == ["late", "c"]
+        assert index.courses_on(datetime(2025, 3, 11).date()) == []
+
+    def test_first_day_with_courses(self):
+        """Test the first day with courses is searched within the window."""
+        index = self.make_index()
+
+        assert index.first_day_with_courses(datetime(2025, 3, 11).date(), days=8) == datetime(2025, 3, 12).date()
+        assert index.first_day_with_courses(datetime(2025, 3, 13).date(), days=8) is None
+
+    def test_upcoming(self):
+        """Test the next courses strictly after a moment."""
+        index = self.make_index()
+        after = PARIS.localize(datetime(2025, 3, 10, 8))
+
+        assert [e.uid for e in index.upcoming(after, limit=2)] == ["b", "late"]
+
+    def test_hour_totals_advance(self):
+        """Test finished courses move from planned to done as time passes."""
+        hours = self.make_index().hours
+        day = PARIS.localize(datetime(2025, 3, 10, 8))
+
+        def maths(now):
+            return next(s for s in hours.breakdown("subject", now=now) if s["subject"] == "Maths")
+
+        assert maths(day) == {"subject": "Maths", "done": 0.0, "planned": 4.0, "total": 4.0}
+
+        # "a" (Maths) ends at 10:00, "b" (Anglais) at 13:00
+        hours.advance(day + timedelta(hours=4))
+        assert maths(day + timedelta(hours=4)) == {"subject": "Maths", "done": 2.0, "planned": 2.0, "total": 4.0}
+
+        by_subject = {s["subject"]: s for s in hours.breakdown("subject", now=day + timedelta(hours=6))}
+        assert by_subject["Maths"]["done"] == 2.0
+        assert by_subject["Anglais"] == {"subject": "Anglais", "done": 2.0, "planned": 0.0, "total": 2.0}
+
+    def test_all_day_event(self):
+        """Test all-day events are localized at midnight."""
+        index = CourseIndex.from_ical(make_calendar(
+            "BEGIN:VEVENT\r\nUID:holiday\r\nSUMMARY:Férié\r\n"
+            "DTSTART;VALUE=DATE:20250501\r\nDTEND;VALUE=DATE:20250502\r\nEND:VEVENT\r\n"
+        ))
+
+        course = index.events[0].to_dict()
+        assert course["start"] == "Toute la journée"
+        assert course["raw_start"] == "2025-05-01T00:00:00+02:00"
+
+
+class TestGrades:
+    """Tests for the grade import endpoints."""
+
+    GRADES = [
+        {"subject": "Anglais", "date": "13 déc.", "value": 15.5},
+        {"subject": "Réseaux", "date": "18 déc.", "value": 18.39},
+        {"subject": "Réseaux", "date": "18 déc.", "value": 18.39},
+    ]
+
+    @pytest.fixture(autouse=True)
+    def clear_summary_cache(self):
+        invalidate_grade_summary()
+        yield
+        invalidate_grade_summary()
+
+    def import_grades(self, client, grades, mode="replace"):
+        return client.post(f"/hyperplanning/grades/import?mode={mode}", json={"grades": grades})
+
+    def test_import_replaces(self, client):
+        """Test an import replaces every stored grade."""
+        self.import_grades(client, self.GRADES)
+
+        response = self.import_grades(client, self.GRADES[:1])
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["count"] == 1
+        assert response.json()["deleted"] == 3
+        assert [g["subject"] for g in client.get("/hyperplanning/grades").json()] == ["Anglais"]
+
+    def test_sync_only_touches_differences(self, client):
+        """Test sync mode keeps unchanged grades and their ids."""
+        self.import_grades(client, self.GRADES)
+        kept_id = next(g["id"] for g in client.get("/hyperplanning/grades").json() if g["subject"] == "Anglais")
+
+        new_grade = {"subject": "Maths", "date": "20 déc.", "value": 12.0}
+        data = self.import_grades(client, [self.GRADES[0], self.GRADES[1], new_grade], mode="sync").json()
+
+        assert (data["inserted"], data["deleted"], data["unchanged"]) == (1, 1, 2)
+        grades = client.get("/hyperplanning/grades").json()
+        assert sorted(g["subject"] for g in grades) == ["Anglais", "Maths", "Réseaux"]
+        assert kept_id in {g["id"] for g in grades}
+
+    def test_clear(self, client):
+        """Test clearing returns the number of deleted grades."""
+        self.import_grades(client, self.GRADES)
+
+        data = client.delete("/hyperplanning/grades/clear").json()
+
+        assert data["count"] == 3
+        assert client.get("/hyperplanning/grades").json() == []
+
+    def test_summary(self, client):
+        """Test per-subject aggregates and overall averages."""
+        self.import_grades(client, [*self.GRADES, {"subject": "Anglais", "date": "20 déc.", "value": 12.5}])
+
+        data = client.get("/hyperplanning/grades/summary").json()
+
+        assert data["count"] == 4
+        assert data["subjects"][0] == {"subject": "Anglais", "count": 2, "mean": 14.0, "min": 12.5, "max": 15.5}
+        assert data["overall_average"] == round((15.5 + 12.5 + 2 * 18.39) / 4, 2)
+        assert data["subject_average"] == round((14.0 + 18.39) / 2, 2)
+
+    def test_summary_trend(self, client):
+        """Test the rolling average follows grade dates, not import order."""
+        grades = [
+            {"subject": "Maths", "date": "2025-01-03", "value": 16},
+            {"subject": "Maths", "date": "2025-01-01", "value": 10},
+            {"subject": "Maths", "date": "2025-01-02", "value": 12},
+            {"subject": "Maths", "date": "bientôt", "value": 20},
+        ]
+        self.import_grades(client, grades)
+
+        trend = client.get("/hyperplanning/grades/summary?window=2").json()["trend"]
+
+        assert [p["average"] for p in trend["points"]] == [10.0, 11.0, 14.0]
+        assert trend["delta"] == 4.0
+        assert trend["undated"] == 1
+
+    def test_summary_invalidated(self, client):
+        """Test imports and clears refresh the cached summary."""
+        self.import_grades(client, self.GRADES[:1])
+        assert client.get("/hyperplanning/grades/summary").json()["count"] == 1
+
+        self.import_grades(client, self.GRADES)
+        assert client.get("/hyperplanning/grades/summary").json()["count"] == 3
+
+        client.delete("/hyperplanning/grades/clear")
+        assert client.get("/hyperplanning/grades/summary").json()["count"] == 0
+
+    def test_grade_day(self):
+        """Test the date formats found in grade exports."""
+        today = datetime(2026, 1, 15).date()
+
+        assert grade_day("13 déc.", today) == datetime(2025, 12, 13).date()
+        assert grade_day("8 janv.", today) == datetime(2026, 1, 8).date()
+        assert grade_day("13/12/2025", today) == datetime(2025, 12, 13).date()
+        assert grade_day("31 févr.", today) is None
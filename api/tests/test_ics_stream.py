@@ -0,0 +1,127 @@
+"""Unit tests for the streaming ICS reader."""
+
+import io
+from datetime import date, datetime
+
+import pytest
+import pytz
+import requests
+from icalendar import Calendar
+
+from ics_stream import iter_vevents, split_property, unfold
+
+PARIS = pytz.timezone("Europe/Paris")
+
+CALENDAR = (
+    b"BEGIN:VCALENDAR\r\n"
+    b"VERSION:2.0\r\n"
+    b"BEGIN:VTIMEZONE\r\nTZID:Europe/Paris\r\nEND:VTIMEZONE\r\n"
+    b"BEGIN:VEVENT\r\n"
+    b"UID:evt-1\r\n"
+    b"SEQUENCE:2\r\n"
+    b"SUMMARY:R\xc3\xa9seaux\\, TCP/IP\r\n"
+    b"LOCATION:B204\r\n"
+    b"DESCRIPTION:Enseignant : M. Dupont\\nType : T\r\n"
+    b" D\r\n"
+    b"DTSTART;TZID=Europe/Paris:20250310T080000\r\n"
+    b"DTEND;TZID=\"Europe/Paris\":20250310T100000\r\n"
+    b"LAST-MODIFIED:20250101T080000Z\r\n"
+    b"BEGIN:VALARM\r\nDESCRIPTION:Rappel\r\nEND:VALARM\r\n"
+    b"END:VEVENT\r\n"
+    b"BEGIN:VEVENT\r\n"
+    b"UID:holiday\r\n"
+    b"SUMMARY:F\xc3\xa9ri\xc3\xa9\r\n"
+    b"DTSTART;VALUE=DATE:20250501\r\n"
+    b"DTEND;VALUE=DATE:20250502\r\n"
+    b"END:VEVENT\r\n"
+    b"END:VCALENDAR\r\n"
+)
+
+
+class TestUnfold:
+    """Tests for line unfolding and property splitting."""
+
+    def test_continuation_lines_joined(self):
+        """Test folded lines are joined before decoding."""
+        # The fold splits a two-byte UTF-8 character
+        lines = [b"SUMMARY:R\xc3", b" \xa9seaux", b"UID:1"]
+
+        assert list(unfold(lines)) == ["SUMMARY:Réseaux", "UID:1"]
+
+    @pytest.mark.parametrize("chunk_size", [1, 7, 64, 1024])
+    def test_response_chunk_boundaries(self, chunk_size):
+        """Test folded lines survive iter_lines() splitting a CRLF across chunks."""
+        response = requests.Response()
+        response.raw = io.BytesIO(CALENDAR)
+
+        event, _ = iter_vevents(response.iter_lines(chunk_size=chunk_size))
+
+        assert event["description"] == "Enseignant : M. Dupont\nType : TD"
+
+    def test_quoted_params(self):
+        """Test a colon inside a quoted parameter is not the value separator."""
+        name, params, value = split_property('ATTENDEE;CN="Dupont: M.":mailto:a@b.fr')
+
+        assert name == "ATTENDEE"
+        assert params == {"CN": "Dupont: M."}
+        assert value == "mailto:a@b.fr"
+
+
+class TestIterVevents:
+    """Tests for the streamed VEVENT fields."""
+
+    def test_fields(self):
+        """Test text, dates and integers are decoded."""
+        event, holiday = iter_vevents(CALENDAR.splitlines())
+
+        assert event["uid"] == "evt-1"
+        assert event["sequence"] == 2
+        assert event["summary"] == "Réseaux, TCP/IP"
+        assert event["description"] == "Enseignant : M. Dupont\nType : TD"
+        assert event["dtstart"] == PARIS.localize(datetime(2025, 3, 10, 8))
+        assert event["last_modified"] == pytz.UTC.localize(datetime(2025, 1, 1, 8))
+        assert holiday["dtstart"] == date(2025, 5, 1)
+
+    def test_matches_icalendar(self):
+        """Test the streamed fields match what icalendar parses."""
+        streamed = list(iter_vevents(CALENDAR.splitlines()))
+        parsed = Calendar.from_ical(CALENDAR).walk("VEVENT")
+
+        assert len(streamed) == len(parsed)
+        for fields, component in zip(streamed, parsed, strict=True):
+            assert fields["uid"] == str(component.get("uid"))
+            assert fields["summary"] == str(component.get("summary"))
+            assert fields.get("description", "") == str(component.get("description", ""))
+            assert fields["dtstart"] == component.get("dtstart").dt
+            assert fields["dtend"] == component.get("dtend").dt
+
+    def test_nested_components_ignored(self):
+        """Test VALARM properties do not override the event's."""
+        event, _ = iter_vevents(CALENDAR.splitlines())
+
+        assert "Rappel" not in event["description"]
+
+    def test_floating_and_unknown_tzid(self):
+        """Test floating times stay naive and unknown TZIDs use the default zone."""
+        lines = [
+            b"BEGIN:VCALENDAR",
+            b"BEGIN:VEVENT",
+            b"DTSTART:20250310T080000",
+            b"DTEND;TZID=Romance Standard Time:20250310T100000",
+            b"END:VEVENT",
+            b"END:VCALENDAR",
+        ]
+        (event,) = iter_vevents(lines, default_tz=PARIS)
+
+        assert event["dtstart"] == datetime(2025, 3, 10, 8)
+        assert event["dtend"] == PARIS.localize(datetime(2025, 3, 10, 10))
+
+    @pytest.mark.parametrize("body", [
+        b"",
+        b"<html><body>Maintenance en cours</body></html>",
+        CALENDAR[:CALENDAR.index(b"BEGIN:VEVENT\r\nUID:holiday")],
+    ], ids=["empty", "html", "truncated"])
+    def test_not_a_whole_calendar(self, body):
+        """Test bodies that aren't a complete calendar raise instead of reading as no events."""
+        with pytest.raises(ValueError):
+            list(iter_vevents(body.splitlines()))
@@ -833,7 +833,7 @@ function app() {
         });
 
         if (result.success) {
-          this.showToast('Email envoyé avec succès !', 'success');
+          this.showToast('Email en cours d\'envoi', 'success');
           this.email.showCompose = false;
           this.email.compose = { to: '', subject: '', body: '' };
         } else {